@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+
+"""announcements.py
+
+The "nearly sold out" announcement, kept up to date as seats change.
+
+The conferences with 0 < seats available <= ANNOUNCEMENT_THRESHOLD are
+kept as a set in one Announcement entity, mirrored in memcache.  A
+registration that leaves a conference near the threshold checks the set
+and, only if the conference crossed it, updates the set in a transaction
+and re-renders the announcement.  The hourly cron rebuilds the set from
+a query, to correct anything that slipped through.  Reads go through a
+short per-instance cache in front of memcache.
+
+"""
+
+import time
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+from models import Announcement
+
+ANNOUNCEMENT_THRESHOLD = 5      # seats
+INSTANCE_CACHE_TIME = 10        # seconds
+MEMCACHE_ANNOUNCEMENTS_KEY = "RECENT_ANNOUNCEMENTS"
+MEMCACHE_NEARLY_SOLD_OUT_KEY = "NEARLY_SOLD_OUT"
+ANNOUNCEMENT_TPL = ('Last chance to attend! The following conferences '
+                    'are nearly sold out: %s')
+
+_local = {'expires': 0, 'announcement': None}
+
+
+def _announcementKey():
+    return ndb.Key(Announcement, 'nearly_sold_out')
+
+
+def isNearlySoldOut(seats):
+    return seats is not None and 0 < seats <= ANNOUNCEMENT_THRESHOLD
+
+
+def render(nearlySoldOut):
+    """Return the announcement for {websafeConferenceKey: name}."""
+    if not nearlySoldOut:
+        return ''
+    return ANNOUNCEMENT_TPL % ', '.join(sorted(nearlySoldOut.values()))
+
+# - - - The set - - - - - - - - - - - - - - - - - - - - - - - -
+
+def getNearlySoldOut():
+    """Return {websafeConferenceKey: name} of nearly sold out conferences."""
+    nearlySoldOut = memcache.get(MEMCACHE_NEARLY_SOLD_OUT_KEY)
+    if nearlySoldOut is None:
+        stored = _announcementKey().get()
+        nearlySoldOut = stored.nearlySoldOut if stored else {}
+        memcache.add(MEMCACHE_NEARLY_SOLD_OUT_KEY, nearlySoldOut)
+    return nearlySoldOut
+
+
+def publish(nearlySoldOut):
+    """Cache the set & its rendered announcement; return the announcement."""
+    announcement = render(nearlySoldOut)
+    memcache.set_multi({MEMCACHE_NEARLY_SOLD_OUT_KEY: nearlySoldOut,
+                        MEMCACHE_ANNOUNCEMENTS_KEY: announcement})
+    _local.update(expires=time.time() + INSTANCE_CACHE_TIME,
+                  announcement=announcement)
+    return announcement
+
+
+@ndb.transactional()
+def _updateSet(changes):
+    """Apply {websafeConferenceKey: name to add, or None to remove}."""
+    announcement = _announcementKey().get() or Announcement(key=_announcementKey())
+    nearlySoldOut = dict(announcement.nearlySoldOut or {})
+    for wsck, name in changes.items():
+        if name is not None:
+            nearlySoldOut[wsck] = name
+        else:
+            nearlySoldOut.pop(wsck, None)
+    if nearlySoldOut != announcement.nearlySoldOut:
+        announcement.nearlySoldOut = nearlySoldOut
+        announcement.put()
+    return nearlySoldOut
+
+
+def seatsChanged(conf, seats):
+    """Add or remove conf from the set if seats crossed the threshold.
+
+    seats is the conference's new total, or None if unknown.  Totals far
+    from the threshold, and conferences without a seat limit, return
+    straight away, so most registrations cost nothing extra.
+    """
+    seatsChangedMulti([(conf, seats)])
+
+
+def seatsChangedMulti(changes):
+    """seatsChanged for many (conf, seats) pairs, e.g. a bulk create:
+    one read of the set and at most one transaction for all of them."""
+    changes = [(conf, seats) for conf, seats in changes
+               if conf.maxAttendees and seats is not None and
+               seats <= ANNOUNCEMENT_THRESHOLD + 1]
+    if not changes:
+        return
+    current = getNearlySoldOut()
+    updates = {}
+    for conf, seats in changes:
+        wsck = conf.key.urlsafe()
+        want = isNearlySoldOut(seats)
+        if (wsck in current) != want:
+            updates[wsck] = conf.name if want else None
+    if updates:
+        publish(_updateSet(updates))
+
+
+@ndb.transactional()
+def reconcile(nearlySoldOut):
+    """Replace the set wholesale, e.g. from a full query; return the
+    announcement."""
+    announcement = _announcementKey().get() or Announcement(key=_announcementKey())
+    announcement.nearlySoldOut = nearlySoldOut
+    announcement.put()
+    ndb.get_context().call_on_commit(lambda: publish(nearlySoldOut))
+    return render(nearlySoldOut)
+
+# - - - Reading - - - - - - - - - - - - - - - - - - - - - - - -
+
+def getAnnouncement():
+    """Return the announcement, from the instance cache, memcache, or
+    rendered from the set."""
+    now = time.time()
+    if _local['announcement'] is not None and now < _local['expires']:
+        return _local['announcement']
+    announcement = memcache.get(MEMCACHE_ANNOUNCEMENTS_KEY)
+    if announcement is None:
+        announcement = render(getNearlySoldOut())
+        memcache.add(MEMCACHE_ANNOUNCEMENTS_KEY, announcement)
+    _local.update(expires=now + INSTANCE_CACHE_TIME, announcement=announcement)
+    return announcement
@@ -0,0 +1,348 @@
+#!/usr/bin/env python
+
+"""api_suite.py
+
+ConferenceApi latency and RPC counts at a seeded scale, as JSON.
+
+Seeds --conferences conferences with --sessions sessions each, --profiles
+attendees with --registrations registrations each, from a fixed --seed,
+then calls each endpoint --runs times through a fresh ConferenceApi, as
+endpoints does per request, with ndb's context cache cleared between
+calls (--cold also flushes memcache and the profile cache).  Prints
+p50/p95 latency and RPCs per call per case; --json writes the same
+figures with the commit they were measured at, and --compare diffs them
+against an earlier --json file.
+
+usage: python benchmarks/api_suite.py [--scale small|medium|large]
+           [--runs 30] [--json out.json] [--compare before.json]
+
+"""
+
+import argparse
+import collections
+import datetime
+import json
+import random
+import subprocess
+
+import benchutils
+
+SCALES = {
+    #          conferences, sessions, profiles, registrations
+    'small':  (50, 5, 100, 3),
+    'medium': (500, 10, 1000, 5),
+    'large':  (2000, 20, 5000, 10),
+}
+ORGANIZERS = 5
+SPEAKERS = 20
+CITIES = ('London', 'Paris', 'Tokyo', 'Chicago', 'Berlin')
+TOPICS = ('Web', 'Medical Innovations', 'Programming Languages', 'Mobile', 'Cloud')
+
+QUERY_FILTER_SETS = [
+    ('none', []),
+    ('city', [('CITY', 'EQ', 'London')]),
+    ('topic+month', [('TOPIC', 'EQ', 'Web'), ('MONTH', 'EQ', '6')]),
+    ('maxAttendees>', [('MAX_ATTENDEES', 'GT', '500')]),
+    ('city+month>+maxAttendees<', [('CITY', 'EQ', 'Paris'), ('MONTH', 'GT', '3'),
+                                   ('MAX_ATTENDEES', 'LT', '500')]),
+    ('topic+city!=', [('TOPIC', 'EQ', 'Web'), ('CITY', 'NE', 'London')]),
+]
+
+
+def organizerEmail(n):
+    return 'organizer-%d@example.com' % n
+
+
+def attendeeEmail(n):
+    return 'user-%d@example.com' % n
+
+# - - - Seeding - - - - - - - - - - - - - - - - - - - - - - - -
+
+def seed(rng, num_conferences, num_sessions, num_profiles, num_registrations):
+    """Create the synthetic data set; return a dict describing it."""
+    from google.appengine.ext import ndb
+    import conference
+    import search
+    import seats
+    from models import (Conference, Profile, Registration, SessionForm,
+                        SessionTypes, Speaker)
+
+    organizers = [Profile(id=organizerEmail(n), displayName='Organizer %d' % n,
+                          mainEmail=organizerEmail(n)) for n in range(ORGANIZERS)]
+    attendees = [Profile(id=attendeeEmail(n), displayName='User %d' % n,
+                         mainEmail=attendeeEmail(n)) for n in range(num_profiles)]
+    speakers = [Speaker(displayName='Speaker %d' % n) for n in range(SPEAKERS)]
+    ndb.put_multi(organizers + attendees + speakers)
+
+    conferences = []
+    for n in range(num_conferences):
+        organizer = organizers[n % ORGANIZERS]
+        start = datetime.date(2026, rng.randint(1, 12), rng.randint(1, 28))
+        maxAttendees = rng.choice((50, 100, 250, 500, 1000))
+        conferences.append(Conference(parent=organizer.key,
+            name='%s %s Conf %d' % (rng.choice(CITIES), rng.choice(TOPICS), n),
+            description=None if rng.random() < 0.2 else 'All about it',
+            organizerUserId=organizer.key.id(),
+            organizerDisplayName=organizer.displayName,
+            topics=rng.sample(TOPICS, rng.randint(1, 2)),
+            city=rng.choice(CITIES), startDate=start, month=start.month,
+            endDate=start + datetime.timedelta(days=rng.randint(0, 3)),
+            maxAttendees=maxAttendees, seatsAvailable=maxAttendees))
+    conf_keys = ndb.put_multi(conferences)
+
+    # registrations, with the seats they took
+    registered = collections.defaultdict(set)
+    taken = collections.Counter()
+    registrations = []
+    for prof in attendees:
+        for conf in rng.sample(conferences, min(num_registrations, len(conferences))):
+            if taken[conf.key] < conf.maxAttendees:
+                taken[conf.key] += 1
+                registered[prof.key.id()].add(conf.key.urlsafe())
+                registrations.append(Registration(
+                    key=Registration.keyFor(prof.key, conf.key.urlsafe()),
+                    conference=conf.key))
+    shards = []
+    for conf in conferences:
+        conf.seatsAvailable = conf.maxAttendees - taken[conf.key]
+        conf.seatShards = seats.numShardsFor(conf.maxAttendees)
+        shards.extend(seats.newShards(conf.key, conf.maxAttendees,
+                                      conf.seatsAvailable, conf.seatShards))
+    entities = registrations + shards
+    for start in range(0, len(entities), 500):
+        ndb.put_multi(entities[start:start + 500])
+    ndb.put_multi(conferences)
+
+    # sessions through the bulk endpoint, which keeps the speaker indexes
+    types = sorted(SessionTypes.names())
+    for conf in conferences:
+        benchutils.signIn(conf.organizerUserId)
+        conference.ConferenceApi().createSessions(
+            conference.SESSIONS_POST_REQUEST.combined_message_class(
+                websafeConferenceKey=conf.key.urlsafe(),
+                items=[SessionForm(
+                    sessionName='Talk %d' % n,
+                    speakerUserId=rng.choice(speakers).key.urlsafe(),
+                    highlights=None if rng.random() < 0.2 else 'Highlights',
+                    typeOfSession=SessionTypes(rng.choice(types)),
+                    duration=rng.choice((30, 45, 60, 90)),
+                    sessionDate=str(conf.startDate),
+                    startTime='%02d:%02d' % (rng.randint(8, 20), rng.choice((0, 15, 30, 45))))
+                    for n in range(num_sessions)]))
+        search.reindexConference(conf.key)
+
+    return {'conferences': [key.urlsafe() for key in conf_keys],
+            'attendees': [prof.key.id() for prof in attendees],
+            'registered': registered,
+            'speakers': [speaker.key.urlsafe() for speaker in speakers]}
+
+# - - - Cases - - - - - - - - - - - - - - - - - - - - - - - - -
+
+def buildCases(data):
+    """Return [(name, setup)]; setup(rng) signs a user in and returns
+    (call, cleanup), of which only call is measured."""
+    from protorpc import message_types
+    import conference
+    from models import ConferenceQueryForm, ConferenceQueryForms
+
+    Api = conference.ConferenceApi
+
+    def request(container, **fields):
+        return container.combined_message_class(**fields)
+
+    def asAttendee(rng):
+        benchutils.signIn(rng.choice(data['attendees']))
+
+    def asOrganizer(rng):
+        benchutils.signIn(organizerEmail(rng.randrange(ORGANIZERS)))
+
+    def simple(signIn, call):
+        def setup(rng):
+            if signIn:
+                signIn(rng)
+            return (lambda: call(rng)), None
+        return setup
+
+    def queryConferences(filters):
+        return simple(asAttendee, lambda rng: Api().queryConferences(
+            ConferenceQueryForms(pageSize=20, filters=[
+                ConferenceQueryForm(field=field, operator=op, value=value)
+                for field, op, value in filters])))
+
+    def register(rng):
+        user = rng.choice(data['attendees'])
+        benchutils.signIn(user)
+        wsck = rng.choice([wsck for wsck in data['conferences']
+                           if wsck not in data['registered'][user]])
+        req = request(conference.CONF_GET_REQUEST, websafeConferenceKey=wsck)
+        return (lambda: Api().registerForConference(req),
+                lambda: Api().unregisterFromConference(req))
+
+    def unregister(rng):
+        call, cleanup = register(rng)
+        call()
+        return cleanup, None
+
+    def wsck(rng):
+        return rng.choice(data['conferences'])
+
+    cases = [('queryConferences[%s]' % name, queryConferences(filters))
+             for name, filters in QUERY_FILTER_SETS]
+    cases += [
+        ('getConference', simple(None, lambda rng: Api().getConference(
+            request(conference.CONF_GET_REQUEST, websafeConferenceKey=wsck(rng))))),
+        ('getConferencesCreated', simple(asOrganizer, lambda rng:
+            Api().getConferencesCreated(
+                request(conference.PAGE_REQUEST, pageSize=20)))),
+        ('getConferencesToAttend', simple(asAttendee, lambda rng:
+            Api().getConferencesToAttend(message_types.VoidMessage()))),
+        ('searchConferences', simple(None, lambda rng: Api().searchConferences(
+            request(conference.SEARCH_REQUEST, query=rng.choice(CITIES).lower(),
+                    pageSize=20)))),
+        ('getPartialConferences', simple(None, lambda rng:
+            Api().getPartialConferences(
+                request(conference.PAGE_REQUEST, pageSize=20)))),
+        ('registerForConference', register),
+        ('unregisterFromConference', unregister),
+        ('getConferenceSessions', simple(None, lambda rng:
+            Api().getConferenceSessions(request(conference.SESSION_LIST_REQUEST,
+                websafeConferenceKey=wsck(rng))))),
+        ('getConferenceSessionsByType', simple(None, lambda rng:
+            Api().getConferenceSessionsByType(request(conference.SESSION_BY_TYPE,
+                websafeConferenceKey=wsck(rng), type='LECTURE')))),
+        ('querySessions', simple(None, lambda rng: Api().querySessions(
+            request(conference.SESSION_QUERY_REQUEST, startsBefore='19:00',
+                    excludeTypes=['WORKSHOP'])))),
+        ('getPartialSessions', simple(None, lambda rng: Api().getPartialSessions(
+            request(conference.SESSION_PAGE_REQUEST,
+                    websafeConferenceKey=wsck(rng), pageSize=20)))),
+        ('getSessionsBySpeaker', simple(None, lambda rng:
+            Api().getSessionsBySpeaker(request(conference.SESSION_BY_SPEAKER,
+                speakerKey=rng.choice(data['speakers']))))),
+        ('getAnnouncement', simple(None, lambda rng:
+            Api().getAnnouncement(message_types.VoidMessage()))),
+    ]
+    return cases
+
+# - - - Measuring & reporting - - - - - - - - - - - - - - - - -
+
+def percentile(values, p):
+    """Nearest-rank percentile of a non-empty list."""
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p * len(values)))]
+
+
+def measure(cases, runs, rng, counter, cold):
+    """Run every case runs times; return {name: figures}."""
+    from google.appengine.api import memcache
+    from google.appengine.ext import ndb
+    import profiles
+
+    results = collections.OrderedDict()
+    for name, setup in cases:
+        times = []
+        rpcs = collections.Counter()
+        for i in range(runs):
+            call, cleanup = setup(rng)
+            if cold:
+                memcache.flush_all()
+                profiles.flush()
+            ndb.get_context().clear_cache()
+            counter.reset()
+            with benchutils.Timer() as timer:
+                call()
+            times.append(timer.elapsed * 1000)
+            rpcs.update(counter.counts)
+            if cleanup:
+                cleanup()
+        results[name] = {
+            'p50_ms': percentile(times, 0.5),
+            'p95_ms': percentile(times, 0.95),
+            'mean_ms': sum(times) / runs,
+            'rpcs': float(sum(rpcs.values())) / runs,
+            'rpcs_by_call': dict((call, float(count) / runs)
+                                 for call, count in sorted(rpcs.items())),
+        }
+    return results
+
+
+def currentCommit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       cwd=benchutils.REPO_ROOT).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def printResults(results, baseline=None):
+    print '%-40s %9s %9s %9s' % ('case', 'p50 ms', 'p95 ms', 'rpcs')
+    for name, figures in results.items():
+        line = '%-40s %9.1f %9.1f %9.1f' % (
+            name, figures['p50_ms'], figures['p95_ms'], figures['rpcs'])
+        before = (baseline or {}).get(name)
+        if before:
+            line += '   (was %.1f / %.1f / %.1f)' % (
+                before['p50_ms'], before['p95_ms'], before['rpcs'])
+        print line
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--sdk', default=benchutils.DEFAULT_SDK)
+    parser.add_argument('--scale', choices=sorted(SCALES), default='small')
+    parser.add_argument('--conferences', type=int)
+    parser.add_argument('--sessions', type=int)
+    parser.add_argument('--profiles', type=int)
+    parser.add_argument('--registrations', type=int)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--runs', type=int, default=30)
+    parser.add_argument('--rpc-latency', type=float, default=0.0)
+    parser.add_argument('--cold', action='store_true')
+    parser.add_argument('--json')
+    parser.add_argument('--compare')
+    args = parser.parse_args()
+    benchutils.setupPaths(args.sdk)
+
+    import metrics
+    metrics.SAMPLE_RATE = 0     # measure the endpoints, not the metrics
+
+    scale = dict(zip(('conferences', 'sessions', 'profiles', 'registrations'),
+                     SCALES[args.scale]))
+    for name in scale:
+        if getattr(args, name) is not None:
+            scale[name] = getattr(args, name)
+
+    tb = benchutils.activateTestbed()
+    try:
+        rng = random.Random(args.seed)
+        with benchutils.Timer() as timer:
+            data = seed(rng, scale['conferences'], scale['sessions'],
+                        scale['profiles'], scale['registrations'])
+        print 'seeded %(conferences)d conferences x %(sessions)d sessions, ' \
+              '%(profiles)d profiles x %(registrations)d registrations' % scale,
+        print 'in %.1fs' % timer.elapsed
+
+        counter = benchutils.RpcCounter(args.rpc_latency).install()
+        results = measure(buildCases(data), args.runs, rng,
+                          counter, args.cold)
+    finally:
+        tb.deactivate()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+    printResults(results, baseline)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'commit': currentCommit(),
+                       'measured': datetime.datetime.utcnow().isoformat(),
+                       'scale': scale, 'seed': args.seed, 'runs': args.runs,
+                       'rpcLatency': args.rpc_latency, 'cold': args.cold,
+                       'results': results}, f, indent=2)
+        print 'wrote %s' % args.json
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+
+"""benchutils.py
+
+Shared setup for the offline benchmarks: puts the App Engine SDK and the
+app on sys.path and activates testbed stubs in place of the real services.
+
+Point APPENGINE_SDK (or --sdk) at the directory holding dev_appserver.py.
+
+"""
+
+import collections
+import os
+import sys
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_SDK = os.environ.get('APPENGINE_SDK', '/usr/local/google_appengine')
+
+
+def setupPaths(sdk_path=DEFAULT_SDK):
+    """Make the SDK, its bundled libraries and the app importable."""
+    if sdk_path not in sys.path:
+        sys.path.insert(0, sdk_path)
+    import dev_appserver
+    dev_appserver.fix_sys_path()
+    if REPO_ROOT not in sys.path:
+        sys.path.insert(0, REPO_ROOT)
+
+
+def activateTestbed():
+    """Activate datastore, memcache, taskqueue & friends; return the Testbed."""
+    from google.appengine.datastore import datastore_stub_util
+    from google.appengine.ext import testbed
+
+    tb = testbed.Testbed()
+    tb.activate()
+    tb.setup_env(app_id='final-conference-app', overwrite=True)
+    tb.init_datastore_v3_stub(
+        consistency_policy=datastore_stub_util.PseudoRandomHRConsistencyPolicy(
+            probability=1))
+    tb.init_memcache_stub()
+    tb.init_taskqueue_stub(root_path=REPO_ROOT)
+    tb.init_app_identity_stub()
+    tb.init_mail_stub()
+    tb.init_urlfetch_stub()
+    tb.init_user_stub()
+    return tb
+
+
+class Timer(object):
+    """Context manager recording wall time in seconds on .elapsed."""
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.elapsed = time.time() - self.start
+
+
+def signIn(email):
+    """Make endpoints.get_current_user() return a user with this email."""
+    os.environ['ENDPOINTS_AUTH_EMAIL'] = email
+    os.environ['ENDPOINTS_AUTH_DOMAIN'] = 'gmail.com'
+
+
+class RpcCounter(object):
+    """Counts API calls per service.method; optionally adds latency to them.
+
+    The local stubs answer instantly, so latency is what makes overlapped
+    and batched RPCs show up in wall time.  It is charged per round
+    rather than per RPC: the first wait on an RPC sleeps once for every
+    RPC issued since the last wait, since those were in flight together,
+    and waits on RPCs already charged cost nothing.  Sequential calls
+    pay for each RPC; ones issued before waiting, as tasklets and
+    *_async calls do, pay once.
+    """
+
+    _installed = []             # counters charging latency on UserRPC.wait
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.counts = collections.defaultdict(int)
+        self.rounds = 0
+        self._inFlight = 0
+
+    def install(self):
+        """Hook into the active testbed's API proxy."""
+        from google.appengine.api import apiproxy_stub_map
+        apiproxy_stub_map.apiproxy.GetPreCallHooks().Append(
+            'rpc_counter', self._preCall)
+        if not RpcCounter._installed:
+            wait = apiproxy_stub_map.UserRPC.wait
+
+            def _wait(rpc):
+                for counter in RpcCounter._installed:
+                    counter._charge()
+                return wait(rpc)
+            apiproxy_stub_map.UserRPC.wait = _wait
+        RpcCounter._installed.append(self)
+        return self
+
+    def reset(self):
+        self.counts.clear()
+        self.rounds = 0
+        self._inFlight = 0
+
+    def total(self):
+        return sum(self.counts.values())
+
+    def _preCall(self, service, call, request, response):
+        self.counts['%s.%s' % (service, call)] += 1
+        self._inFlight += 1
+
+    def _charge(self):
+        """Sleep once for the RPCs issued since the last wait."""
+        if self._inFlight:
+            self._inFlight = 0
+            self.rounds += 1
+            if self.latency:
+                time.sleep(self.latency)
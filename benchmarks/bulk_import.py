@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+
+"""bulk_import.py
+
+RPCs and time per imported conference: createConference once per item
+against one createConferences call, and likewise for sessions.
+
+usage: python benchmarks/bulk_import.py [--items 200] [--rpc-latency 0.005]
+
+"""
+
+import argparse
+
+import benchutils
+
+ORGANIZER = 'organizer@example.com'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--sdk', default=benchutils.DEFAULT_SDK)
+    parser.add_argument('--items', type=int, default=200)
+    parser.add_argument('--rpc-latency', type=float, default=0.005)
+    args = parser.parse_args()
+    benchutils.setupPaths(args.sdk)
+
+    import conference
+    from models import ConferenceForm, ConferenceForms, Profile, SessionForm, Speaker
+
+    tb = benchutils.activateTestbed()
+    try:
+        Profile(id=ORGANIZER, displayName='Organizer', mainEmail=ORGANIZER).put()
+        speaker_key = Speaker(displayName='Speaker').put()
+        benchutils.signIn(ORGANIZER)
+        api = conference.ConferenceApi()
+        counter = benchutils.RpcCounter(args.rpc_latency).install()
+
+        def conferenceForm(n):
+            return ConferenceForm(name='Imported %d' % n, city='London',
+                                  topics=['Web'], maxAttendees=100,
+                                  startDate='2026-06-01', endDate='2026-06-02')
+
+        def sessionForm(n):
+            return SessionForm(sessionName='Talk %d' % n,
+                               speakerUserId=speaker_key.urlsafe())
+
+        def one(func):
+            counter.reset()
+            with benchutils.Timer() as timer:
+                result = func()
+            return timer.elapsed, counter.total(), result
+
+        single = one(lambda: [api.createConference(conferenceForm(n))
+                              for n in range(args.items)])
+        bulk = one(lambda: api.createConferences(
+            ConferenceForms(items=[conferenceForm(n) for n in range(args.items)])))
+        assert bulk[2].created == args.items
+
+        wsck = bulk[2].items[0].websafeKey
+        single_s = one(lambda: [api.createSession(
+            conference.SESSION_POST_REQUEST.combined_message_class(
+                websafeConferenceKey=wsck, sessionName='Talk %d' % n,
+                speakerUserId=speaker_key.urlsafe()))
+            for n in range(args.items)])
+        bulk_s = one(lambda: api.createSessions(
+            conference.SESSIONS_POST_REQUEST.combined_message_class(
+                websafeConferenceKey=wsck,
+                items=[sessionForm(n) for n in range(args.items)])))
+        assert bulk_s[2].created == args.items
+
+        print '%-30s %12s %12s' % ('path', 'ms/item', 'rpcs/item')
+        for name, (elapsed, rpcs, _) in [
+                ('createConference x %d' % args.items, single),
+                ('createConferences', bulk),
+                ('createSession x %d' % args.items, single_s),
+                ('createSessions', bulk_s)]:
+            print '%-30s %12.2f %12.2f' % (name, elapsed * 1000 / args.items,
+                                           float(rpcs) / args.items)
+    finally:
+        tb.deactivate()
+
+
+if __name__ == '__main__':
+    main()
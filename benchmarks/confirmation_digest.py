@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+
+"""confirmation_digest.py
+
+Confirmation digests against the local mail and task queue stubs.
+
+Queues --conferences confirmations spread over --organizers organizers,
+runs the digest worker once and checks, on the mail stub, that each
+organizer got exactly one message naming every conference they created
+and that the pull queue was drained.  Reports mails and RPCs per
+confirmation next to the one-mail-per-conference baseline.
+
+usage: python benchmarks/confirmation_digest.py [--conferences 500] [--organizers 7]
+
+"""
+
+import argparse
+
+import benchutils
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--sdk', default=benchutils.DEFAULT_SDK)
+    parser.add_argument('--conferences', type=int, default=500)
+    parser.add_argument('--organizers', type=int, default=7)
+    parser.add_argument('--batch-size', type=int, default=None)
+    args = parser.parse_args()
+    benchutils.setupPaths(args.sdk)
+
+    from google.appengine.ext import testbed
+    import confirmations
+    from models import ConferenceForm
+
+    if args.batch_size:
+        confirmations.DIGEST_BATCH_SIZE = args.batch_size
+
+    tb = benchutils.activateTestbed()
+    try:
+        mail_stub = tb.get_stub(testbed.MAIL_SERVICE_NAME)
+        queue_stub = tb.get_stub(testbed.TASKQUEUE_SERVICE_NAME)
+        counter = benchutils.RpcCounter().install()
+
+        expected = {}
+        tasks = []
+        for n in range(args.conferences):
+            email = 'organizer-%d@example.com' % (n % args.organizers)
+            cf = ConferenceForm(name='Conference %d' % n, city='London',
+                                topics=['Web'], maxAttendees=100,
+                                startDate='2026-06-01', endDate='2026-06-03')
+            expected.setdefault(email, []).append(cf.name)
+            tasks.append(confirmations.confirmationTask(email, cf))
+        confirmations.enqueueConfirmations(tasks)
+
+        counter.reset()
+        with benchutils.Timer() as timer:
+            digests = confirmations.sendDigests()
+        rpcs = counter.total()
+
+        messages = mail_stub.get_sent_messages()
+        assert digests == len(messages) == len(expected), (digests, len(messages))
+        for message in messages:
+            body = message.body.decode()
+            names = expected.pop(message.to)
+            assert all(name + ' (' in body for name in names), message.to
+        assert not expected
+        assert not queue_stub.GetTasks(confirmations.CONFIRMATION_QUEUE)
+        print 'ok: %d digests for %d confirmations, pull queue drained' % (
+            digests, args.conferences)
+
+        print '%-26s %10s %10s' % ('path', 'mails', 'worker ms')
+        print '%-26s %10d %10s' % ('one mail per conference', args.conferences, '-')
+        print '%-26s %10d %10.1f' % ('digest per organizer', digests,
+                                     timer.elapsed * 1000)
+        print 'worker rpcs: %d (%.2f per confirmation)' % (
+            rpcs, float(rpcs) / args.conferences)
+    finally:
+        tb.deactivate()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+
+"""endpoint_latency.py
+
+Before/after latency of the multi-RPC endpoints.
+
+"before" replays the strictly sequential datastore calls the endpoints
+used to make; "after" calls the current tasklet-based ConferenceApi
+methods.  Caches are flushed before every call and each round of RPCs
+in flight together is charged --rpc-latency seconds (see
+benchutils.RpcCounter), so the numbers reflect RPC round trips rather
+than cache hits, and RPCs the tasklets overlap are paid for once.
+
+usage: python benchmarks/endpoint_latency.py [--conferences 50] [--runs 20]
+
+"""
+
+import argparse
+
+import benchutils
+
+ORGANIZER = 'organizer@example.com'
+ATTENDEE = 'attendee@example.com'
+
+
+def seed(num_conferences):
+    """Create an organizer's conferences, an attendee of all of them and
+    a speaker; return (attendee Profile, conference keys, speaker key)."""
+    from google.appengine.ext import ndb
+    from models import Conference, Profile, Registration, Speaker
+
+    organizer = Profile(id=ORGANIZER, displayName='Organizer',
+                        mainEmail=ORGANIZER)
+    conferences = [Conference(parent=organizer.key, name='Conference %d' % i,
+                              organizerUserId=ORGANIZER, city='London',
+                              maxAttendees=100, seatsAvailable=99)
+                   for i in range(num_conferences)]
+    conf_keys = ndb.put_multi(conferences)
+    attendee = Profile(id=ATTENDEE, displayName='Attendee', mainEmail=ATTENDEE,
+                       conferenceKeysToAttend=[k.urlsafe() for k in conf_keys])
+    # the legacy list feeds the "before" replay, Registrations the endpoint
+    registrations = [Registration(key=Registration.keyFor(attendee.key, k.urlsafe()),
+                                  conference=k) for k in conf_keys]
+    speaker = Speaker(displayName='Speaker')
+    ndb.put_multi([organizer, attendee, speaker] + registrations)
+    return attendee, conf_keys, speaker.key
+
+# - - - before: sequential RPCs - - - - - - - - - - - - - - - -
+
+def conferencesToAttendBefore(api):
+    from google.appengine.ext import ndb
+    from models import Profile
+    prof = ndb.Key(Profile, ATTENDEE).get()
+    conferences = ndb.get_multi(
+        [ndb.Key(urlsafe=wsck) for wsck in prof.conferenceKeysToAttend])
+    profiles = ndb.get_multi(
+        [ndb.Key(Profile, conf.organizerUserId) for conf in conferences])
+    names = dict((p.key.id(), p.displayName) for p in profiles)
+    return [api._copyConferenceToForm(conf, names[conf.organizerUserId])
+            for conf in conferences]
+
+
+def conferencesCreatedBefore(api):
+    from google.appengine.ext import ndb
+    from models import Conference, Profile
+    p_key = ndb.Key(Profile, ORGANIZER)
+    conferences = Conference.query(ancestor=p_key).fetch()
+    prof = p_key.get()
+    return [api._copyConferenceToForm(conf, prof.displayName)
+            for conf in conferences]
+
+
+def createSessionBefore(conf_key, speaker_key):
+    from google.appengine.ext import ndb
+    from models import Session
+    conf = conf_key.get()
+    speaker = speaker_key.get()
+    s_id = Session.allocate_ids(size=1, parent=conf.key)[0]
+    Session(key=ndb.Key(Session, s_id, parent=conf.key), sessionName='Talk',
+            speaker=[speaker_key.urlsafe()],
+            speakerDisplayName=speaker.displayName).put()
+
+# - - - runner - - - - - - - - - - - - - - - - - - - - - - - -
+
+def measure(counter, runs, func):
+    """Return (mean seconds, mean RPCs, mean RPC rounds) of func over
+    runs cold calls."""
+    from google.appengine.api import memcache
+    from google.appengine.ext import ndb
+    import profiles
+
+    elapsed = rpcs = rounds = 0
+    for i in range(runs):
+        memcache.flush_all()
+        ndb.get_context().clear_cache()
+        profiles.flush()
+        counter.reset()
+        with benchutils.Timer() as timer:
+            func()
+        elapsed += timer.elapsed
+        rpcs += counter.total()
+        rounds += counter.rounds
+    return elapsed / runs, float(rpcs) / runs, float(rounds) / runs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--sdk', default=benchutils.DEFAULT_SDK)
+    parser.add_argument('--conferences', type=int, default=50)
+    parser.add_argument('--runs', type=int, default=20)
+    parser.add_argument('--rpc-latency', type=float, default=0.005)
+    args = parser.parse_args()
+    benchutils.setupPaths(args.sdk)
+
+    from protorpc import message_types
+    import conference
+
+    tb = benchutils.activateTestbed()
+    try:
+        attendee, conf_keys, speaker_key = seed(args.conferences)
+        # endpoints makes a service instance, and so a RequestContext,
+        # per request; the "after" calls do likewise
+        api = conference.ConferenceApi()
+        counter = benchutils.RpcCounter(args.rpc_latency).install()
+
+        def conferencesToAttendAfter():
+            benchutils.signIn(ATTENDEE)
+            conference.ConferenceApi().getConferencesToAttend(
+                message_types.VoidMessage())
+
+        def conferencesCreatedAfter():
+            benchutils.signIn(ORGANIZER)
+            conference.ConferenceApi().getConferencesCreated(
+                conference.PAGE_REQUEST.combined_message_class(
+                    pageSize=args.conferences))
+
+        def createSessionAfter():
+            benchutils.signIn(ORGANIZER)
+            conference.ConferenceApi().createSession(
+                conference.SESSION_POST_REQUEST.combined_message_class(
+                    websafeConferenceKey=conf_keys[0].urlsafe(),
+                    sessionName='Talk', speakerUserId=speaker_key.urlsafe()))
+
+        cases = [
+            ('getConferencesToAttend',
+                lambda: conferencesToAttendBefore(api), conferencesToAttendAfter),
+            ('getConferencesCreated',
+                lambda: conferencesCreatedBefore(api), conferencesCreatedAfter),
+            ('createSession',
+                lambda: createSessionBefore(conf_keys[0], speaker_key),
+                createSessionAfter),
+        ]
+
+        print '%-24s %10s %10s %10s %10s %12s %12s' % (
+            'endpoint', 'before ms', 'after ms', 'before rpc', 'after rpc',
+            'before rnds', 'after rnds')
+        for name, before, after in cases:
+            before_s, before_rpc, before_rounds = measure(counter, args.runs, before)
+            after_s, after_rpc, after_rounds = measure(counter, args.runs, after)
+            print '%-24s %10.1f %10.1f %10.1f %10.1f %12.1f %12.1f' % (
+                name, before_s * 1000, after_s * 1000, before_rpc, after_rpc,
+                before_rounds, after_rounds)
+    finally:
+        tb.deactivate()
+
+
+if __name__ == '__main__':
+    main()
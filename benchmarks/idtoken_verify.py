@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+
+"""idtoken_verify.py
+
+Cost of verifying ID tokens offline, cold and from cache.
+
+A local RSA key pair stands in for Google's certs: tokens are signed with
+the private key and the CertCache is handed its public half as a JWK set,
+so no network is used.  Also checks that tampered, expired and wrongly
+addressed tokens are rejected.
+
+usage: python benchmarks/idtoken_verify.py [--tokens 200]
+
+"""
+
+import argparse
+import base64
+import json
+import time
+
+import benchutils
+
+AUDIENCE = 'local-client-id'
+
+
+def b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip('=')
+
+
+def encodeInt(n):
+    digits = '%x' % n
+    return b64encode(('0' * (len(digits) % 2) + digits).decode('hex'))
+
+
+def makeSigner(kid='local-key'):
+    """Return (sign(claims) -> token, JWK set of the public key)."""
+    from Crypto.Hash import SHA256
+    from Crypto.PublicKey import RSA
+    from Crypto.Signature import PKCS1_v1_5
+
+    key = RSA.generate(2048)
+    jwks = {'keys': [{'kty': 'RSA', 'alg': 'RS256', 'kid': kid,
+                      'n': encodeInt(key.n), 'e': encodeInt(key.e)}]}
+    header = b64encode(json.dumps({'alg': 'RS256', 'kid': kid}))
+
+    def sign(claims):
+        signed = '%s.%s' % (header, b64encode(json.dumps(claims)))
+        signature = PKCS1_v1_5.new(key).sign(SHA256.new(signed))
+        return '%s.%s' % (signed, b64encode(signature))
+    return sign, jwks
+
+
+def claimsFor(n, **overrides):
+    now = int(time.time())
+    claims = {'iss': 'accounts.google.com', 'aud': AUDIENCE,
+              'sub': 'user-%d' % n, 'iat': now, 'exp': now + 3600}
+    claims.update(overrides)
+    return claims
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--sdk', default=benchutils.DEFAULT_SDK)
+    parser.add_argument('--tokens', type=int, default=200)
+    args = parser.parse_args()
+    benchutils.setupPaths(args.sdk)
+
+    import idtoken
+
+    tb = benchutils.activateTestbed()
+    try:
+        sign, jwks = makeSigner()
+        certs = idtoken.CertCache(fetch=lambda: (jwks, 3600),
+                                  memcache_key='LOCAL_CERTS')
+        tokens = [sign(claimsFor(n)) for n in range(args.tokens)]
+
+        for name, token in [
+                ('tampered', tokens[0][:-4] + 'AAAA'),
+                ('expired', sign(claimsFor(0, exp=int(time.time()) - 3600))),
+                ('wrong audience', sign(claimsFor(0, aud='someone-else')))]:
+            try:
+                idtoken.decodeAndVerify(token, [AUDIENCE], certs)
+                print 'FAIL: %s token accepted' % name
+            except idtoken.InvalidTokenError:
+                print 'ok: %s token rejected' % name
+
+        with benchutils.Timer() as cold:
+            for token in tokens:
+                idtoken.verifyIdToken(token, [AUDIENCE], certs)
+        with benchutils.Timer() as warm:
+            for token in tokens:
+                idtoken.verifyIdToken(token, [AUDIENCE], certs)
+        idtoken._tokens.clear()
+        with benchutils.Timer() as shared:
+            for token in tokens:
+                idtoken.verifyIdToken(token, [AUDIENCE], certs)
+
+        print '%-28s %10s' % ('path', 'us/token')
+        for name, timer in [('verify (signature check)', cold),
+                            ('instance LRU hit', warm),
+                            ('memcache hit', shared)]:
+            print '%-28s %10.1f' % (name, timer.elapsed * 1e6 / len(tokens))
+    finally:
+        tb.deactivate()
+
+
+if __name__ == '__main__':
+    main()
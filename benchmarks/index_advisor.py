@@ -0,0 +1,278 @@
+#!/usr/bin/env python
+
+"""index_advisor.py
+
+Derive a minimal covering set of Conference indexes for queryConferences.
+
+Enumerates every query shape _getQuery can send to the datastore given
+the FIELDS and OPERATORS tables: any set of equality filters, at most one
+pushed-down inequality field (the query planner post-filters the rest,
+and every '!='), sorted by that field and then by name.  The datastore
+can serve equality filters with a merge join over indexes that share the
+same sort suffix, so one (field, suffix) index per filterable field
+covers every combination; the advisor checks that, compares the result
+with index.yaml, and reports the index rows each Conference write costs,
+counting the repeated topics property once per value.
+
+Field-mask projections are modelled too: queryConferences only projects
+masks within the sort suffix of a shape with at most one equality
+filter, and such a projection must be read from a single index holding
+the filter and the whole suffix, without a merge join.  The advisor
+checks those shapes against the same indexes.
+
+So are the planner's estimate counts: with inequalities on several
+fields, queryplan counts the keys matching the equalities and each
+candidate field's inequalities, sorted as the plan would be, before
+picking the field to push down.  Those keys-only shapes are checked
+against the same indexes as the plans.
+
+usage: python benchmarks/index_advisor.py [--topics 2] [--write]
+
+"""
+
+import argparse
+import itertools
+import os
+
+import benchutils
+
+KIND = 'Conference'
+SORT_FIELD = 'name'
+AUTOGENERATED = '# AUTOGENERATED'
+
+# - - - Query shapes - - - - - - - - - - - - - - - - - - - - -
+
+def enumerateShapes(fields, operators):
+    """Return every (equality fields, inequality field or None) the query
+    planner can push down for filters over fields using operators."""
+    fields = sorted(set(fields.values()))
+    pushable = [op for op in operators.values() if op not in ('=', '!=')]
+    orders = [None] + (fields if pushable else [])
+    shapes = set()
+    for ordered in orders:
+        others = [f for f in fields if f != ordered]
+        for n in range(len(others) + 1):
+            for equalities in itertools.combinations(others, n):
+                shapes.add((frozenset(equalities), ordered))
+    return sorted(shapes, key=lambda shape: (shape[1] or '', sorted(shape[0])))
+
+
+def suffixOf(shape):
+    ordered = shape[1]
+    return ((ordered,) if ordered else ()) + (SORT_FIELD,)
+
+
+def exactIndex(shape):
+    """The one composite index serving shape on its own, or None if the
+    built-in single property indexes do."""
+    equalities, ordered = shape
+    index = tuple(sorted(equalities)) + suffixOf(shape)
+    return index if len(index) > 1 else None
+
+
+def minimalIndexes(shapes):
+    """Return the composite indexes covering shapes with merge joins:
+    (field, suffix) per equality field, and the bare suffix when needed."""
+    indexes = set()
+    for shape in shapes:
+        suffix = suffixOf(shape)
+        if not shape[0] and len(suffix) > 1:
+            indexes.add(suffix)
+        for field in shape[0]:
+            indexes.add((field,) + suffix)
+    return sorted(indexes, key=lambda index: (len(index), index[-2::-1], index))
+
+
+def covers(indexes, shape):
+    """Return whether indexes (tuples of property names) can serve shape,
+    alone or merge-joined on a shared sort suffix."""
+    equalities, _ = shape
+    suffix = suffixOf(shape)
+    if not equalities:
+        return len(suffix) == 1 or suffix in indexes
+    joined = set()
+    for index in indexes:
+        prefix = index[:len(index) - len(suffix)]
+        if index[len(prefix):] == suffix and set(prefix) <= equalities:
+            joined.update(prefix)
+    return joined == equalities
+
+def estimateShapes(fields, operators):
+    """Return the (equality fields, inequality field) queryplan counts
+    keys for: a candidate inequality field, another one competing with
+    it, and equalities on any of the rest, sorted by the candidate
+    field, then name."""
+    fields = sorted(set(fields.values()))
+    if not [op for op in operators.values() if op not in ('=', '!=')]:
+        return []
+    shapes = set()
+    for ordered, rival in itertools.permutations(fields, 2):
+        others = [f for f in fields if f not in (ordered, rival)]
+        for n in range(len(others) + 1):
+            for equalities in itertools.combinations(others, n):
+                shapes.add((frozenset(equalities), ordered))
+    return sorted(shapes, key=lambda shape: (shape[1] or '', sorted(shape[0])))
+
+
+def projectionShapes(shapes, projectable):
+    """Return the shapes queryConferences serves with a projection of
+    their sort suffix: no more than one equality filter, and a suffix of
+    projectable (single-valued, indexed) properties."""
+    return [shape for shape in shapes
+            if len(shape[0]) <= 1 and set(suffixOf(shape)) <= set(projectable)]
+
+
+def coversProjection(indexes, shape):
+    """Return whether one index, or the built-in one, serves a projection
+    of shape's sort suffix."""
+    index = tuple(sorted(shape[0])) + suffixOf(shape)
+    return len(index) == 1 or index in indexes
+
+# - - - Write amplification - - - - - - - - - - - - - - - - - -
+
+def valueCounts(model_cls, repeated_values):
+    """Return {indexed property: values per entity}."""
+    return dict((name, repeated_values if prop._repeated else 1)
+                for name, prop in model_cls._properties.items()
+                if prop._indexed)
+
+
+def builtinRows(counts):
+    """Index rows of a new entity in the built-in indexes: one by kind,
+    and an ascending and descending row per indexed value."""
+    return 1 + 2 * sum(counts.values())
+
+
+def compositeRows(index, counts):
+    """Index rows of a new entity in one composite index; repeated
+    properties multiply."""
+    rows = 1
+    for name in index:
+        rows *= counts.get(name, 1)
+    return rows
+
+
+def readIndexYaml(path):
+    """Return [(kind, ancestor, property names)] from an index.yaml."""
+    from google.appengine.datastore import datastore_index
+    with open(path) as f:
+        definitions = datastore_index.ParseIndexDefinitions(f)
+    if not definitions or not definitions.indexes:
+        return []
+    return [(index.kind, bool(index.ancestor),
+             tuple(prop.name for prop in index.properties or []))
+            for index in definitions.indexes]
+
+
+def isPlannerIndex(kind, ancestor, properties, fields):
+    """Whether an existing index serves queryConferences shapes."""
+    return (kind == KIND and not ancestor and properties
+            and properties[-1] == SORT_FIELD
+            and set(properties[:-1]) <= set(fields.values()))
+
+
+def renderIndex(kind, properties, ancestor=False):
+    lines = ['- kind: %s' % kind]
+    if ancestor:
+        lines.append('  ancestor: yes')
+    lines.append('  properties:')
+    lines.extend('  - name: %s' % name for name in properties)
+    return '\n'.join(lines) + '\n'
+
+
+def writeIndexYaml(path, indexes, kept):
+    """Write the advised indexes above the AUTOGENERATED marker, keeping
+    the autogenerated indexes the advisor doesn't replace below it."""
+    with open(path) as f:
+        text = f.read()
+    marker = text.find(AUTOGENERATED)
+    tail = text[marker:].split('\n- kind:')[0].rstrip() + '\n' if marker >= 0 else ''
+    out = ['indexes:\n',
+           '\n# queryConferences: one index per filter field and sort suffix,\n'
+           '# merge-joined by the datastore; the planner\'s estimate counts use\n'
+           '# the same shapes, and field-mask projections of the sort suffix\n'
+           '# read a single one of them; see benchmarks/index_advisor.py\n']
+    out.extend('\n' + renderIndex(KIND, index) for index in indexes)
+    out.append('\n' + (tail or AUTOGENERATED + '\n'))
+    out.extend('\n' + renderIndex(*entry) for entry in kept)
+    with open(path, 'w') as f:
+        f.write(''.join(out))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--sdk', default=benchutils.DEFAULT_SDK)
+    parser.add_argument('--topics', type=int, default=None,
+                        help='topics per conference (default: len(DEFAULTS))')
+    parser.add_argument('--index-yaml',
+                        default=os.path.join(benchutils.REPO_ROOT, 'index.yaml'))
+    parser.add_argument('--write', action='store_true',
+                        help='rewrite index.yaml with the advised indexes')
+    args = parser.parse_args()
+    benchutils.setupPaths(args.sdk)
+
+    from conference import CONFERENCE_PROJECTIONS, DEFAULTS, FIELDS, OPERATORS
+    from models import Conference
+
+    shapes = enumerateShapes(FIELDS, OPERATORS)
+    exact = sorted(set(filter(None, map(exactIndex, shapes))))
+    advised = minimalIndexes(shapes)
+    projected = projectionShapes(shapes, CONFERENCE_PROJECTIONS)
+    estimates = estimateShapes(FIELDS, OPERATORS)
+    uncovered = [shape for shape in shapes + estimates
+                 if not covers(advised, shape)] + \
+        [shape for shape in projected if not coversProjection(advised, shape)]
+    assert not uncovered, 'advised indexes miss %r' % uncovered
+
+    existing = readIndexYaml(args.index_yaml)
+    current = [props for kind, ancestor, props in existing
+               if isPlannerIndex(kind, ancestor, props, FIELDS)]
+    kept = [(kind, props, ancestor) for kind, ancestor, props in existing
+            if not isPlannerIndex(kind, ancestor, props, FIELDS)]
+    missed = [shape for shape in shapes if not covers(current, shape)]
+    missedEstimates = [shape for shape in estimates
+                       if not covers(current, shape)]
+    missedProjections = [shape for shape in projected
+                         if not coversProjection(current, shape)]
+
+    counts = valueCounts(Conference, args.topics or len(DEFAULTS['topics']))
+    builtin = builtinRows(counts)
+
+    print '%d query shapes over %s; order by the inequality field, then %s' % (
+        len(shapes), ', '.join(sorted(FIELDS.values())), SORT_FIELD)
+    print 'per Conference: %d built-in index rows (topics x %d)\n' % (
+        builtin, counts.get('topics', 1))
+    print '%d of them also served as projections of their sort suffix' % (
+        len(projected))
+    print '%d keys-only estimate count shapes, sorted like the plans\n' % (
+        len(estimates))
+    print '%-26s %8s %13s %14s' % ('index set', 'indexes', 'rows/entity', 'shapes missed')
+    for name, indexes in [('index.yaml', current),
+                          ('one index per shape', exact),
+                          ('advised (merge join)', advised)]:
+        rows = builtin + sum(compositeRows(index, counts) for index in indexes)
+        print '%-26s %8d %13d %14d' % (name, len(indexes), rows,
+            len([s for s in shapes + estimates if not covers(indexes, s)]) +
+            len([s for s in projected if not coversProjection(indexes, s)]))
+
+    if missed or missedEstimates or missedProjections:
+        print '\nshapes index.yaml can\'t serve:'
+        for kind, (equalities, ordered) in (
+                [('', shape) for shape in missed] +
+                [('estimate: ', shape) for shape in missedEstimates] +
+                [('projected: ', shape) for shape in missedProjections]):
+            print '  %s%s' % (kind, ' AND '.join(
+                ['%s =' % f for f in sorted(equalities)] +
+                (['%s <>' % ordered] if ordered else [])))
+
+    if args.write:
+        writeIndexYaml(args.index_yaml, advised, kept)
+        print '\nwrote %d indexes to %s' % (len(advised), args.index_yaml)
+    else:
+        print '\nadvised indexes (--write to apply):'
+        for index in advised:
+            print '  %s' % ', '.join(index)
+
+
+if __name__ == '__main__':
+    main()
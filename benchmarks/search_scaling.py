@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+
+"""search_scaling.py
+
+Search latency against corpus size, on the in-process MemoryBackend.
+
+Each corpus holds --docs conferences of random common words, plus a rare
+word planted in --matches of them.  Searching for the rare word should
+take about the same time whatever the corpus size, while a linear scan
+grows with it.  Results are checked against the scan.
+
+usage: python benchmarks/search_scaling.py [--docs 1000,10000,50000]
+
+"""
+
+import argparse
+import random
+
+import benchutils
+
+WORDS = ['web', 'cloud', 'mobile', 'data', 'design', 'security', 'python',
+         'summit', 'expo', 'forum', 'london', 'paris', 'berlin', 'tokyo',
+         'medical', 'innovation', 'developer', 'startup', 'games', 'music']
+RARE_WORD = 'quasar'
+
+
+class Doc(object):
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+
+def makeCorpus(docs, matches, rng):
+    corpus = {}
+    planted = set(rng.sample(range(docs), matches))
+    for n in range(docs):
+        words = [rng.choice(WORDS) for _ in range(8)]
+        if n in planted:
+            words[rng.randrange(len(words))] = RARE_WORD
+        corpus['doc-%06d' % n] = Doc(name=' '.join(words[:3]),
+                                     topics=words[3:5], city=words[5],
+                                     description=' '.join(words[6:]))
+    return corpus
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--sdk', default=benchutils.DEFAULT_SDK)
+    parser.add_argument('--docs', default='1000,10000,50000')
+    parser.add_argument('--matches', type=int, default=20)
+    parser.add_argument('--queries', type=int, default=200)
+    args = parser.parse_args()
+    benchutils.setupPaths(args.sdk)
+
+    import search
+
+    rng = random.Random(42)
+    print '%8s %12s %12s %12s' % ('docs', 'index ms', 'search us', 'scan us')
+    for docs in [int(n) for n in args.docs.split(',')]:
+        corpus = makeCorpus(docs, args.matches, rng)
+        backend = search.MemoryBackend()
+        with benchutils.Timer() as indexing:
+            for doc_id, doc in corpus.items():
+                search.updateDoc(doc_id, search.conferenceTerms(doc), backend)
+
+        with benchutils.Timer() as searching:
+            for _ in range(args.queries):
+                found = search.search(RARE_WORD[:4], backend)
+        scans = min(args.queries, 5)
+        with benchutils.Timer() as scanning:
+            for _ in range(scans):
+                scanned = [doc_id for doc_id, doc in corpus.items()
+                           if any(token.startswith(RARE_WORD[:4]) for token in
+                                  search.conferenceTerms(doc))]
+        assert sorted(doc_id for doc_id, _ in found) == sorted(scanned)
+
+        print '%8d %12.1f %12.1f %12.1f' % (
+            docs, indexing.elapsed * 1000,
+            searching.elapsed * 1e6 / args.queries,
+            scanning.elapsed * 1e6 / scans)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+
+"""seat_contention.py
+
+Contention benchmark for sharded seat allocation.
+
+Concurrent workers register distinct attendees for one conference through
+ConferenceApi._seatTransaction, picking shards as _conferenceRegistration
+does.  The local datastore stub has no 1 write/sec/entity-group limit,
+so each transaction holds its entity groups open for --commit-delay
+seconds to stand in for commit latency; collisions then show up as
+transaction retries and failed registrations, and throughput scales
+with the number of shards.
+
+usage: python benchmarks/seat_contention.py [--shards 1,5,20] [--workers 20]
+
+"""
+
+import argparse
+import threading
+import time
+
+import benchutils
+
+
+def runOnce(num_shards, workers, per_worker, commit_delay):
+    """Register workers * per_worker attendees; return a result dict."""
+    from google.appengine.api import datastore_errors
+    from google.appengine.ext import ndb
+
+    import conference
+    import seats
+    from models import Conference, Profile
+
+    tb = benchutils.activateTestbed()
+    takeSeats = seats.takeSeats
+
+    def slowTakeSeats(shard_key, count=1):
+        # hold the shard's & registration's groups open, as a commit would
+        taken = takeSeats(shard_key, count)
+        time.sleep(commit_delay)
+        return taken
+    seats.takeSeats = slowTakeSeats
+    try:
+        attendees = workers * per_worker
+        p_key = ndb.Key(Profile, 'organizer')
+        conf = Conference(parent=p_key, name='Flash Sale Conf',
+                          maxAttendees=attendees, seatsAvailable=attendees,
+                          seatShards=num_shards)
+        conf.put()
+        wsck = conf.key.urlsafe()
+        seats.createShards(conf.key, attendees, num_shards=num_shards)
+        ndb.put_multi([Profile(id='attendee-%d' % i) for i in range(attendees)])
+        counter = benchutils.RpcCounter().install()
+
+        stats = {'registered': 0, 'collisions': 0, 'failed': 0}
+        calls = [0]
+        lock = threading.Lock()
+
+        def worker(n):
+            api = conference.ConferenceApi()
+            for i in range(per_worker):
+                p_key = ndb.Key(Profile, 'attendee-%d' % (n * per_worker + i))
+                # _conferenceRegistration's loop, minus the signed-in user
+                registered = False
+                for attempt in range(conference.SEAT_ALLOCATION_RETRIES):
+                    shard_key = seats.pickShard(conf)
+                    if not shard_key:
+                        break
+                    with lock:
+                        calls[0] += 1
+                    try:
+                        registered = bool(api._seatTransaction(
+                            p_key, wsck, shard_key, True))
+                    except datastore_errors.TransactionFailedError:
+                        continue
+                    if registered:
+                        break
+                with lock:
+                    stats['registered' if registered else 'failed'] += 1
+
+        threads = [threading.Thread(target=worker, args=(n,))
+                   for n in range(workers)]
+        with benchutils.Timer() as timer:
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+
+        # every transaction attempt past the first of each call collided
+        stats['collisions'] = \
+            counter.counts['datastore_v3.BeginTransaction'] - calls[0]
+        stats['shards'] = num_shards
+        stats['seconds'] = timer.elapsed
+        stats['perSecond'] = stats['registered'] / timer.elapsed
+        stats['seatsLeft'] = seats.countSeats(conf.key, num_shards)
+        return stats
+    finally:
+        seats.takeSeats = takeSeats
+        tb.deactivate()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--sdk', default=benchutils.DEFAULT_SDK)
+    parser.add_argument('--shards', default='1,5,20')
+    parser.add_argument('--workers', type=int, default=20)
+    parser.add_argument('--per-worker', type=int, default=10)
+    parser.add_argument('--commit-delay', type=float, default=0.02)
+    args = parser.parse_args()
+    benchutils.setupPaths(args.sdk)
+
+    print '%6s %10s %10s %8s %10s %8s' % (
+        'shards', 'registered', 'collisions', 'failed', 'seconds', 'reg/s')
+    for num_shards in [int(n) for n in args.shards.split(',')]:
+        r = runOnce(num_shards, args.workers, args.per_worker, args.commit_delay)
+        print '%6d %10d %10d %8d %10.2f %8.1f' % (
+            r['shards'], r['registered'], r['collisions'], r['failed'],
+            r['seconds'], r['perSecond'])
+
+
+if __name__ == '__main__':
+    main()
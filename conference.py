@@ -13,40 +13,67 @@ created by wesc on 2014 apr 21
 __author__ = 'wesc+api@google.com (Wesley Chun)'
 
 
+import collections
 from datetime import datetime
+import logging
+import time
 
 import endpoints
 from protorpc import messages
 from protorpc import message_types
+from protorpc import protojson
 from protorpc import remote
 
 from google.appengine.ext import ndb
+from google.appengine.datastore.datastore_query import Cursor
 from google.appengine.api import memcache
 from google.appengine.api import taskqueue
 
 from models import Profile
 from models import ProfileMiniForm
 from models import ProfileForm
-from models import TeeShirtSize
 
 from models import Conference
 from models import ConferenceForm
 from models import Session
 from models import SessionForm
 from models import SessionForms
+from models import SessionTypes
+from models import SLOT_MINUTES
+from models import slotLabel
 from models import SpeakerForm
 from models import Speaker
+from models import SpeakerSessions
+from models import FeaturedSpeaker
+from models import FeaturedSpeakerForm
 
 from models import ConferenceForms
 from models import ConferenceQueryForm
 from models import ConferenceQueryForms
 
+from models import AttendeeForm
+from models import AttendeeForms
+from models import Registration
+from models import RegistrationIntent
+from models import RegistrationStatus
+from models import RegistrationTicketForm
+
 from models import BooleanMessage
+from models import BulkResultForm
+from models import BulkResultForms
 from models import ConflictException
 
 from models import StringMessage
 
-from utils import getUserId
+import announcements
+import confirmations
+import metrics
+import profiles
+import queryplan
+import search
+import seats
+import serializers
+import timeline
 
 from settings import WEB_CLIENT_ID
 from settings import ANDROID_CLIENT_ID
@@ -56,9 +83,45 @@ from settings import ANDROID_AUDIENCE
 EMAIL_SCOPE = endpoints.EMAIL_SCOPE
 API_EXPLORER_CLIENT_ID = endpoints.API_EXPLORER_CLIENT_ID
 
-MEMCACHE_ANNOUNCEMENTS_KEY = "RECENT_ANNOUNCEMENTS"
-ANNOUNCEMENT_TPL = ('Last chance to attend! The following conferences '
-                    'are nearly sold out: %s')
+MEMCACHE_CONFERENCE_KEY = "CONFERENCE_FORM_V2:%s"   # (encoded form, seatShards)
+CONFERENCE_CACHE_TIME = 600     # seconds
+ORGANIZER_FANOUT_BATCH = 100
+MEMCACHE_FEATURED_KEY = "FEATURED_SPEAKER:%s"
+FEATURED_LATEST = 'latest'
+FEATURED_MIN_SESSIONS = 2
+FEATURED_SPEAKER_DELAY = 2      # seconds; recomputes of one conference coalesce
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+SEAT_ALLOCATION_RETRIES = 5
+MAX_BULK_ITEMS = 500
+BULK_PUT_CHUNK = 500        # entities per datastore put
+BULK_TASK_CHUNK = 100       # tasks per Queue.add
+XG_SPEAKER_GROUPS = 24      # speakers per xg transaction, besides the conference
+
+MAX_SESSION_RESULTS = 500
+MAX_WISHLIST_CHANGES = 100
+RESAVE_BATCH_SIZE = 200
+
+REGISTRATION_QUEUE = 'registrations'
+REGISTRATION_BATCH_SIZE = 20        # xg transactions span <= 25 entity groups
+REGISTRATION_WORKER_INTERVAL = 1    # seconds
+REGISTRATION_MAX_BATCHES = 50       # per worker run
+MIGRATION_BATCH_SIZE = 50           # profiles per registration migration task
+
+# form fields a datastore projection can serve, with their model-to-form
+# converters; repeated & unindexed properties can't be projected
+CONFERENCE_PROJECTIONS = {
+    'name': None,
+    'description': None,
+    'organizerUserId': None,
+    'city': None,
+    'startDate': str,
+    'endDate': str,
+    'month': None,
+    'maxAttendees': None,
+    'seatsAvailable': None,
+}
 
 #- - - - - - - - - - - - - - - - - - - - - - - - - 
 
@@ -90,20 +153,54 @@ CONF_GET_REQUEST = endpoints.ResourceContainer(
     websafeConferenceKey=messages.StringField(1),
 )
 
+CONF_PAGE_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeConferenceKey=messages.StringField(1),
+    pageSize=messages.IntegerField(2),
+    pageToken=messages.StringField(3),
+)
+
+PAGE_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    pageSize=messages.IntegerField(1),
+    pageToken=messages.StringField(2),
+)
+
+SEARCH_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    query=messages.StringField(1),
+    pageSize=messages.IntegerField(2),
+    pageToken=messages.StringField(3),
+)
+
 CONF_POST_REQUEST = endpoints.ResourceContainer(
     ConferenceForm,
     websafeConferenceKey=messages.StringField(1),
 )
 
-SESSION_GET_REQUEST = endpoints.ResourceContainer(
-    SessionForm,
+REGISTRATION_STATUS_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    ticket=messages.StringField(1, required=True),
+)
+
+SESSION_LIST_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
     websafeConferenceKey=messages.StringField(1),
+    fields=messages.StringField(2, repeated=True),
 )
 
 SESSION_BY_TYPE = endpoints.ResourceContainer(
     message_types.VoidMessage,
     websafeConferenceKey=messages.StringField(1),
     type=messages.StringField(2),
+    fields=messages.StringField(3, repeated=True),
+)
+
+SESSION_PAGE_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeConferenceKey=messages.StringField(1),
+    pageSize=messages.IntegerField(2),
+    pageToken=messages.StringField(3),
 )
 
 SESSION_POST_REQUEST = endpoints.ResourceContainer(
@@ -111,16 +208,48 @@ SESSION_POST_REQUEST = endpoints.ResourceContainer(
     websafeConferenceKey=messages.StringField(1, required=True),
 )
 
+SESSIONS_POST_REQUEST = endpoints.ResourceContainer(
+    SessionForms,
+    websafeConferenceKey=messages.StringField(1, required=True),
+)
+
+SESSION_QUERY_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeConferenceKey=messages.StringField(1),
+    sessionDate=messages.StringField(2),
+    startsFrom=messages.StringField(3),
+    startsBefore=messages.StringField(4),
+    excludeTypes=messages.StringField(5, repeated=True),
+    pageSize=messages.IntegerField(6),
+    pageToken=messages.StringField(7),
+)
+
 SESSION_BY_SPEAKER = endpoints.ResourceContainer(
     message_types.VoidMessage,
     speakerKey=messages.StringField(1),
 )
 
+FEATURED_SPEAKER_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeConferenceKey=messages.StringField(1),
+)
+
 SESSION_WISHLIST = endpoints.ResourceContainer(
     message_types.VoidMessage,
     websafeSessionKey=messages.StringField(1),
 )
 
+WISHLIST_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeConferenceKey=messages.StringField(1),
+)
+
+WISHLIST_UPDATE_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    add=messages.StringField(1, repeated=True),
+    remove=messages.StringField(2, repeated=True),
+)
+
 
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
@@ -134,30 +263,116 @@ class ConferenceApi(remote.Service):
 
     def _copyConferenceToForm(self, conf, displayName):
         """Copy relevant fields from Conference to ConferenceForm."""
-        cf = ConferenceForm()
-        for field in cf.all_fields():
-            if hasattr(conf, field.name):
-                # convert Date to date string; just copy others
-                if field.name.endswith('Date'):
-                    setattr(cf, field.name, str(getattr(conf, field.name)))
-                else:
-                    setattr(cf, field.name, getattr(conf, field.name))
-            elif field.name == "websafeKey":
-                setattr(cf, field.name, conf.key.urlsafe())
+        cf = serializers.serialize(conf, ConferenceForm)
         if displayName:
-            setattr(cf, 'organizerDisplayName', displayName)
-        cf.check_initialized()
+            cf.organizerDisplayName = displayName
         return cf
 
 
-    def _createConferenceObject(self, request):
-        """Create or update Conference object, returning ConferenceForm/request."""
-        # preload necessary data items
-        user = endpoints.get_current_user()
-        if not user:
-            raise endpoints.UnauthorizedException('Authorization required')
-        user_id = getUserId(user)
+    def _getConferenceForms(self, conf_keys, conferences=None):
+        """Return ConferenceForms for conf_keys, read through memcache."""
+        return self._getConferenceFormsAsync(conf_keys, conferences).get_result()
+
+
+    @ndb.tasklet
+    def _getConferenceFormsAsync(self, conf_keys, conferences=None):
+        """Tasklet returning ConferenceForms for conf_keys, read through memcache.
+
+        Forms come back in the order of conf_keys; conferences that no
+        longer exist are left out.  Seat totals are overlaid afterwards,
+        so registrations don't have to rewrite the cached forms.  Cache
+        misses are built from conferences, if the caller already has them.
+        """
+        ctx = ndb.get_context()
+        wscks = [key.urlsafe() for key in conf_keys]
+        # cached forms & seat totals are batched into one memcache RPC
+        encoded, counts = yield (
+            [ctx.memcache_get(MEMCACHE_CONFERENCE_KEY % wsck) for wsck in wscks],
+            [ctx.memcache_get(seats.MEMCACHE_SEATS_KEY % wsck) for wsck in wscks])
+        forms = dict((wsck, protojson.decode_message(ConferenceForm, value[0]))
+                     for wsck, value in zip(wscks, encoded) if value is not None)
+        # only sharded conferences keep their seat total in memcache
+        sharded = set(wsck for wsck, value in zip(wscks, encoded)
+                      if value is not None and value[1])
+
+        missing = [key for key, wsck in zip(conf_keys, wscks) if wsck not in forms]
+        if missing:
+            if conferences is None:
+                conferences = yield ndb.get_multi_async(missing)
+            else:
+                missing = set(missing)
+                conferences = [conf for conf in conferences if conf.key in missing]
+            conferences = [conf for conf in conferences if conf]
+            names = yield self._getOrganizerNamesAsync(conferences)
+            cached = []
+            for conf in conferences:
+                cf = self._copyConferenceToForm(conf, names.get(conf.organizerUserId))
+                forms[cf.websafeKey] = cf
+                if conf.seatShards:
+                    sharded.add(cf.websafeKey)
+                cached.append(ctx.memcache_set(MEMCACHE_CONFERENCE_KEY % cf.websafeKey,
+                    (protojson.encode_message(cf), conf.seatShards),
+                    time=CONFERENCE_CACHE_TIME))
+            yield cached
+
+        # expired seat totals are recounted from the shards, so a cached
+        # form never shows its stale seatsAvailable; an unsharded
+        # conference's form holds its seat count already
+        uncounted = [key for key, wsck, count in zip(conf_keys, wscks, counts)
+                     if wsck in sharded and count is None]
+        if uncounted:
+            known = dict((conf.key, conf) for conf in conferences or ())
+            fetched = yield ndb.get_multi_async(
+                [key for key in uncounted if key not in known])
+            known.update((conf.key, conf) for conf in fetched if conf)
+            recounted = yield [seats.countSeatsAsync(known[key])
+                               for key in uncounted if key in known]
+            recounted = dict(zip([key.urlsafe() for key in uncounted if key in known],
+                                 recounted))
+            counts = [recounted.get(wsck, count) for wsck, count in zip(wscks, counts)]
+
+        items = []
+        for wsck, count in zip(wscks, counts):
+            if wsck in forms:
+                if count is not None:
+                    forms[wsck].seatsAvailable = int(count)
+                items.append(forms[wsck])
+        raise ndb.Return(items)
+
+
+    @ndb.tasklet
+    def _getOrganizerNamesAsync(self, conferences):
+        """Tasklet returning {organizerUserId: displayName} for conferences
+        created before organizerDisplayName was stored on the Conference."""
+        organisers = set(ndb.Key(Profile, conf.organizerUserId)
+                         for conf in conferences if conf.organizerDisplayName is None)
+        names = {}
+        for profile in (yield ndb.get_multi_async(organisers)):
+            if profile:
+                names[profile.key.id()] = profile.displayName
+        raise ndb.Return(names)
+
+
+    def _cacheConferenceForm(self, cf, seatShards):
+        """Store a freshly written ConferenceForm in memcache."""
+        memcache.set(MEMCACHE_CONFERENCE_KEY % cf.websafeKey,
+                     (protojson.encode_message(cf), seatShards),
+                     time=CONFERENCE_CACHE_TIME)
+
 
+    @staticmethod
+    def _ensureShards(conf):
+        """seats.ensureShards, dropping the cached form of a conference
+        that has just been sharded, as it says there are no shards."""
+        sharded = seats.ensureShards(conf)
+        if sharded.seatShards and not conf.seatShards:
+            memcache.delete(MEMCACHE_CONFERENCE_KEY % conf.key.urlsafe())
+        return sharded
+
+
+    def _conferenceFromForm(self, request):
+        """Check a ConferenceForm & convert it into Conference fields,
+        filling in defaults on both; raises BadRequestException."""
         if not request.name:
             raise endpoints.BadRequestException("Conference 'name' field required")
 
@@ -173,19 +388,33 @@ class ConferenceApi(remote.Service):
                 setattr(request, df, DEFAULTS[df])
 
         # convert dates from strings to Date objects; set month based on start_date
-        if data['startDate']:
-            data['startDate'] = datetime.strptime(data['startDate'][:10], "%Y-%m-%d").date()
-            data['month'] = data['startDate'].month
-        else:
-            data['month'] = 0
-        if data['endDate']:
-            data['endDate'] = datetime.strptime(data['endDate'][:10], "%Y-%m-%d").date()
+        try:
+            if data['startDate']:
+                data['startDate'] = datetime.strptime(data['startDate'][:10], "%Y-%m-%d").date()
+                data['month'] = data['startDate'].month
+            else:
+                data['month'] = 0
+            if data['endDate']:
+                data['endDate'] = datetime.strptime(data['endDate'][:10], "%Y-%m-%d").date()
+        except ValueError:
+            raise endpoints.BadRequestException("Dates must be given as YYYY-MM-DD.")
 
         # set seatsAvailable to be same as maxAttendees on creation
         # both for data model & outbound Message
         if data["maxAttendees"] > 0:
             data["seatsAvailable"] = data["maxAttendees"]
             setattr(request, "seatsAvailable", data["maxAttendees"])
+            data['seatShards'] = seats.numShardsFor(data['maxAttendees'])
+        return data
+
+
+    def _createConferenceObject(self, request):
+        """Create or update Conference object, returning ConferenceForm/request."""
+        # preload necessary data items
+        ctx = self._requestContext()
+        user = ctx.requireUser()
+        user_id = ctx.userId
+        data = self._conferenceFromForm(request)
 
         # make Profile Key from user ID
         p_key = ndb.Key(Profile, user_id)
@@ -195,23 +424,100 @@ class ConferenceApi(remote.Service):
         c_key = ndb.Key(Conference, c_id, parent=p_key)
         data['key'] = c_key
         data['organizerUserId'] = request.organizerUserId = user_id
+        # store organizer's name so listings needn't read the Profile
+        data['organizerDisplayName'] = request.organizerDisplayName = getattr(
+            ctx.getProfile(create=False), 'displayName', None) or user.nickname()
 
-        # create Conference & return (modified) ConferenceForm
-        Conference(**data).put()
-        #adding confirmation email sending task to queue
-        taskqueue.add(params={'email': user.email(),
-            'conferenceInfo': repr(request)},
-            url='/tasks/send_confirmation_email'
-        )
+        # create Conference & its seat shards & return (modified) ConferenceForm
+        conf = Conference(**data)
+        conf.put()
+        if data.get('seatShards'):
+            seats.createShards(c_key, data['maxAttendees'],
+                num_shards=data['seatShards'])
+        self._cacheConferenceForm(self._copyConferenceToForm(conf, None),
+                                  conf.seatShards)
+        announcements.seatsChanged(conf, conf.seatsAvailable)
+        #queue confirmation for the organizer's next digest & search indexing
+        confirmations.enqueueConfirmations(
+            [confirmations.confirmationTask(user.email(), request)])
+        search.reindexTask(c_key).add()
 
         return request
 
+
+    def _createConferenceObjects(self, request):
+        """Create many Conferences at once, returning a result per item.
+
+        IDs are allocated in one call, conferences and their seat shards
+        written with put_multi in chunks, forms cached with one memcache
+        call and tasks enqueued with batched Queue.add calls.
+        """
+        ctx = self._requestContext()
+        user = ctx.requireUser()
+        user_id = ctx.userId
+        if len(request.items) > MAX_BULK_ITEMS:
+            raise endpoints.BadRequestException(
+                'At most %d conferences per request.' % MAX_BULK_ITEMS)
+
+        results = [BulkResultForm(index=i) for i in range(len(request.items))]
+        valid = []
+        for i, form in enumerate(request.items):
+            try:
+                valid.append((i, form, self._conferenceFromForm(form)))
+            except endpoints.BadRequestException as e:
+                results[i].error = str(e)
+        if not valid:
+            return BulkResultForms(items=results, created=0)
+
+        p_key = ndb.Key(Profile, user_id)
+        first, last = Conference.allocate_ids(size=len(valid), parent=p_key)
+        displayName = getattr(ctx.getProfile(create=False), 'displayName', None) \
+            or user.nickname()
+
+        conferences = []
+        shards = []
+        tasks = []
+        confirmed = []
+        for (i, form, data), c_id in zip(valid, range(first, last + 1)):
+            data['key'] = ndb.Key(Conference, c_id, parent=p_key)
+            data['organizerUserId'] = form.organizerUserId = user_id
+            data['organizerDisplayName'] = form.organizerDisplayName = displayName
+            conf = Conference(**data)
+            conferences.append(conf)
+            if conf.seatShards:
+                shards.extend(seats.newShards(conf.key, conf.maxAttendees,
+                    num_shards=conf.seatShards))
+            confirmed.append(confirmations.confirmationTask(user.email(), form))
+            tasks.append(search.reindexTask(conf.key))
+            results[i].websafeKey = conf.key.urlsafe()
+
+        # a put may hold at most BULK_PUT_CHUNK entities; chunks go out together
+        entities = conferences + shards
+        ndb.Future.wait_all([future
+            for start in range(0, len(entities), BULK_PUT_CHUNK)
+            for future in ndb.put_multi_async(entities[start:start + BULK_PUT_CHUNK])])
+
+        memcache.set_multi(dict(
+            (MEMCACHE_CONFERENCE_KEY % conf.key.urlsafe(),
+             (protojson.encode_message(self._copyConferenceToForm(conf, None)),
+              conf.seatShards))
+            for conf in conferences), time=CONFERENCE_CACHE_TIME)
+        memcache.set_multi(dict(
+            (seats.MEMCACHE_SEATS_KEY % conf.key.urlsafe(), conf.seatsAvailable)
+            for conf in conferences if conf.seatShards), time=seats.SEATS_CACHE_TIME)
+        queue = taskqueue.Queue()
+        for start in range(0, len(tasks), BULK_TASK_CHUNK):
+            queue.add(tasks[start:start + BULK_TASK_CHUNK])
+        announcements.seatsChangedMulti(
+            [(conf, conf.seatsAvailable) for conf in conferences])
+        # one digest will confirm the whole import
+        confirmations.enqueueConfirmations(confirmed)
+
+        return BulkResultForms(items=results, created=len(conferences))
+
     @ndb.transactional()
     def _updateConferenceObject(self, request):
-        user = endpoints.get_current_user()
-        if not user:
-            raise endpoints.UnauthorizedException('Authorization required')
-        user_id = getUserId(user)
+        user_id = self._getUserId()
         data = {field.name: getattr(request, field.name) for field in request.all_fields()}
         conf = ndb.Key(urlsafe=request.websafeConferenceKey).get()
         if not conf:
@@ -221,6 +527,8 @@ class ConferenceApi(remote.Service):
             raise endpoints.ForbiddenException(
                 'Only the owner can update the conference.')
         for field in request.all_fields():
+            if field.name in ('organizerUserId', 'organizerDisplayName'):
+                continue
             data = getattr(request, field.name)
             if data not in (None, []):
                 if field.name in ('startDate', 'endDate'):
@@ -229,122 +537,285 @@ class ConferenceApi(remote.Service):
                         conf.month = data.month
                 setattr(conf, field.name, data)
         conf.put()
-        prof = ndb.Key(Profile, user_id).get()
-        return self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
+        search.scheduleReindex(conf.key, transactional=True)
+        cf = self._copyConferenceToForm(conf, None)
+        # refresh the cached form only once the update has committed
+        seatShards = conf.seatShards
+        ndb.get_context().call_on_commit(
+            lambda: self._cacheConferenceForm(cf, seatShards))
+        return cf
 
 # - - - - - - - - Session Objects - - - - - - - - - - - - -
 
-    def _copySessionToForm(self, session, name=None):
+    def _copySessionToForm(self, session):
         """Copy relevant fields from Session to SessionForm."""
-        session_form = SessionForm()
-        for field in session_form.all_fields():
-            if hasattr(session, field.name):
-                # convert typeOfSession to enum SessionTypes; just copy others
-                if field.name == 'typeOfSession':
-                    setattr(session_form, field.name, getattr(SessionTypes, str(getattr(session,field.name))))
-                else:
-                    setattr(session_form, field.name, getattr(session,field.name))
-            elif field.name == "websafeKey":
-                setattr(session_form, field.name, session.key.urlsafe())
-            elif field.name == "speakerDisplayName":
-                setattr(session_form, field.name, name)
-
-            # convert startDateTime from session model to date and startTime for session Form
-            startDateTime = getattr(session, 'startDateTime')
-            if startDateTime:
-                if field.name == 'date':
-                    setattr(session_form, field.name, str(startDateTime.date()))
-                if hasattr(session, 'startDateTime') and field.name == 'startTime':
-                    setattr(session_form, field.name, str(startDateTime.time().strftime('%H:%M')))
-        session_form.check_initialized()
-        return session_form
+        return serializers.serialize(session, SessionForm)
 
     def _createSessionObject(self, request):
-        user = endpoints.get_current_user()
-        if not user:
-            raise endpoints.UnauthorizedException('Authorization required')
-        user_id = getUserId(user)
-
-        if not request.name:
-            raise endpoints.BadRequestException("Session 'name' field required")
-
-        # copy SessionForm/ProtoRPC Message into dict
-        data = {field.name: getattr(request, field.name) for field in request.all_fields()}
-        del data['websafeConferenceKey']
-        del data['websafeKey']
-    
-        # add default values for those missing (both data model & outbound Message)
-        for defaultValue in SESSION_DEFAULTS:
-            if data[defaultValue] in (None, []):
-                data[default] = SESSION_DEFAULTS[defaultValue]
-                setattr(request, defaulValue, SESSION_DEFAULTS[defaulValue])
-
-        if data['typeOfSession']==None:
-            del data['typeOfSession']
-        else:
-            data['typeOfSession'] = str(data['typeOfSession'])
-
-        # set start time and date to be next available when not explicit
-        if data['startTime'] and data['date']:
-            data['startDateTime'] = datetime.strptime(data['date'][:10] + ' ' + data['startTime'][:5], "%Y-%m-%d %H:%M")
-        del data['startTime']
-        del data['date']
+        """Create Session object, returning SessionForm."""
+        return self._createSessionAsync(request).get_result()
+
+    @ndb.tasklet
+    def _createSessionAsync(self, request):
+        """Tasklet creating a Session; the conference & speaker reads and the
+        ID allocation run concurrently."""
+        user_id = self._getUserId()
+
+        if not request.sessionName:
+            raise endpoints.BadRequestException("Session 'sessionName' field required")
+        if not request.speakerUserId:
+            raise endpoints.BadRequestException("Session 'speakerUserId' field required")
+
+        try:
+            c_key = ndb.Key(urlsafe=request.websafeConferenceKey)
+            sp_key = ndb.Key(urlsafe=request.speakerUserId)
+        except Exception:
+            raise endpoints.BadRequestException(
+                'Invalid conference or speaker key.')
 
-        # get the conference for session
-        c_key = ndb.Key(urlsafe=request.websafeConferenceKey).get()
+        # get the conference & speaker for session, and generate Session
+        # ID as child of Conference, all at once
+        conf, speaker, s_ids = yield (c_key.get_async(), sp_key.get_async(),
+            Session.allocate_ids_async(size=1, parent=c_key))
 
         # check that conf.key is a Conference key and it exists
-        if not c_key:
+        if c_key.kind() != 'Conference' or not conf:
             raise endpoints.NotFoundException(
                 'Hold up! No conference with key %s' % request.websafeConferenceKey)
 
         # check that user is owner
-        if user_id != c_key.organizerUserId:
+        if user_id != conf.organizerUserId:
             raise endpoints.ForbiddenException(
                 'Only the owner can update the conference.')
 
-        # generate Session key as child of Conference
-        s_id = Session.allocate_ids(size=1, parent=c_key.key)[0]
-        s_key = ndb.Key(Session, s_id, parent=c_key.key)
-        data['key'] = s_key
+        # check that speaker.key is a speaker key and it exists
+        if sp_key.kind() != 'Speaker' or not speaker:
+            raise endpoints.NotFoundException(
+                'Hold up! No speaker with key %s' % request.speakerUserId)
+
+        data = self._sessionFromForm(request, speaker)
+        data['key'] = ndb.Key(Session, s_ids[0], parent=c_key)
+        session = Session(**data)
+        # write the session & its speaker's index together
+        yield ndb.transaction_async(lambda: self._putSpeakerBatchAsync(
+            c_key, [(speaker, [session])]), xg=True)
+        search.scheduleReindex(c_key)
+        self._scheduleFeaturedSpeaker(c_key.urlsafe(), request.speakerUserId)
+        raise ndb.Return(self._copySessionToForm(session))
+
+    @ndb.tasklet
+    def _putSessionsAsync(self, sessions, speaker):
+        """Tasklet writing new sessions of one speaker along with the
+        speaker's SpeakerSessions; run it inside an xg transaction."""
+        index_key = SpeakerSessions.keyFor(speaker.key)
+        index = yield index_key.get_async()
+        index = index or SpeakerSessions(key=index_key)
+        index.sessionKeys.extend(session.key for session in sessions)
+        yield ndb.put_multi_async(sessions + [index])
+        raise ndb.Return(index)
+
+
+    @ndb.tasklet
+    def _putSpeakerBatchAsync(self, c_key, batch):
+        """Tasklet writing [(speaker, sessions)] of one conference with
+        their speaker indexes, and marking its timeline stale; run it
+        inside an xg transaction."""
+        yield ([self._putSessionsAsync(sessions, speaker)
+                for speaker, sessions in batch] + [timeline.bumpAsync(c_key)])
+
+
+    def _sessionFromForm(self, request, speaker):
+        """Convert a SessionForm, given by speaker, into Session fields;
+        raises BadRequestException."""
+        # copy SessionForm/ProtoRPC Message into dict
+        data = {field.name: getattr(request, field.name) for field in request.all_fields()
+                if field.name not in ('websafeConferenceKey', 'websafeKey', 'speakerUserId')}
+        data['speaker'] = [request.speakerUserId]
+        data['speakerDisplayName'] = speaker.displayName
+
+        # convert enum to its name, date & time strings to Date & Time objects
+        if data['typeOfSession']:
+            data['typeOfSession'] = [str(data['typeOfSession'])]
+        else:
+            del data['typeOfSession']
+        try:
+            if data['sessionDate']:
+                data['sessionDate'] = datetime.strptime(data['sessionDate'][:10], "%Y-%m-%d").date()
+            if data['startTime']:
+                data['startTime'] = datetime.strptime(data['startTime'][:5], "%H:%M").time()
+        except ValueError:
+            raise endpoints.BadRequestException(
+                "Give 'sessionDate' as YYYY-MM-DD and 'startTime' as HH:MM.")
+        return data
 
-        # get the speakerDisplayName from Speaker entity if a speakerKey was provided
-        if data['speakerKey']:
-            speaker = ndb.Key(urlsafe=request.s_key).get()
 
-            # check that speaker.key is a speaker key and it exists
-            if not s_key:
-                raise endpoints.NotFoundException(
-                'Hold up! No speaker with key %s' % request.websafeConferenceKey)
+    def _createSessionObjects(self, request):
+        """Create many Sessions of one conference at once, returning a
+        result per item; one ID allocation, one speaker read and chunked
+        put_multi calls in all."""
+        user_id = self._getUserId()
+        if len(request.items) > MAX_BULK_ITEMS:
+            raise endpoints.BadRequestException(
+                'At most %d sessions per request.' % MAX_BULK_ITEMS)
+
+        try:
+            c_key = ndb.Key(urlsafe=request.websafeConferenceKey)
+        except Exception:
+            c_key = None
+        conf = c_key.get() if c_key and c_key.kind() == 'Conference' else None
+        if not conf:
+            raise endpoints.NotFoundException(
+                'Hold up! No conference with key %s' % request.websafeConferenceKey)
+        if user_id != conf.organizerUserId:
+            raise endpoints.ForbiddenException(
+                'Only the owner can update the conference.')
 
-            data['speakerDisplayName'] = speaker.displayName
+        # read every distinct speaker once
+        results = [BulkResultForm(index=i) for i in range(len(request.items))]
+        sp_keys = {}
+        for form in request.items:
+            try:
+                sp_key = ndb.Key(urlsafe=form.speakerUserId)
+            except Exception:
+                continue
+            if sp_key.kind() == 'Speaker':
+                sp_keys[form.speakerUserId] = sp_key
+        speakers = dict(zip(sp_keys.keys(), ndb.get_multi(sp_keys.values())))
+
+        valid = []
+        for i, form in enumerate(request.items):
+            try:
+                if not form.sessionName:
+                    raise endpoints.BadRequestException(
+                        "Session 'sessionName' field required")
+                speaker = speakers.get(form.speakerUserId)
+                if not speaker:
+                    raise endpoints.BadRequestException(
+                        'No speaker with key %s' % form.speakerUserId)
+                valid.append((i, self._sessionFromForm(form, speaker)))
+            except endpoints.BadRequestException as e:
+                results[i].error = str(e)
+        if not valid:
+            return BulkResultForms(items=results, created=0)
+
+        first, last = Session.allocate_ids(size=len(valid), parent=c_key)
+        by_speaker = {}
+        for (i, data), s_id in zip(valid, range(first, last + 1)):
+            data['key'] = ndb.Key(Session, s_id, parent=c_key)
+            by_speaker.setdefault(data['speaker'][0], []).append(Session(**data))
+            results[i].websafeKey = data['key'].urlsafe()
+
+        # each transaction writes sessions with their speakers' indexes:
+        # the conference's entity group plus up to XG_SPEAKER_GROUPS
+        # speakers', and at most BULK_PUT_CHUNK entities
+        batch = []
+        batch_size = 0
+        for speaker_id, sessions in sorted(by_speaker.items()):
+            if batch and (len(batch) == XG_SPEAKER_GROUPS or
+                          batch_size + len(sessions) + 1 > BULK_PUT_CHUNK):
+                ndb.transaction(lambda: self._putSpeakerBatchAsync(
+                    c_key, batch).get_result(), xg=True)
+                batch, batch_size = [], 0
+            batch.append((speakers[speaker_id], sessions))
+            batch_size += len(sessions) + 1
+        if batch:
+            ndb.transaction(lambda: self._putSpeakerBatchAsync(
+                c_key, batch).get_result(), xg=True)
+        search.scheduleReindex(c_key)
+        self._scheduleFeaturedSpeaker(c_key.urlsafe())
+        return BulkResultForms(items=results, created=len(valid))
+
+# - - - - - - - - Speaker Objects - - - - - - - - - - - - -
+
+    def _copySpeakerToForm(self, speaker):
+        """Copy relevant fields from Speaker to SpeakerForm."""
+        return serializers.serialize(speaker, SpeakerForm)
 
 # - - - - - - - - - Query and Filter Objects - - - - - - - - - -
 
     def _getQuery(self, request):
-        """Return formatted query from the submitted filters."""
-        q = Conference.query()
-        inequality_filter, filters = self._formatFilters(request.filters)
-
-        # If exists, sort on inequality filter first
-        if not inequality_filter:
-            q = q.order(Conference.name)
-        else:
-            q = q.order(ndb.GenericProperty(inequality_filter))
-            q = q.order(Conference.name)
-
-        for filtr in filters:
-            if filtr["field"] in ["month", "maxAttendees"]:
-                filtr["value"] = int(filtr["value"])
-            formatted_query = ndb.query.FilterNode(filtr["field"], filtr["operator"], filtr["value"])
-            q = q.filter(formatted_query)
-        return q
+        """Return a QueryPlan for the submitted filters."""
+        queryPlan = queryplan.plan(Conference,
+            self._formatFilters(request.filters), Conference.name)
+        logging.debug('queryConferences plan: %s', queryPlan.describe())
+        return queryPlan
+
+
+    def _pageArgs(self, pageSize, pageToken, default=DEFAULT_PAGE_SIZE,
+                  maximum=MAX_PAGE_SIZE):
+        """Check paging fields; return (page size, start Cursor or None)."""
+        pageSize = min(pageSize or default, maximum)
+        if pageSize < 1:
+            raise endpoints.BadRequestException("'pageSize' must be positive.")
+        try:
+            cursor = Cursor(urlsafe=pageToken) if pageToken else None
+        except Exception:
+            raise endpoints.BadRequestException("Invalid 'pageToken'.")
+        return pageSize, cursor
+
+
+    def _fetchPage(self, query, pageSize, pageToken, default=DEFAULT_PAGE_SIZE,
+                   maximum=MAX_PAGE_SIZE, **options):
+        """Fetch one page of query results, returning (items, nextPageToken)."""
+        pageSize, cursor = self._pageArgs(pageSize, pageToken, default, maximum)
+        items, next_cursor, more = query.fetch_page(pageSize,
+            start_cursor=cursor, **options)
+        nextPageToken = next_cursor.urlsafe() if (more and next_cursor) else None
+        return items, nextPageToken
+
+
+    def _parseFieldMask(self, form_cls, fields):
+        """Check a field mask against form_cls; return the set of field
+        names to send back (always with websafeKey), or None for all."""
+        if not fields:
+            return None
+        mask = set(fields)
+        unknown = mask.difference(field.name for field in form_cls.all_fields())
+        if unknown:
+            raise endpoints.BadRequestException(
+                "Unknown field(s) in mask: %s" % ', '.join(sorted(unknown)))
+        mask.add('websafeKey')
+        return mask
+
+
+    def _projectionFor(self, mask, projections, needed=(), excluded=()):
+        """Return the properties to project for a field mask, or None when
+        a projection query can't serve it."""
+        if not mask:
+            return None
+        props = (mask - set(['websafeKey'])).union(needed)
+        if not props or not props.issubset(projections) or props.intersection(excluded):
+            return None
+        return sorted(props)
+
+
+    def _copyProjectionToForm(self, entity, form_cls, mask, projections):
+        """Copy the masked fields of a projected entity into a sparse form."""
+        form = form_cls()
+        for name in mask:
+            if name == 'websafeKey':
+                form.websafeKey = entity.key.urlsafe()
+                continue
+            value = getattr(entity, name)
+            if value is not None and projections[name]:
+                value = projections[name](value)
+            setattr(form, name, value)
+        return form
+
+
+    def _maskForms(self, forms, mask):
+        """Clear the fields of forms that are not in the field mask."""
+        if mask:
+            for form in forms:
+                for field in form.all_fields():
+                    if field.name not in mask:
+                        form.reset(field.name)
+        return forms
 
 
     def _formatFilters(self, filters):
         """Parse, check validity and format user supplied filters."""
         formatted_filters = []
-        inequality_field = None
 
         for f in filters:
             filtr = {field.name: getattr(f, field.name) for field in f.all_fields()}
@@ -355,18 +826,16 @@ class ConferenceApi(remote.Service):
             except KeyError:
                 raise endpoints.BadRequestException("Filter contains invalid field or operator.")
 
-            # Every operation except "=" is an inequality
-            if filtr["operator"] != "=":
-                # check if inequality operation has been used in previous filters
-                # disallow the filter if inequality was performed on a different field before
-                # track the field on which the inequality operation is performed
-                if inequality_field and inequality_field != filtr["field"]:
-                    raise endpoints.BadRequestException("Inequality filter is allowed on only one field.")
-                else:
-                    inequality_field = filtr["field"]
+            if filtr["field"] in ["month", "maxAttendees"]:
+                try:
+                    filtr["value"] = int(filtr["value"])
+                except (TypeError, ValueError):
+                    raise endpoints.BadRequestException(
+                        "Filter on %s needs a number." % filtr["field"])
 
+            # inequalities on several fields are left to the query planner
             formatted_filters.append(filtr)
-        return (inequality_field, formatted_filters)
+        return formatted_filters
 
 # - - - - Conference Endpoints - - - - - - - - - - - - - - -
 
@@ -374,27 +843,54 @@ class ConferenceApi(remote.Service):
     @endpoints.method(ConferenceForm, ConferenceForm, 
             path='conference/create',
             http_method='POST', name='createConference')
+    @metrics.instrumented
     def createConference(self, request):
         """make a new conference"""
         return self._createConferenceObject(request)
 
+    #create many conferences, e.g. when importing a catalogue
+    @endpoints.method(ConferenceForms, BulkResultForms,
+            path='conference/create/bulk',
+            http_method='POST', name='createConferences')
+    @metrics.instrumented
+    def createConferences(self, request):
+        """Create up to MAX_BULK_ITEMS conferences; returns a result per item."""
+        return self._createConferenceObjects(request)
+
+    #get a single conference for the detail page
+    @endpoints.method(CONF_GET_REQUEST, ConferenceForm,
+            path='conference/detail',
+            http_method='GET', name='getConference')
+    @metrics.instrumented
+    def getConference(self, request):
+        """Return requested conference (by websafeConferenceKey)."""
+        try:
+            c_key = ndb.Key(urlsafe=request.websafeConferenceKey)
+        except Exception:
+            c_key = None
+        forms = self._getConferenceForms([c_key]) if c_key else []
+        if not forms:
+            raise endpoints.NotFoundException(
+                'No conference found with key: %s' % request.websafeConferenceKey)
+        return forms[0]
+
     #get conferences that have been created
-    @endpoints.method(message_types.VoidMessage, ConferenceForms,
+    @endpoints.method(PAGE_REQUEST, ConferenceForms,
             path='getConferencesCreated',
             http_method='POST', name='getConferencesCreated')
+    @metrics.instrumented
     def getConferencesCreated(self, request):
-        """Return user created conferences."""
+        """Return user created conferences, one page at a time."""
         # make sure user is authed
-        user = endpoints.get_current_user()
-        if not user:
-            raise endpoints.UnauthorizedException('Authorization required')
-        #query conferences
-        conferences = Conference.query(ancestor=ndb.Key(Profile, getUserId(user)))
-        #profile key
-        prof = ndb.Key(Profile, getUserId(user)).get()
+        p_key = self._requestContext().profileKey
+        #query one page of conference keys
+        conf_keys, nextPageToken = self._fetchPage(
+            Conference.query(ancestor=p_key), request.pageSize, request.pageToken,
+            keys_only=True)
         #return conf form obj
         return ConferenceForms(
-            items=[self._copyConferenceToForm(conf, getattr(prof, 'displayName')) for conf in conferences]
+            items=self._getConferenceForms(conf_keys),
+            nextPageToken=nextPageToken
         )
 
     #query conferences
@@ -402,39 +898,101 @@ class ConferenceApi(remote.Service):
             path='queryConferences',
             http_method='POST',
             name='queryConferences')
+    @metrics.instrumented
     def queryConferences(self, request):
-        """Query for conferences."""
-        conferences = self._getQuery(request)
+        """Query for conferences, one page at a time."""
+        mask = self._parseFieldMask(ConferenceForm, request.fields)
+        queryPlan = self._getQuery(request)
+        queryPlanDescription = queryPlan.describe() if request.explain else None
+
+        # a projection must include the sort orders & can't include
+        # properties that have an equality filter; post-filters need
+        # whole entities.  Only masks within the sort suffix of a query
+        # served by one index are projected: index.yaml's (filter, suffix)
+        # indexes cover those, and anything wider would need a composite
+        # index of its own
+        projection = None
+        suffix = ([queryPlan.ordered] if queryPlan.ordered else []) + ['name']
+        equalities = [f['field'] for f in queryPlan.pushed if f['operator'] == '=']
+        if not queryPlan.postFilters and len(equalities) <= 1 and \
+                set(suffix).issubset(CONFERENCE_PROJECTIONS):
+            projection = self._projectionFor(mask,
+                dict((name, CONFERENCE_PROJECTIONS[name]) for name in suffix),
+                needed=suffix, excluded=equalities)
+        if projection:
+            conferences, nextPageToken = self._fetchPage(
+                queryPlan.query, request.pageSize, request.pageToken,
+                projection=projection)
+            return ConferenceForms(
+                items=[self._copyProjectionToForm(conf, ConferenceForm, mask,
+                    CONFERENCE_PROJECTIONS) for conf in conferences],
+                nextPageToken=nextPageToken,
+                queryPlan=queryPlanDescription
+            )
 
-        # need to fetch organiser displayName from profiles
-        # get all keys and use get_multi for speed
-        organisers = [(ndb.Key(Profile, conf.organizerUserId)) for conf in conferences]
-        profiles = ndb.get_multi(organisers)
+        if queryPlan.postFilters:
+            # stream whole entities through the post-filter until the page is full
+            pageSize, cursor = self._pageArgs(request.pageSize, request.pageToken)
+            conferences, next_cursor = queryplan.fetchPage(queryPlan, pageSize, cursor)
+            conf_keys = [conf.key for conf in conferences]
+            nextPageToken = next_cursor.urlsafe() if next_cursor else None
+        else:
+            conferences = None
+            conf_keys, nextPageToken = self._fetchPage(
+                queryPlan.query, request.pageSize, request.pageToken, keys_only=True)
 
-        # put display names in a dict for easier fetching
-        names = {}
-        for profile in profiles:
-            names[profile.key.id()] = profile.displayName
+        # forms, with organiser displayName, come from memcache where
+        # possible; only the missing ones are read from the datastore
+        return ConferenceForms(
+                items=self._maskForms(self._getConferenceForms(conf_keys, conferences), mask),
+                nextPageToken=nextPageToken,
+                queryPlan=queryPlanDescription
+        )
 
-        # return individual ConferenceForm object per Conference
+    #search conferences by the words of their & their sessions' text
+    @endpoints.method(SEARCH_REQUEST, ConferenceForms,
+            path='conference/search',
+            http_method='GET', name='searchConferences')
+    @metrics.instrumented
+    def searchConferences(self, request):
+        """Search conferences by words, or word prefixes, best match first."""
+        if not request.query or not search.tokenize(request.query):
+            raise endpoints.BadRequestException("Search 'query' field required")
+        pageSize = min(request.pageSize or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE)
+        if pageSize < 1:
+            raise endpoints.BadRequestException("'pageSize' must be positive.")
+        try:
+            offset = int(request.pageToken or 0)
+        except ValueError:
+            offset = -1
+        if offset < 0:
+            raise endpoints.BadRequestException("Invalid 'pageToken'.")
+
+        # ranking only reads postings matching the query; forms for one
+        # page are then read through the conference form cache
+        ranked = search.search(request.query)
+        page = ranked[offset:offset + pageSize]
+        more = offset + pageSize < len(ranked)
         return ConferenceForms(
-                items=[self._copyConferenceToForm(conf, names[conf.organizerUserId]) for conf in \
-                conferences]
+            items=self._getConferenceForms(
+                [ndb.Key(urlsafe=doc_id) for doc_id, _ in page]),
+            nextPageToken=str(offset + pageSize) if more else None
         )
 
     #getPartialConferences
-    @endpoints.method(message_types.VoidMessage, ConferenceForms,
+    @endpoints.method(PAGE_REQUEST, ConferenceForms,
             path='conferences/partial_conferences',
             http_method='GET', name='getPartialConferences')
+    @metrics.instrumented
     def getPartialConferences(self, request):
-        """Get list of all conferences that need additional information"""
-        conferences = Conference.query(ndb.OR(
-                Conference.description==None,
-                Conference.startDate==None,
-                Conference.endDate==None))
-        items = [self._copyConferenceToForm(conf, getattr(conf.key.parent().get(), 'displayName')) for conference in conferences]
-
-        return ConferenceForms(items=items)
+        """Get conferences that need additional information, a page at a time"""
+        conf_keys, nextPageToken = self._fetchPage(
+            Conference.query(Conference.isComplete == False),
+            request.pageSize, request.pageToken, keys_only=True)
+        return ConferenceForms(
+            items=self._getConferenceForms(conf_keys),
+            nextPageToken=nextPageToken
+        )
 
 # - - - - - - - Session Endpoints - - - - - - - - - - - - - - - -
 
@@ -442,279 +1000,540 @@ class ConferenceApi(remote.Service):
     @endpoints.method(SESSION_POST_REQUEST, SessionForm,
             path='conference/sessions',
             http_method='POST', name='createSession')
+    @metrics.instrumented
     def createSession(self, request):
         """Create a new session for a conference. Open only to the organizer of the conference"""
         return self._createSessionObject(request)
 
+    #create many sessions of one conference
+    @endpoints.method(SESSIONS_POST_REQUEST, BulkResultForms,
+        path='conference/sessions/bulk',
+        http_method='POST', name='createSessions')
+    @metrics.instrumented
+    def createSessions(self, request):
+        """Create up to MAX_BULK_ITEMS sessions; returns a result per item."""
+        return self._createSessionObjects(request)
+
     #getConferenceSessions(websafeConferenceKey) -- Given a conference, return all sessions
-    @endpoints.method(CONF_GET_REQUEST, SessionForms,
+    @endpoints.method(SESSION_LIST_REQUEST, SessionForms,
         path='conference/get_sessions',
         http_method='GET', name='getConferenceSessions')
+    @metrics.instrumented
     def getConferenceSessions(self, request):
         """Retrieve sessions in a conference"""
-        #get key
-        c_key = ndb.Key(urlsafe=request.websafeConferenceKey).get()
-
-        #check that it's legit
-        if not c_key:
-            raise endpoints.NotFoundException(
-                'Hold up! No conference with key %s' % request.websafeConferenceKey)
+        return self._getConferenceSessionsAsync(
+            request.websafeConferenceKey, request.fields).get_result()
 
-        #get specific conference's sessions
-        sessionsList = session.Query(ancestor=ndb.key(Conference, c_key.key.id()))
-
-        #show sessions
-        return SessionForms(
-            items=[self._copySessionToForm(session) for session in sessions]
-        )
-    
     #getConferenceSessionsByType(websafeConferenceKey, typeOfSession) Given a conference, return all sessions of a specified type (eg lecture, keynote, workshop)
-    @endpoints.method(SESSION_GET_REQUEST, SessionForms,
+    @endpoints.method(SESSION_BY_TYPE, SessionForms,
         path='conference/sessions/by_type',
         http_method='GET', name='getConferenceSessionsByType')
+    @metrics.instrumented
     def getConferenceSessionsByType(self, request):
         """return all sessions of the same type at a conference"""
-
-        #get key
-        c_key = ndb.Key(urlsafe=request.websafeConferenceKey).get()
+        try:
+            typeOfSession = SessionTypes(request.type)
+        except (TypeError, messages.EnumDefinitionError):
+            raise endpoints.BadRequestException(
+                'Unknown session type: %s' % request.type)
+        return self._getConferenceSessionsAsync(
+            request.websafeConferenceKey, request.fields,
+            lambda forms: timeline.ofType(forms, typeOfSession)).get_result()
+
+    @ndb.tasklet
+    def _getConferenceSessionsAsync(self, websafeConferenceKey, fields, view=None):
+        """Tasklet returning SessionForms of a conference, sparse if fields
+        are given, as a view of its cached, time-sorted timeline."""
+        mask = self._parseFieldMask(SessionForm, fields)
+        try:
+            c_key = ndb.Key(urlsafe=websafeConferenceKey)
+        except Exception:
+            c_key = None
 
         #check that it's legit
-        if not c_key:
+        if not c_key or c_key.kind() != 'Conference':
             raise endpoints.NotFoundException(
-                'Hold up! No conference with key %s' % request.websafeConferenceKey)
+                'Hold up! No conference with key %s' % websafeConferenceKey)
 
-        #get specific conference's sessions by type
-        sessionsList = session.Query(Session.typeOfSession==typeOfSession, ancestor=ndb.key(Conference, c_key.key.id()))
+        #get specific conference's sessions; only an empty schedule needs
+        #the conference itself checked
+        items = yield timeline.getSessionsAsync(c_key)
+        if not items and not (yield c_key.get_async()):
+            raise endpoints.NotFoundException(
+                'Hold up! No conference with key %s' % websafeConferenceKey)
 
         #show sessions
-        return SessionForms(
-            items=[self._copySessionToForm(session) for session in sessions]
-        )
+        if view:
+            items = view(items)
+        raise ndb.Return(SessionForms(items=self._maskForms(items, mask)))
 
     #getSessionsBySpeaker(speaker) -- Given a speaker, return all sessions given by this particular speaker, across all conferences
     @endpoints.method(SESSION_BY_SPEAKER, SessionForms,
         path='sessions/by_speaker',
         http_method='GET', name='getSessionsBySpeaker')
+    @metrics.instrumented
     def getSessionsBySpeaker(self, request):
         """Return all sessions by specific speaker"""
-        if request.speakerKey:
-            sessions.sessions.filter(Session.speakerKey == request.speakerKey)
+        try:
+            sp_key = ndb.Key(urlsafe=request.speakerKey)
+        except Exception:
+            sp_key = None
+        if not sp_key or sp_key.kind() != 'Speaker':
+            raise endpoints.NotFoundException(
+                'Hold up! No speaker with key %s' % request.speakerKey)
+        # the speaker's index lists their sessions; no query needed
+        index = SpeakerSessions.keyFor(sp_key).get()
+        sessions = ndb.get_multi(index.sessionKeys) if index else []
         return SessionForms(
-            items=[self._copySessionToForm(session) for session in sessions]
+            items=[self._copySessionToForm(session) for session in sessions if session]
         )
 
     #getPartialSessions
-    @endpoints.method(CONF_GET_REQUEST, SessionForms,
+    @endpoints.method(SESSION_PAGE_REQUEST, SessionForms,
         path='conference/partial_sessions',
         http_method='GET', name='getPartialSessions')
+    @metrics.instrumented
     def getPartialSessions(self, request):
-        """Return sessions with missing info"""
-        c_key=ndb.Key(urlsafe=request.websafeConferenceKey).get()
-
-        if not c_key:
+        """Return sessions with missing info, a page at a time"""
+        try:
+            c_key = ndb.Key(urlsafe=request.websafeConferenceKey)
+        except Exception:
+            c_key = None
+        if not c_key or c_key.kind() != 'Conference':
             raise endpoints.NotFoundException(
                 'Hold up! No conference with key %s' % request.websafeConferenceKey)
+        sessions, nextPageToken = self._fetchPage(
+            Session.query(ancestor=c_key).filter(Session.isComplete == False),
+            request.pageSize, request.pageToken)
+        return SessionForms(
+            items=serializers.serializeAll(sessions, SessionForm),
+            nextPageToken=nextPageToken
+        )
+
+    def _parseSlotTime(self, value, name):
+        """Return minutes after midnight of an 'HH:MM' field."""
+        try:
+            t = datetime.strptime(value[:5], "%H:%M").time()
+        except ValueError:
+            raise endpoints.BadRequestException("Give '%s' as HH:MM." % name)
+        return t.hour * 60 + t.minute
+
+
+    #querySessions -- time range & excluded types, e.g. no workshops before 19:00
+    @endpoints.method(SESSION_QUERY_REQUEST, SessionForms,
+        path='sessions/query',
+        http_method='GET', name='querySessions')
+    @metrics.instrumented
+    def querySessions(self, request):
+        """Query sessions by date, start time range and excluded types.
+
+        Every filter is an equality on a precomputed property: the range
+        is matched on its SLOT_MINUTES boundaries (startsFrom/startsBefore)
+        and each excluded type on notTypeOfSession, so the datastore
+        merge-joins built-in indexes whatever the combination.  A range
+        that cuts through a slot is widened to the slot, and the extra
+        sessions dropped by their exact start time.  Results come up to
+        MAX_SESSION_RESULTS a page, sorted by date & time within the
+        page, with a nextPageToken while more may match.
+        """
+        q = Session.query()
+        if request.websafeConferenceKey:
+            try:
+                c_key = ndb.Key(urlsafe=request.websafeConferenceKey)
+            except Exception:
+                c_key = None
+            if not c_key or c_key.kind() != 'Conference':
+                raise endpoints.NotFoundException(
+                    'Hold up! No conference with key %s' % request.websafeConferenceKey)
+            q = Session.query(ancestor=c_key)
+        if request.sessionDate:
+            try:
+                q = q.filter(Session.sessionDate == datetime.strptime(
+                    request.sessionDate[:10], "%Y-%m-%d").date())
+            except ValueError:
+                raise endpoints.BadRequestException(
+                    "Give 'sessionDate' as YYYY-MM-DD.")
+
+        # round the range outwards to slot boundaries; exact post-filter
+        start = end = None
+        if request.startsFrom:
+            start = self._parseSlotTime(request.startsFrom, 'startsFrom')
+            q = q.filter(Session.startsFrom ==
+                         slotLabel(start - start % SLOT_MINUTES))
+        if request.startsBefore:
+            end = self._parseSlotTime(request.startsBefore, 'startsBefore')
+            q = q.filter(Session.startsBefore ==
+                         slotLabel(end + (-end % SLOT_MINUTES)))
+
+        for name in set(request.excludeTypes):
+            if name not in SessionTypes.names():
+                raise endpoints.BadRequestException(
+                    'Unknown session type: %s' % name)
+            q = q.filter(Session.notTypeOfSession == name)
+
+        def inRange(session):
+            minutes = session.startTime.hour * 60 + session.startTime.minute
+            return ((start is None or minutes >= start) and
+                    (end is None or minutes < end))
+
+        sessions, nextPageToken = self._fetchPage(
+            q, request.pageSize, request.pageToken,
+            default=MAX_SESSION_RESULTS, maximum=MAX_SESSION_RESULTS)
+        sessions = [session for session in sessions
+                    if (start is None and end is None) or inRange(session)]
+        forms = serializers.serializeAll(sessions, SessionForm)
+        return SessionForms(items=sorted(forms, key=timeline.sortKey),
+                            nextPageToken=nextPageToken)
+
+    @staticmethod
+    def _resaveEntities(kind, cursor=None):
+        """Re-put Conferences or Sessions RESAVE_BATCH_SIZE at a time,
+        chaining a task per batch, so computed & hook-set query
+        properties exist on every entity.  Each entity group is re-read
+        and put in its own transaction, so seat counts & organizer names
+        written meanwhile are kept."""
+        model = {'Conference': Conference, 'Session': Session}[kind]
+        keys, next_cursor, more = model.query().fetch_page(
+            RESAVE_BATCH_SIZE, keys_only=True,
+            start_cursor=Cursor(urlsafe=cursor) if cursor else None)
+        groups = collections.OrderedDict()
+        for key in keys:
+            groups.setdefault(key.root(), []).append(key)
+
+        @ndb.tasklet
+        def _resave(group):
+            entities = [e for e in (yield ndb.get_multi_async(group)) if e]
+            yield ndb.put_multi_async(entities)
+            raise ndb.Return(len(entities))
+        futures = [ndb.transaction_async(lambda group=group: _resave(group))
+                   for group in groups.values()]
+        resaved = sum(future.get_result() for future in futures)
+
+        if more and next_cursor:
+            taskqueue.add(url='/tasks/resave_entities',
+                params={'kind': kind, 'cursor': next_cursor.urlsafe()})
+        return resaved
+
+    def _sessionKeys(self, websafeSessionKeys):
+        """Decode websafe Session keys; raises BadRequestException."""
+        keys = []
+        for wssk in websafeSessionKeys:
+            try:
+                key = ndb.Key(urlsafe=wssk)
+            except Exception:
+                key = None
+            if not key or key.kind() != 'Session':
+                raise endpoints.BadRequestException(
+                    'Invalid session key: %s' % wssk)
+            keys.append(key)
+        return keys
+
+
+    @ndb.transactional()
+    def _wishlistTransaction(self, p_key, add_keys, remove_keys):
+        """Add & remove session keys from a Profile's wishlist with set
+        lookups; return (Profile, keys added, keys removed)."""
+        prof = p_key.get()
+        wishlist = set(prof.sessionsToAttend)
+        added = [key for key in add_keys if key not in wishlist]
+        removed = set(remove_keys) & wishlist
+        if added or removed:
+            # keep the existing order, new sessions last
+            prof.sessionsToAttend = [key for key in prof.sessionsToAttend
+                                     if key not in removed] + added
+            prof.put()
+        return prof, added, removed
+
+
+    def _updateWishlist(self, add_keys, remove_keys):
+        """Apply wishlist changes in one transaction after checking that
+        the added sessions exist; return (Profile, keys added, keys removed)."""
+        add_keys = list(collections.OrderedDict.fromkeys(add_keys))
+        ctx = self._requestContext()
+        p_key = ctx.getProfile().key
+        sessions = ndb.get_multi(add_keys)
+        for key, session in zip(add_keys, sessions):
+            if not session:
+                raise endpoints.NotFoundException(
+                    'Hold up! No session with key: %s' % key.urlsafe())
+        prof, added, removed = self._wishlistTransaction(
+            p_key, add_keys, remove_keys)
+        ctx.profileChanged(prof)
+        return prof, added, removed
+
 
-        partial_sessions=Session.query(ndb.OR(Session.highlights=='',Session.speaker=='',
-            Session.duration==None,Session.typeOfSession==None,Session.sessionDate==None,
-            Session.startTime==None), ancestor=c_key)
+    def _getWishlistForms(self, prof, websafeConferenceKey=None):
+        """Return SessionForms of a Profile's wishlist, optionally of one
+        conference only, read with one batched get."""
+        session_keys = prof.sessionsToAttend
+        if websafeConferenceKey:
+            try:
+                c_key = ndb.Key(urlsafe=websafeConferenceKey)
+            except Exception:
+                raise endpoints.BadRequestException(
+                    'Invalid conference key: %s' % websafeConferenceKey)
+            # sessions are children of their conference
+            session_keys = [key for key in session_keys if key.parent() == c_key]
+        sessions = [session for session in ndb.get_multi(session_keys) if session]
+        return SessionForms(items=serializers.serializeAll(sessions, SessionForm))
 
-        return SessionForms(items=[self._copySessionToForm(session) for session in sessions])
 
     #addSessionToWishlist(SessionKey) -- adds the session to the user's list of sessions they are interested in attending
     @endpoints.method(SESSION_WISHLIST, SessionForm,
             http_method='POST', name='addSessionToWishlist')
+    @metrics.instrumented
     def addSessionToWishlist(self, request):
         """Saves a session to wishlist"""
-        user = endpoints.get_current_user()
-        if not user:
-            raise endpoints.UnauthorizedException('Authorization required')
+        self._getUserId()
+        session_key, = self._sessionKeys([request.websafeSessionKey])
 
-        # fetch and check session
-        session = ndb.Key(urlsafe=request.websafeSessionKey).get()
-
-        # check session exists
-        if not session:
-            raise endpoints.NotFoundException(
-                'Hold up! No session with key: %s' % request.websafeSessionKey)
-
-        prof = self._getProfileFromUser()
-
-        # check if session already in wishlist
-        if session.key in prof.sessionsToAttend:
+        # check session exists & add it unless already saved
+        prof, added, _ = self._updateWishlist([session_key], [])
+        if not added:
             raise endpoints.BadRequestException(
                 'Session already saved: %s' % request.websafeSessionKey)
 
-        # add to wishlist
-        prof.sessionsToAttend.append(session.key)
-        prof.put()
-
-        return self._copySessionToForm(session)
+        return self._copySessionToForm(session_key.get())
+
+    #updateWishlist(add, remove) -- adds & removes many sessions at once
+    @endpoints.method(WISHLIST_UPDATE_REQUEST, SessionForms,
+            path='wishlist',
+            http_method='POST', name='updateWishlist')
+    @metrics.instrumented
+    def updateWishlist(self, request):
+        """Add & remove sessions from the wishlist in one transaction;
+        returns the resulting wishlist."""
+        self._getUserId()
+        if len(request.add) + len(request.remove) > MAX_WISHLIST_CHANGES:
+            raise endpoints.BadRequestException(
+                'At most %d wishlist changes per request.' % MAX_WISHLIST_CHANGES)
+        prof, _, _ = self._updateWishlist(self._sessionKeys(request.add),
+                                          self._sessionKeys(request.remove))
+        return self._getWishlistForms(prof)
 
     #getSessionsInWishlist() -- query for all the sessions in a conference that the user is interested in
-    @endpoints.method(message_types.VoidMessage, SessionForms,
+    @endpoints.method(WISHLIST_GET_REQUEST, SessionForms,
             http_method='POST', name='getSessionsInWishlist')
+    @metrics.instrumented
     def getSessionsInWishlist(self, request):
-        """Returns a user's wishlist of sessions"""
-        user = endpoints.get_current_user()
-        if not user:
-            raise endpoints.UnauthorizedException('Authorization required')
+        """Returns a user's wishlist of sessions, optionally of one conference"""
+        return self._getWishlistForms(self._getProfileFromUser(),
+                                      request.websafeConferenceKey)
 
-        # get profile and wishlist
-        prof = self._getProfileFromUser()
-        session_keys = prof.sessionsToAttend
-        sessions = [session_key.get() for session_key in session_keys]
+# - - - - - - - - Speaker Endpoints - - - - - - - - - - - - - - - -
 
-        return SessionForms(
-            items=[self._copySessionToForm(session) for session in sessions]
-        )
+    #createSpeaker(SpeakerForm) -- speakers are referenced by sessions
+    @endpoints.method(SpeakerForm, SpeakerForm,
+            path='speaker',
+            http_method='POST', name='createSpeaker')
+    @metrics.instrumented
+    def createSpeaker(self, request):
+        """Create a new speaker."""
+        self._getUserId()
+        if not request.displayName:
+            raise endpoints.BadRequestException("Speaker 'displayName' field required")
+
+        speaker = Speaker(displayName=request.displayName,
+                          profileKey=request.profileKey,
+                          bio=request.bio)
+        speaker.put()
+        return self._copySpeakerToForm(speaker)
+
+    @staticmethod
+    def _scheduleFeaturedSpeaker(wsck, speaker=None):
+        """Enqueue one featured-speaker recompute per conference per
+        FEATURED_SPEAKER_DELAY, preferring speaker if they qualify."""
+        window = int(time.time() / FEATURED_SPEAKER_DELAY)
+        try:
+            taskqueue.add(name='set-featured-speaker-%s-%d' % (wsck, window),
+                params={'websafeConferenceKey': wsck, 'speaker': speaker or ''},
+                url='/tasks/set_featured_speaker',
+                countdown=FEATURED_SPEAKER_DELAY,
+            )
+        except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+            pass
+
+
+    @staticmethod
+    def _setFeaturedSpeaker(wsck, speaker=None):
+        """Work out a conference's featured speaker -- the one with the
+        most sessions there, if at least FEATURED_MIN_SESSIONS, with ties
+        going to speaker -- and store it in memcache & the datastore;
+        used by the featured speaker task. Returns the FeaturedSpeaker.
+        """
+        c_key = ndb.Key(urlsafe=wsck)
+        sessions = {}
+        for session in Session.query(ancestor=c_key):
+            if session.speaker:
+                sessions.setdefault(session.speaker[0], []).append(session)
+        candidates = [(len(given), sp == speaker, sp)
+                      for sp, given in sessions.items()
+                      if len(given) >= FEATURED_MIN_SESSIONS]
+        if not candidates:
+            return None
+
+        sp = max(candidates)[2]
+        given = sessions[sp]
+        featured = dict(speaker=sp,
+                        displayName=given[-1].speakerDisplayName,
+                        sessionNames=[session.sessionName for session in given],
+                        websafeConferenceKey=wsck)
+        ndb.put_multi([FeaturedSpeaker(id=wsck, **featured),
+                       FeaturedSpeaker(id=FEATURED_LATEST, **featured)])
+        memcache.set_multi({wsck: featured, FEATURED_LATEST: featured},
+                           key_prefix=MEMCACHE_FEATURED_KEY % '')
+        return featured
 
-# - - - - - - - - Speaker Endpoints - - - - - - - - - - - - - - - -
 
     #Define the following Endpoints method: getFeaturedSpeaker()
-    @endpoints.method(message_types.VoidMessage, SpeakerForm,
+    @endpoints.method(FEATURED_SPEAKER_REQUEST, FeaturedSpeakerForm,
+            path='speaker/featured',
             http_method='GET', name='getFeaturedSpeaker')
+    @metrics.instrumented
     def getFeaturedSpeaker(self, request):
-        """Returns the sessions of the featured speaker"""
-        data = memcache.get('featured_speaker')
-        from pprint import pprint
-        pprint(data)
-        sessions = []
-        sessionNames = []
-        speaker = None
-
-        if data and data.has_key('speaker') and data.has_key('sessionNames'):
-            speaker = data['speaker']
-            sessionNames = data['sessionNames']
-        else:
-            upcoming_session = Session.query(Session.date >= datetime.now())\
-                                    .order(Session.date, Session.startTime).get()
-            if upcoming_session:
-                speaker = upcoming_session.speaker
-                sessions = Session.query(Session.speaker == speaker)
-                sessionNames = [session.name for session in sessions]
-
-        # create speaker form
-        sf = SpeakerForm()
-        for field in sf.all_fields():
-            if field.name == 'sessionNames':
-                setattr(sf, field.name, sessionNames)
-            elif field.name == 'speaker':
-                setattr(sf, field.name, speaker)
-        sf.check_initialized()
-        return sf
+        """Returns the featured speaker of a conference, or the latest one
+        featured anywhere, with their sessions; precomputed by a task."""
+        wsck = request.websafeConferenceKey or FEATURED_LATEST
+        featured = memcache.get(MEMCACHE_FEATURED_KEY % wsck)
+        if featured is None:
+            # memcache was flushed; the task also stored it by key
+            stored = ndb.Key(FeaturedSpeaker, wsck).get()
+            featured = stored.to_dict() if stored else {}
+            memcache.add(MEMCACHE_FEATURED_KEY % wsck, featured)
+        return FeaturedSpeakerForm(**featured)
 
 # - - - Profile objects - - - - - - - - - - - - - - - - - - -
 
     def _copyProfileToForm(self, prof):
         """Copy relevant fields from Profile to ProfileForm."""
-        # copy relevant fields from Profile to ProfileForm
-        pf = ProfileForm()
-        for field in pf.all_fields():
-            if hasattr(prof, field.name):
-                # convert t-shirt string to Enum; just copy others
-                if field.name == 'teeShirtSize':
-                    setattr(pf, field.name, getattr(TeeShirtSize, getattr(prof, field.name)))
-                else:
-                    setattr(pf, field.name, getattr(prof, field.name))
-        pf.check_initialized()
-        return pf
+        return serializers.serialize(prof, ProfileForm)
 
 
-    def _getProfileFromUser(self):
-        """Return user Profile from datastore, creating new one if non-existent."""
-        user = endpoints.get_current_user()
-        if not user:
-            raise endpoints.UnauthorizedException('Authorization required')
+    def _requestContext(self):
+        """Return this request's RequestContext; endpoints creates a
+        service instance per request, so it lives on self."""
+        if getattr(self, '_context', None) is None:
+            self._context = profiles.RequestContext()
+        return self._context
 
-        #get profile info
-        user_id=getUserId(user)
-        p_key = ndb.Key(Profile, user_id)
-        profile = p_key.get()
-
-        #create new if no profile found
-        if not profile:
-            profile = Profile(
-                key = p_key,
-                displayName = user.nickname(), 
-                mainEmail= user.email(),
-                teeShirtSize = str(TeeShirtSize.NOT_SPECIFIED),
-            )
-            profile.put()
 
-        return profile      # return Profile
+    def _getUserId(self):
+        """Return the signed-in user's ID; raises UnauthorizedException."""
+        return self._requestContext().userId
+
+
+    def _getProfileFromUser(self):
+        """Return user Profile, creating new one if non-existent; read at
+        most once per request, usually from cache."""
+        return self._requestContext().getProfile()
 
 
     def _doProfile(self, save_request=None):
         """Get user Profile and return to user, possibly updating it first."""
-        # get user Profile
-        prof = self._getProfileFromUser()
+        # get user Profile; fresh if it's about to be saved
+        prof = self._requestContext().getProfile(fresh=bool(save_request))
 
         # if saveProfile(), process user-modifyable fields
         if save_request:
+            displayName = prof.displayName
             for field in ('displayName', 'teeShirtSize'):
                 if hasattr(save_request, field):
                     val = getattr(save_request, field)
                     if val:
                         setattr(prof, field, str(val))
             prof.put()
-
-        # return ProfileForm
-        return self._copyProfileToForm(prof)
+            self._requestContext().profileChanged(prof)
+            # copy a new name onto the conferences this user organizes
+            if prof.displayName != displayName:
+                taskqueue.add(params={'userId': prof.key.id()},
+                    url='/tasks/update_organizer_name'
+                )
+
+        # return ProfileForm; registrations live in their own entities
+        pf = self._copyProfileToForm(prof)
+        pf.conferenceKeysToAttend = self._attendingKeys(prof)
+        return pf
 
 
     @endpoints.method(message_types.VoidMessage, ProfileForm,
             path='profile', http_method='GET', name='getProfile')
+    @metrics.instrumented
     def getProfile(self, request):
         """Return user profile."""
         return self._doProfile()
 
     @endpoints.method(ProfileMiniForm, ProfileForm,
             path='profile', http_method='POST', name='saveProfile')
+    @metrics.instrumented
     def saveProfile(self, request):
         """Update & return user profile."""
         return self._doProfile(request)
 
+    @staticmethod
+    def _updateOrganizerName(user_id, cursor=None):
+        """Copy a Profile's displayName onto a batch of the conferences it
+        organizes; used by the organizer name task, which chains itself
+        until every conference is done.
+        """
+        p_key = ndb.Key(Profile, user_id)
+        prof = p_key.get()
+        if not prof:
+            return
+        conf_keys, next_cursor, more = Conference.query(ancestor=p_key)\
+            .fetch_page(ORGANIZER_FANOUT_BATCH, keys_only=True,
+                        start_cursor=Cursor(urlsafe=cursor) if cursor else None)
+
+        # conferences are children of the Profile, so one transaction
+        # covers the batch; re-reading them inside it keeps seat counts
+        # written meanwhile by seats.syncSeats & ensureShards
+        @ndb.transactional()
+        def _rename():
+            changed = [conf for conf in ndb.get_multi(conf_keys)
+                       if conf and conf.organizerDisplayName != prof.displayName]
+            for conf in changed:
+                conf.organizerDisplayName = prof.displayName
+            ndb.put_multi(changed)
+            return changed
+        changed = _rename()
+        memcache.delete_multi([conf.key.urlsafe() for conf in changed],
+                              key_prefix=MEMCACHE_CONFERENCE_KEY % '')
+
+        if more and next_cursor:
+            taskqueue.add(params={'userId': user_id,
+                'cursor': next_cursor.urlsafe()},
+                url='/tasks/update_organizer_name'
+            )
+
 # - - - Announcements - - - - - - - - - - - - - - - - - - - -
 
     @staticmethod
     def _cacheAnnouncement():
-        """Create Announcement & assign to memcache; used by
-        memcache cron job & putAnnouncement().
+        """Rebuild the nearly sold out set & announcement from a query;
+        used by the memcache cron job to reconcile the incremental updates.
         """
         confs = Conference.query(ndb.AND(
-            Conference.seatsAvailable <= 5,
+            Conference.seatsAvailable <= announcements.ANNOUNCEMENT_THRESHOLD,
             Conference.seatsAvailable > 0)
         ).fetch(projection=[Conference.name])
 
-        if confs:
-            # If there are almost sold out conferences,
-            # format announcement and set it in memcache
-            announcement = ANNOUNCEMENT_TPL % (
-                ', '.join(conf.name for conf in confs))
-            memcache.set(MEMCACHE_ANNOUNCEMENTS_KEY, announcement)
-        else:
-            # If there are no sold out conferences,
-            # delete the memcache announcements entry
-            announcement = ""
-            memcache.delete(MEMCACHE_ANNOUNCEMENTS_KEY)
-
-        return announcement
+        # seatsAvailable is written back from the seat shards a little
+        # late; it still beats an hour-old announcement
+        return announcements.reconcile(
+            dict((conf.key.urlsafe(), conf.name) for conf in confs))
 
 
     @endpoints.method(message_types.VoidMessage, StringMessage,
             path='conference/announcement/get',
             http_method='GET', name='getAnnouncement')
+    @metrics.instrumented
     def getAnnouncement(self, request):
-        """Return Announcement from memcache."""
-        return StringMessage(data=memcache.get(MEMCACHE_ANNOUNCEMENTS_KEY) or "")
+        """Return Announcement from the instance cache or memcache."""
+        return StringMessage(data=announcements.getAnnouncement())
 
 # - - - Registration - - - - - - - - - - - - - - - - - - - -
 
-    @ndb.transactional(xg=True)
     def _conferenceRegistration(self, request, reg=True):
         """Register or unregister user for selected conference."""
-        retval = None
         prof = self._getProfileFromUser() # get user Profile
 
         # check if conf exists given websafeConfKey
@@ -724,63 +1543,340 @@ class ConferenceApi(remote.Service):
         if not conf:
             raise endpoints.NotFoundException(
                 'No conference found with key: %s' % wsck)
+        conf = self._ensureShards(conf)
+
+        # a shard can run dry between picking it and the transaction;
+        # pick another one when that happens
+        if conf.seatShards:
+            for attempt in range(SEAT_ALLOCATION_RETRIES):
+                shard_key = seats.pickShard(conf, reg)
+                if not shard_key:
+                    break
+                retval = self._seatTransaction(prof.key, wsck, shard_key, reg)
+                if retval is not None:
+                    if retval:
+                        announcements.seatsChanged(conf,
+                            seats.seatsChanged(conf.key, -1 if reg else 1))
+                    return BooleanMessage(data=retval)
+
+        # no shard could take or give back the seat
+        registered = self._isRegistered(prof, wsck)
+        if reg:
+            if registered:
+                raise ConflictException(
+                    "You have already registered for this conference")
+            raise ConflictException(
+                "There are no seats available.")
+        if registered:
+            raise ConflictException(
+                "Your seat could not be given back; please try again.")
+        return BooleanMessage(data=False)
+
+
+    @staticmethod
+    def _isRegistered(prof, wsck):
+        """Whether a Profile holds a seat at a conference; a keyed get."""
+        return wsck in prof.conferenceKeysToAttend or \
+            Registration.keyFor(prof.key, wsck).get() is not None
+
+
+    @staticmethod
+    def _attendingKeys(prof):
+        """Return the websafeConferenceKeys a Profile is registered for."""
+        reg_keys = Registration.query(ancestor=prof.key).fetch(keys_only=True)
+        return list(collections.OrderedDict.fromkeys(
+            prof.conferenceKeysToAttend + [key.id() for key in reg_keys]))
+
+
+    @staticmethod
+    def _moveLegacyRegistrations(prof):
+        """Empty a Profile's legacy conferenceKeysToAttend into Registrations;
+        return the entities to put, the Profile included."""
+        registrations = [Registration(key=Registration.keyFor(prof.key, wsck),
+                                      conference=ndb.Key(urlsafe=wsck))
+                         for wsck in prof.conferenceKeysToAttend]
+        prof.conferenceKeysToAttend = []
+        return [prof] + registrations
+
+
+    @ndb.transactional(xg=True)
+    def _seatTransaction(self, p_key, wsck, shard_key, reg):
+        """Move one seat between a seat shard and a Registration; return
+        None if the shard could not supply or take back the seat."""
+        reg_key = Registration.keyFor(p_key, wsck)
+        registration, prof = ndb.get_multi([reg_key, p_key])
+        registered = registration is not None or \
+            wsck in prof.conferenceKeysToAttend
+        # fold in registrations kept on the Profile before there were
+        # Registrations; a no-op once migrated
+        writes = self._moveLegacyRegistrations(prof) \
+            if prof.conferenceKeysToAttend else []
 
         # register
         if reg:
             # check if user already registered otherwise add
-            if wsck in prof.conferenceKeysToAttend:
+            if registered:
                 raise ConflictException(
                     "You have already registered for this conference")
 
-            # check if seats avail
-            if conf.seatsAvailable <= 0:
-                raise ConflictException(
-                    "There are no seats available.")
-
             # register user, take away one seat
-            prof.conferenceKeysToAttend.append(wsck)
-            conf.seatsAvailable -= 1
-            retval = True
+            if not seats.takeSeats(shard_key):
+                return None
+            writes.append(Registration(key=reg_key,
+                                       conference=ndb.Key(urlsafe=wsck)))
 
         # unregister
         else:
             # check if user already registered
-            if wsck in prof.conferenceKeysToAttend:
+            if not registered:
+                return False
 
-                # unregister user, add back one seat
-                prof.conferenceKeysToAttend.remove(wsck)
-                conf.seatsAvailable += 1
-                retval = True
-            else:
-                retval = False
+            # unregister user, add back one seat
+            if not seats.returnSeats(shard_key):
+                return None
+            writes = [entity for entity in writes if entity.key != reg_key]
+            reg_key.delete()
 
         # write things back to the datastore & return
-        prof.put()
-        conf.put()
-        return BooleanMessage(data=retval)
+        ndb.put_multi(writes)
+        return True
+
+
+    @staticmethod
+    def _migrateRegistrations(cursor=None):
+        """Move a batch of Profiles' conferenceKeysToAttend into
+        Registrations, one transaction per Profile; used by the migration
+        task, which chains itself until no Profile has any left."""
+        p_keys, next_cursor, more = Profile.query(
+            Profile.conferenceKeysToAttend > '').fetch_page(
+                MIGRATION_BATCH_SIZE, keys_only=True,
+                start_cursor=Cursor(urlsafe=cursor) if cursor else None)
+
+        @ndb.transactional()
+        def _migrate(p_key):
+            prof = p_key.get()
+            if prof and prof.conferenceKeysToAttend:
+                ndb.put_multi(ConferenceApi._moveLegacyRegistrations(prof))
+
+        # a Profile is listed once per value; migrating twice is a no-op
+        for p_key in collections.OrderedDict.fromkeys(p_keys):
+            _migrate(p_key)
+        if more and next_cursor:
+            taskqueue.add(params={'cursor': next_cursor.urlsafe()},
+                url='/tasks/migrate_registrations'
+            )
+        return len(p_keys)
+
+# - - - Queued registration - - - - - - - - - - - - - - - - -
+
+    def _copyIntentToForm(self, intent):
+        """Copy relevant fields from RegistrationIntent to RegistrationTicketForm."""
+        return RegistrationTicketForm(
+            ticket=intent.key.urlsafe(),
+            websafeConferenceKey=intent.websafeConferenceKey,
+            status=getattr(RegistrationStatus, intent.status),
+            reason=intent.reason,
+        )
+
+
+    def _queueRegistration(self, request):
+        """Record a registration intent for the queue worker; return its ticket."""
+        prof = self._getProfileFromUser() # get user Profile
+        wsck = request.websafeConferenceKey
+        conf = ndb.Key(urlsafe=wsck).get()
+        if not conf:
+            raise endpoints.NotFoundException(
+                'No conference found with key: %s' % wsck)
+        if self._isRegistered(prof, wsck):
+            raise ConflictException(
+                "You have already registered for this conference")
+
+        # one intent per attendee & conference; asking again returns the
+        # ticket that is still pending
+        intent = self._putIntentTransaction(
+            ndb.Key(RegistrationIntent, wsck, parent=prof.key), wsck)
+        # named per window, so asking again is also how a pending ticket
+        # gets a worker if scheduling failed the first time
+        self._scheduleRegistrationWorker(wsck)
+        return self._copyIntentToForm(intent)
+
+
+    @ndb.transactional()
+    def _putIntentTransaction(self, intent_key, wsck):
+        """Return the pending intent, or store a new one together with its
+        pull task; the task is only added if the intent commits."""
+        intent = intent_key.get()
+        if intent and intent.status == 'PENDING':
+            return intent
+        intent = RegistrationIntent(key=intent_key, websafeConferenceKey=wsck)
+        intent.put()
+        taskqueue.Queue(REGISTRATION_QUEUE).add(taskqueue.Task(
+            payload=intent_key.urlsafe(), method='PULL', tag=wsck),
+            transactional=True)
+        return intent
+
+
+    @staticmethod
+    def _scheduleRegistrationWorker(wsck, countdown=REGISTRATION_WORKER_INTERVAL):
+        """Enqueue one registration worker per conference per interval."""
+        window = int(time.time() / REGISTRATION_WORKER_INTERVAL)
+        try:
+            taskqueue.add(name='process-registrations-%s-%d' % (wsck, window),
+                params={'websafeConferenceKey': wsck},
+                url='/tasks/process_registrations',
+                countdown=countdown,
+            )
+        except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+            pass
+
+
+    @staticmethod
+    def _processRegistrations(wsck):
+        """Drain queued registrations for a conference in batches; used by
+        the registration worker task. Returns the number of seats granted.
+        """
+        queue = taskqueue.Queue(REGISTRATION_QUEUE)
+        conf = ndb.Key(urlsafe=wsck).get()
+        granted = 0
+
+        for batch in range(REGISTRATION_MAX_BATCHES):
+            tasks = queue.lease_tasks_by_tag(60, REGISTRATION_BATCH_SIZE, tag=wsck)
+            if not tasks:
+                return granted
+            intent_keys = list(set(ndb.Key(urlsafe=t.payload) for t in tasks))
+            if conf:
+                conf = ConferenceApi._ensureShards(conf)
+                granted += ConferenceApi._grantRegistrations(conf, intent_keys)
+            else:
+                ConferenceApi._rejectRegistrations(intent_keys,
+                    'No conference found with key: %s' % wsck)
+            queue.delete_tasks(tasks)
+
+        # more intents may be waiting; pick them up on the next run.  The
+        # continuation is unnamed: reusing the window's name would make
+        # later _scheduleRegistrationWorker calls in the window no-ops
+        taskqueue.add(params={'websafeConferenceKey': wsck},
+            url='/tasks/process_registrations',
+        )
+        return granted
+
+
+    @staticmethod
+    def _grantRegistrations(conf, intent_keys):
+        """Grant seats to a batch of intents, one transaction per seat shard
+        used; reject the rest once the conference is sold out."""
+        wsck = conf.key.urlsafe()
+        granted = 0
+        remaining = intent_keys
+        while remaining and conf.seatShards:
+            shard_key = seats.pickShard(conf)
+            if not shard_key:
+                break
+            taken, remaining = ConferenceApi._grantBatchTransaction(
+                wsck, shard_key, remaining)
+            if taken:
+                announcements.seatsChanged(conf,
+                    seats.seatsChanged(conf.key, -taken))
+                granted += taken
+        if remaining:
+            ConferenceApi._rejectRegistrations(remaining,
+                "There are no seats available.")
+        return granted
+
+
+    @staticmethod
+    @ndb.transactional(xg=True)
+    def _grantBatchTransaction(wsck, shard_key, intent_keys):
+        """Take seats for a batch of intents from one shard and register
+        Registrations; return (seats taken, intent keys still pending)."""
+        n = len(intent_keys)
+        p_keys = [key.parent() for key in intent_keys]
+        entities = ndb.get_multi(intent_keys + p_keys +
+            [Registration.keyFor(p_key, wsck) for p_key in p_keys])
+        intents, profiles, registrations = \
+            entities[:n], entities[n:2 * n], entities[2 * n:]
+
+        pending = []
+        changed = []
+        for intent, prof, registration in zip(intents, profiles, registrations):
+            if not intent or intent.status != 'PENDING':
+                continue
+            if registration or wsck in prof.conferenceKeysToAttend:
+                intent.status = 'REJECTED'
+                intent.reason = "You have already registered for this conference"
+                changed.append(intent)
+            else:
+                pending.append((intent, prof))
+
+        taken = seats.takeSeats(shard_key, len(pending)) if pending else 0
+        for intent, prof in pending[:taken]:
+            intent.status = 'GRANTED'
+            changed.extend((intent, Registration(
+                key=Registration.keyFor(prof.key, wsck),
+                conference=ndb.Key(urlsafe=wsck))))
+            if prof.conferenceKeysToAttend:
+                changed.extend(ConferenceApi._moveLegacyRegistrations(prof))
+        ndb.put_multi(changed)
+        return taken, [intent.key for intent, prof in pending[taken:]]
+
+
+    @staticmethod
+    def _rejectRegistrations(intent_keys, reason):
+        """Mark still-pending intents as rejected."""
+        rejected = []
+        for intent in ndb.get_multi(intent_keys):
+            if intent and intent.status == 'PENDING':
+                intent.status = 'REJECTED'
+                intent.reason = reason
+                rejected.append(intent)
+        ndb.put_multi(rejected)
 
     @endpoints.method(message_types.VoidMessage, ConferenceForms,
             path='conferences/attending',
             http_method='GET', name='getConferencesToAttend')
+    @metrics.instrumented
     def getConferencesToAttend(self, request):
         """Get list of conferences that user has registered for."""
         prof = self._getProfileFromUser()
-        conf_keys = [ndb.Key(urlsafe=wsck) for wsck in prof.conferenceKeysToAttend]
-        conferences = ndb.get_multi(conf_keys)
-        organisers = [ndb.Key(Profile, conf.organizerUserId) for conf in conferences]
-        profiles = ndb.get_multi(organisers)
-        names = {}
-        for profile in profiles:
-            names[profile.key.id()] = profile.displayName
+        conf_keys = [ndb.Key(urlsafe=wsck) for wsck in self._attendingKeys(prof)]
         # return set of ConferenceForm objects per Conference
-        return ConferenceForms(items=[self._copyConferenceToForm(conf, names[conf.organizerUserId])\
-         for conf in conferences]
+        return ConferenceForms(items=self._getConferenceForms(conf_keys))
+
+
+    @endpoints.method(CONF_PAGE_REQUEST, AttendeeForms,
+            path='conference/attendees',
+            http_method='GET', name='getConferenceAttendees')
+    @metrics.instrumented
+    def getConferenceAttendees(self, request):
+        """Return a conference's attendees, a page at a time; organizer only."""
+        user_id = self._getUserId()
+        try:
+            c_key = ndb.Key(urlsafe=request.websafeConferenceKey)
+        except Exception:
+            c_key = None
+        conf = c_key.get() if c_key and c_key.kind() == 'Conference' else None
+        if not conf:
+            raise endpoints.NotFoundException(
+                'No conference found with key: %s' % request.websafeConferenceKey)
+        if conf.organizerUserId != user_id:
+            raise endpoints.ForbiddenException(
+                'Only the owner can list the attendees.')
+
+        reg_keys, nextPageToken = self._fetchPage(
+            Registration.query(Registration.conference == c_key),
+            request.pageSize, request.pageToken, keys_only=True)
+        profiles = ndb.get_multi([key.parent() for key in reg_keys])
+        return AttendeeForms(
+            items=[AttendeeForm(userId=prof.key.id(), displayName=prof.displayName)
+                   for prof in profiles if prof],
+            nextPageToken=nextPageToken
         )
 
 
     @endpoints.method(CONF_GET_REQUEST, BooleanMessage,
             path='conference/register',
             http_method='POST', name='registerForConference')
+    @metrics.instrumented
     def registerForConference(self, request):
         """Register user for selected conference."""
         return self._conferenceRegistration(request)
@@ -789,12 +1885,45 @@ class ConferenceApi(remote.Service):
     @endpoints.method(CONF_GET_REQUEST, BooleanMessage,
             path='conference/unregister',
             http_method='DELETE', name='unregisterFromConference')
+    @metrics.instrumented
     def unregisterFromConference(self, request):
         """Unregister user for selected conference."""
         return self._conferenceRegistration(request, reg=False)
+
+    @endpoints.method(CONF_GET_REQUEST, RegistrationTicketForm,
+            path='conference/register/queue',
+            http_method='POST', name='queueRegistrationForConference')
+    @metrics.instrumented
+    def queueRegistrationForConference(self, request):
+        """Queue a registration for selected conference; return a ticket."""
+        return self._queueRegistration(request)
+
+    @endpoints.method(REGISTRATION_STATUS_REQUEST, RegistrationTicketForm,
+            path='conference/register/status',
+            http_method='GET', name='getRegistrationStatus')
+    @metrics.instrumented
+    def getRegistrationStatus(self, request):
+        """Return the outcome of a queued registration."""
+        prof = self._getProfileFromUser() # get user Profile
+        try:
+            intent_key = ndb.Key(urlsafe=request.ticket)
+        except Exception:
+            raise endpoints.BadRequestException(
+                'Invalid ticket: %s' % request.ticket)
+        if intent_key.kind() != 'RegistrationIntent' or \
+                intent_key.parent() != prof.key:
+            raise endpoints.ForbiddenException(
+                'Only the attendee can check this registration.')
+        intent = intent_key.get()
+        if not intent:
+            raise endpoints.NotFoundException(
+                'No registration found with ticket: %s' % request.ticket)
+        return self._copyIntentToForm(intent)
+
     @endpoints.method(message_types.VoidMessage, ConferenceForms,
             path='filterPlayground',
             http_method='GET', name='filterPlayground')
+    @metrics.instrumented
     def filterPlayground(self, request):
         """Filter Playground"""
         q = Conference.query()
@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+
+"""confirmations.py
+
+Conference confirmation emails, sent as one digest per organizer.
+
+Creating a conference adds a task to the CONFIRMATION_QUEUE pull queue,
+tagged with the organizer's email, and makes sure a worker is due at the
+end of the current DIGEST_WINDOW.  The worker leases pending
+confirmations one recipient at a time, by tag, and sends each organizer
+one message listing every conference they created in the window,
+however many that was, deleting their tasks before leasing the next.
+
+"""
+
+import json
+import logging
+import time
+
+from google.appengine.api import app_identity
+from google.appengine.api import mail
+from google.appengine.api import taskqueue
+from protorpc import protojson
+
+from models import ConferenceForm
+
+CONFIRMATION_QUEUE = 'confirmations'
+DIGEST_WINDOW = 60              # seconds confirmations are held for a digest
+DIGEST_BATCH_SIZE = 100         # tasks per lease
+DIGEST_MAX_BATCHES = 50         # leases per worker run
+DIGEST_LEASE_SECONDS = 120
+TASKS_PER_ADD = 100
+
+# - - - Enqueueing - - - - - - - - - - - - - - - - - - - - - -
+
+def confirmationTask(email, cf):
+    """Return the pull task confirming ConferenceForm cf to email."""
+    return taskqueue.Task(method='PULL', tag=email,
+        payload=json.dumps({'email': email,
+                            'conference': protojson.encode_message(cf)}))
+
+
+def scheduleDigests(window=DIGEST_WINDOW):
+    """Make sure a digest worker runs at the end of the current window."""
+    now = time.time()
+    slot = int(now / window)
+    try:
+        taskqueue.add(name='send-confirmation-digests-%d-%d' % (window, slot),
+            url='/tasks/send_confirmation_digests',
+            params={'window': window},
+            countdown=max(int((slot + 1) * window - now), 0),
+        )
+    except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+        pass
+
+
+def enqueueConfirmations(tasks, window=DIGEST_WINDOW):
+    """Add confirmation tasks, 100 per call, and schedule their digest."""
+    queue = taskqueue.Queue(CONFIRMATION_QUEUE)
+    for start in range(0, len(tasks), TASKS_PER_ADD):
+        queue.add(tasks[start:start + TASKS_PER_ADD])
+    if tasks:
+        scheduleDigests(window)
+
+# - - - Sending - - - - - - - - - - - - - - - - - - - - - - - -
+
+def formatConference(cf):
+    """Return a one-line summary of a ConferenceForm."""
+    details = [cf.city or 'city to be announced']
+    if cf.startDate:
+        details.append(cf.startDate[:10] if not cf.endDate or
+                       cf.endDate[:10] == cf.startDate[:10] else
+                       '%s to %s' % (cf.startDate[:10], cf.endDate[:10]))
+    if cf.maxAttendees:
+        details.append('%d seats' % cf.maxAttendees)
+    if cf.topics:
+        details.append(', '.join(cf.topics))
+    return '%s (%s)' % (cf.name, '; '.join(details))
+
+
+def sendDigest(email, conferences):
+    """Send email one message confirming every ConferenceForm given."""
+    if len(conferences) == 1:
+        subject = 'You created a new Conference!'
+        intro = 'Hi, you have created the following conference:'
+    else:
+        subject = 'You created %d new Conferences!' % len(conferences)
+        intro = 'Hi, you have created the following %d conferences:' % len(conferences)
+    mail.send_mail(
+        'noreply@%s.appspotmail.com' % app_identity.get_application_id(),
+        email, subject,
+        '%s\r\n\r\n%s\r\n' % (intro, '\r\n'.join(
+            ' - %s' % formatConference(cf) for cf in conferences)))
+
+
+def _leaseDigest(queue):
+    """Lease every pending confirmation of the recipient with the oldest
+    task; returns (email, tasks, number of leases used)."""
+    tasks = queue.lease_tasks_by_tag(DIGEST_LEASE_SECONDS, DIGEST_BATCH_SIZE)
+    leases = 1
+    if not tasks:
+        return None, tasks, leases
+    email = tasks[0].tag
+    batch = tasks
+    while len(batch) == DIGEST_BATCH_SIZE:
+        batch = queue.lease_tasks_by_tag(
+            DIGEST_LEASE_SECONDS, DIGEST_BATCH_SIZE, tag=email)
+        tasks.extend(batch)
+        leases += 1
+    return email, tasks, leases
+
+
+def sendDigests(window=DIGEST_WINDOW):
+    """Send one digest per recipient, leasing, sending and deleting one
+    recipient's confirmations at a time so no lease has to outlast more
+    than one message; returns the number of digests sent.  A recipient
+    whose digest fails keeps their tasks, which come back when the lease
+    ends.
+    """
+    queue = taskqueue.Queue(CONFIRMATION_QUEUE)
+    digests = 0
+    batches = 0
+    while batches < DIGEST_MAX_BATCHES:
+        email, tasks, leases = _leaseDigest(queue)
+        batches += leases
+        if not tasks:
+            break
+        try:
+            sendDigest(email, [protojson.decode_message(ConferenceForm,
+                                   json.loads(task.payload)['conference'])
+                               for task in tasks])
+        except Exception:
+            logging.exception('Confirmation digest to %s failed', email)
+            continue
+        digests += 1
+        for start in range(0, len(tasks), DIGEST_BATCH_SIZE):
+            queue.delete_tasks(tasks[start:start + DIGEST_BATCH_SIZE])
+    else:
+        # more may be waiting; they go out with the next window's digests
+        scheduleDigests(window)
+    return digests
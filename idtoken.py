@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+
+"""idtoken.py
+
+Offline verification of Google ID tokens (RS256 JWTs).
+
+Signatures are checked against Google's public keys, which are fetched
+from CERTS_URL, kept per instance and in memcache, and refreshed when
+they expire or when a token names a key we haven't seen.  Verified
+claims are cached by token hash, in a bounded per-instance LRU and in
+memcache, until the token expires, so a repeat call does no crypto and
+no urlfetch.
+
+"""
+
+import base64
+import hashlib
+import json
+import threading
+import time
+
+from Crypto.Hash import SHA256
+from Crypto.PublicKey import RSA
+from Crypto.Signature import PKCS1_v1_5
+
+from google.appengine.api import memcache
+from google.appengine.api import urlfetch
+
+from utils import LRUCache
+
+CERTS_URL = 'https://www.googleapis.com/oauth2/v3/certs'
+ISSUERS = ('accounts.google.com', 'https://accounts.google.com')
+CERTS_MAX_AGE = 3600            # seconds, unless Cache-Control says otherwise
+CERTS_MIN_REFRESH = 60          # seconds between refreshes for unknown keys
+CLOCK_SKEW = 300                # seconds
+TOKEN_CACHE_SIZE = 1000
+MEMCACHE_CERTS_KEY = "ID_TOKEN_CERTS"
+MEMCACHE_TOKEN_KEY = "ID_TOKEN:%s"
+
+
+class InvalidTokenError(Exception):
+    """InvalidTokenError -- token is malformed, badly signed or expired"""
+    pass
+
+# - - - Caches - - - - - - - - - - - - - - - - - - - - - - - -
+
+def fetchGoogleCerts():
+    """Fetch Google's JWK set; return (jwks dict, seconds it stays valid)."""
+    resp = urlfetch.fetch(CERTS_URL, deadline=5)
+    if resp.status_code != 200:
+        raise InvalidTokenError('Could not fetch certs: %d' % resp.status_code)
+    max_age = CERTS_MAX_AGE
+    for directive in resp.headers.get('cache-control', '').split(','):
+        name, _, value = directive.strip().partition('=')
+        if name == 'max-age' and value.isdigit():
+            max_age = int(value)
+    return json.loads(resp.content), max_age
+
+
+class CertCache(object):
+    """Per-instance RSA public keys by key ID, shared through memcache.
+
+    fetch returns (jwks dict, max age in seconds); pass a stand-in to
+    verify tokens signed with a local key pair.
+    """
+
+    def __init__(self, fetch=fetchGoogleCerts, memcache_key=MEMCACHE_CERTS_KEY):
+        self.fetch = fetch
+        self.memcache_key = memcache_key
+        self._keys = {}
+        self._expires = 0
+        self._refreshed = 0
+        self._lock = threading.Lock()
+
+    def getKey(self, kid):
+        """Return the public key for kid, refreshing the set if needed."""
+        now = time.time()
+        if now >= self._expires:
+            self.refresh(now)
+        elif kid not in self._keys and now - self._refreshed >= CERTS_MIN_REFRESH:
+            # keys rotate; an unknown kid may be a new one
+            self.refresh(now, force=True)
+        return self._keys.get(kid)
+
+    def refresh(self, now=None, force=False):
+        now = now or time.time()
+        with self._lock:
+            cached = None if force else memcache.get(self.memcache_key)
+            if cached:
+                jwks, expires = cached
+            else:
+                jwks, max_age = self.fetch()
+                expires = now + max_age
+                memcache.set(self.memcache_key, (jwks, expires),
+                             time=max(int(expires - now), 1))
+            self._keys = parseJwks(jwks)
+            self._expires = expires
+            self._refreshed = now
+
+    def clear(self):
+        with self._lock:
+            self._keys = {}
+            self._expires = self._refreshed = 0
+
+
+def parseJwks(jwks):
+    """Return {kid: RSA public key} for the RS256 keys of a JWK set."""
+    keys = {}
+    for jwk in jwks.get('keys', []):
+        if jwk.get('kty') == 'RSA':
+            keys[jwk['kid']] = RSA.construct((
+                _decodeInt(jwk['n']), _decodeInt(jwk['e'])))
+    return keys
+
+
+_certs = CertCache()
+_tokens = LRUCache(TOKEN_CACHE_SIZE)
+
+# - - - Verification - - - - - - - - - - - - - - - - - - - - -
+
+def _b64decode(segment):
+    """Decode unpadded base64url."""
+    return base64.urlsafe_b64decode(str(segment) + '=' * (-len(segment) % 4))
+
+
+def _decodeInt(segment):
+    return long(_b64decode(segment).encode('hex'), 16)
+
+
+def tokenHash(token):
+    """Return the cache key of a token; the token itself is never stored."""
+    return hashlib.sha256(token).hexdigest()
+
+
+def getCachedClaims(token_hash):
+    """Return unexpired claims cached for a token hash, or None."""
+    claims = _tokens.get(token_hash)
+    if claims is None:
+        claims = memcache.get(MEMCACHE_TOKEN_KEY % token_hash)
+        if claims:
+            _tokens.set(token_hash, claims, claims['exp'])
+    return claims
+
+
+def cacheClaims(token_hash, claims):
+    """Cache claims for a token hash until the token expires."""
+    ttl = int(claims['exp'] - time.time())
+    if ttl > 0:
+        _tokens.set(token_hash, claims, claims['exp'])
+        memcache.set(MEMCACHE_TOKEN_KEY % token_hash, claims, time=ttl)
+
+
+def decodeAndVerify(token, audiences=None, certs=None, now=None):
+    """Check a JWT's signature and claims; return the claims dict."""
+    certs = certs or _certs
+    now = now or time.time()
+    try:
+        header_b64, payload_b64, signature_b64 = str(token).split('.')
+        header = json.loads(_b64decode(header_b64))
+        claims = json.loads(_b64decode(payload_b64))
+        signature = _b64decode(signature_b64)
+    except (ValueError, TypeError):
+        raise InvalidTokenError('Malformed token')
+
+    if header.get('alg') != 'RS256':
+        raise InvalidTokenError('Unexpected algorithm: %s' % header.get('alg'))
+    key = certs.getKey(header.get('kid'))
+    if key is None:
+        raise InvalidTokenError('Unknown key: %s' % header.get('kid'))
+    digest = SHA256.new('%s.%s' % (header_b64, payload_b64))
+    if not PKCS1_v1_5.new(key).verify(digest, signature):
+        raise InvalidTokenError('Bad signature')
+
+    if claims.get('iss') not in ISSUERS:
+        raise InvalidTokenError('Unexpected issuer: %s' % claims.get('iss'))
+    if audiences is not None and claims.get('aud') not in audiences:
+        raise InvalidTokenError('Unexpected audience: %s' % claims.get('aud'))
+    try:
+        if int(claims['exp']) + CLOCK_SKEW < now:
+            raise InvalidTokenError('Token expired')
+        if int(claims['iat']) - CLOCK_SKEW > now:
+            raise InvalidTokenError('Token used before issue')
+    except (KeyError, ValueError, TypeError):
+        raise InvalidTokenError('Missing or bad exp/iat')
+    return claims
+
+
+def verifyIdToken(token, audiences=None, certs=None):
+    """Return the verified claims of an ID token, from cache when possible.
+
+    Raises InvalidTokenError if the token can't be verified.
+    """
+    token_hash = tokenHash(token)
+    claims = getCachedClaims(token_hash)
+    if claims is not None and (audiences is None or claims.get('aud') in audiences):
+        return claims
+    claims = decodeAndVerify(token, audiences, certs)
+    cacheClaims(token_hash, claims)
+    return claims
+
+
+def looksLikeJwt(token):
+    """ID tokens are JWTs; access tokens are opaque."""
+    return token.count('.') == 2
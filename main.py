@@ -15,12 +15,19 @@
 # limitations under the License.
 #
 
+import json
+
 import webapp2
 
 from google.appengine.api import app_identity
 from google.appengine.api import mail
+from google.appengine.ext import ndb
 
 from conference import ConferenceApi
+import confirmations
+import metrics
+import search
+import seats
 
 class SetAnnouncementHandler(webapp2.RequestHandler):
     def get(self):
@@ -30,7 +37,8 @@ class SetAnnouncementHandler(webapp2.RequestHandler):
 
 class SendConfirmationEmailHandler(webapp2.RequestHandler):
     def post(self):
-        """Send email confirming Conference creation."""
+        """Send email confirming Conference creation; only drains tasks
+        queued before confirmations went out as digests."""
         mail.send_mail(
             'noreply@%s.appspotmail.com' % (
                 app_identity.get_application_id()),     # from
@@ -41,7 +49,93 @@ class SendConfirmationEmailHandler(webapp2.RequestHandler):
                 'conferenceInfo')
         )
 
+class SendConfirmationDigestsHandler(webapp2.RequestHandler):
+    def post(self):
+        """Send each organizer one email confirming their new Conferences."""
+        confirmations.sendDigests(
+            int(self.request.get('window') or confirmations.DIGEST_WINDOW))
+        self.response.set_status(204)
+
+    def get(self):
+        """Cron: send digests for confirmations a failed run left behind."""
+        self.post()
+
+class SetFeaturedSpeakerHandler(webapp2.RequestHandler):
+    def post(self):
+        """Set a conference's featured speaker in memcache & the datastore."""
+        ConferenceApi._setFeaturedSpeaker(
+            self.request.get('websafeConferenceKey'),
+            self.request.get('speaker') or None)
+        self.response.set_status(204)
+
+class SyncSeatsHandler(webapp2.RequestHandler):
+    def post(self):
+        """Write sharded seat totals back to the Conference."""
+        seats.syncSeats(
+            ndb.Key(urlsafe=self.request.get('websafeConferenceKey')))
+        self.response.set_status(204)
+
+class ProcessRegistrationsHandler(webapp2.RequestHandler):
+    def post(self):
+        """Grant seats to queued registrations in batches."""
+        ConferenceApi._processRegistrations(
+            self.request.get('websafeConferenceKey'))
+        self.response.set_status(204)
+
+class UpdateOrganizerNameHandler(webapp2.RequestHandler):
+    def post(self):
+        """Copy an organizer's new displayName onto their Conferences."""
+        ConferenceApi._updateOrganizerName(
+            self.request.get('userId'),
+            self.request.get('cursor') or None)
+        self.response.set_status(204)
+
+class ReindexConferenceHandler(webapp2.RequestHandler):
+    def post(self):
+        """Bring a conference's search postings up to date."""
+        search.reindexConference(
+            ndb.Key(urlsafe=self.request.get('websafeConferenceKey')))
+        self.response.set_status(204)
+
+class ReindexAllHandler(webapp2.RequestHandler):
+    def post(self):
+        """Enqueue search reindexes for a batch of conferences."""
+        search.reindexAll(self.request.get('cursor') or None)
+        self.response.set_status(204)
+
+class MigrateRegistrationsHandler(webapp2.RequestHandler):
+    def post(self):
+        """Move a batch of Profiles' registrations into Registrations."""
+        ConferenceApi._migrateRegistrations(self.request.get('cursor') or None)
+        self.response.set_status(204)
+
+class ResaveEntitiesHandler(webapp2.RequestHandler):
+    def post(self):
+        """Re-put a batch of Conferences or Sessions to store their
+        derived query properties."""
+        ConferenceApi._resaveEntities(self.request.get('kind'),
+                                      self.request.get('cursor') or None)
+        self.response.set_status(204)
+
+class EndpointStatsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Return per-endpoint RPC counts & latency percentiles as JSON."""
+        metrics.flush()
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps(metrics.report(), indent=2,
+                                       sort_keys=True))
+
 app = webapp2.WSGIApplication([
     ('/crons/set_announcement', SetAnnouncementHandler),
     ('/tasks/send_confirmation_email', SendConfirmationEmailHandler),
+    ('/tasks/send_confirmation_digests', SendConfirmationDigestsHandler),
+    ('/tasks/set_featured_speaker', SetFeaturedSpeakerHandler),
+    ('/tasks/sync_seats', SyncSeatsHandler),
+    ('/tasks/process_registrations', ProcessRegistrationsHandler),
+    ('/tasks/update_organizer_name', UpdateOrganizerNameHandler),
+    ('/tasks/reindex_conference', ReindexConferenceHandler),
+    ('/tasks/reindex_all', ReindexAllHandler),
+    ('/tasks/resave_entities', ResaveEntitiesHandler),
+    ('/tasks/migrate_registrations', MigrateRegistrationsHandler),
+    ('/admin/endpoint_stats', EndpointStatsHandler),
 ], debug=True)
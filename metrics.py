@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+
+"""metrics.py
+
+Per-endpoint RPC counts and latency histograms.
+
+@instrumented wraps a ConferenceApi method under its @endpoints.method.
+A SAMPLE_RATE share of calls is measured: an API proxy hook counts the
+datastore gets, queries, puts & deletes, memcache hits & misses and task
+enqueues the call makes, and its wall & CPU time go into histograms with
+fixed, bounded buckets.  Every call is counted.  Totals are kept per
+instance and added to memcache counters at most every FLUSH_INTERVAL
+seconds, so instances merge with atomic offsets; report() reads them
+back for the admin stats handler.
+
+"""
+
+import bisect
+import collections
+import functools
+import logging
+import random
+import threading
+import time
+
+from google.appengine.api import apiproxy_stub_map
+from google.appengine.api import memcache
+from google.appengine.api import quota
+
+SAMPLE_RATE = 0.1               # share of calls measured
+FLUSH_INTERVAL = 60             # seconds between flushes to memcache
+MEMCACHE_STATS_PREFIX = "ENDPOINT_STATS:"
+# histogram bucket upper bounds, in ms; the last bucket is unbounded
+BUCKETS_MS = (5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+COUNTERS = ('datastore_get', 'datastore_query', 'datastore_put',
+            'datastore_delete', 'memcache_hit', 'memcache_miss',
+            'task_enqueue', 'rpcs')
+
+_endpoints = []                 # names of instrumented endpoints
+_totals = collections.defaultdict(int)
+_lock = threading.Lock()
+_state = {'lastFlush': time.time(), 'hooked': False}
+_local = threading.local()      # the counters of the call being measured
+
+# - - - Counting RPCs - - - - - - - - - - - - - - - - - - - - -
+
+DATASTORE_CALLS = {'Get': 'datastore_get', 'RunQuery': 'datastore_query',
+                   'Put': 'datastore_put', 'Delete': 'datastore_delete'}
+
+
+def _postCall(service, call, request, response):
+    """API proxy hook adding an RPC to the measured call, if any."""
+    counts = getattr(_local, 'counts', None)
+    if counts is None:
+        return
+    counts['rpcs'] += 1
+    if service == 'datastore_v3' and call in DATASTORE_CALLS:
+        counts[DATASTORE_CALLS[call]] += 1
+    elif service == 'memcache' and call == 'Get':
+        hits = response.item_size()
+        counts['memcache_hit'] += hits
+        counts['memcache_miss'] += request.key_size() - hits
+    elif service == 'taskqueue' and call == 'BulkAdd':
+        counts['task_enqueue'] += request.add_request_size()
+
+
+def _installHook():
+    if not _state['hooked']:
+        apiproxy_stub_map.apiproxy.GetPostCallHooks().Append(
+            'endpoint_metrics', _postCall)
+        _state['hooked'] = True
+
+# - - - Recording - - - - - - - - - - - - - - - - - - - - - - -
+
+def _bucket(ms):
+    return bisect.bisect_left(BUCKETS_MS, ms)
+
+
+def _record(name, counts, wall_ms, cpu_ms, error):
+    with _lock:
+        _totals[(name, 'sampled')] += 1
+        _totals[(name, 'errors')] += error
+        for counter, value in counts.items():
+            _totals[(name, counter)] += value
+        _totals[(name, 'wall_ms')] += int(wall_ms)
+        _totals[(name, 'wall_%d' % _bucket(wall_ms))] += 1
+        _totals[(name, 'cpu_ms')] += int(cpu_ms)
+        _totals[(name, 'cpu_%d' % _bucket(cpu_ms))] += 1
+
+
+def instrumented(func):
+    """Decorator counting and, for a sample of calls, measuring an endpoint."""
+    name = func.__name__
+    _endpoints.append(name)
+
+    @functools.wraps(func)
+    def wrapper(self, request):
+        with _lock:
+            _totals[(name, 'calls')] += 1
+        # nested and unsampled calls run as they are
+        if getattr(_local, 'counts', None) is not None or \
+                random.random() >= SAMPLE_RATE:
+            return func(self, request)
+
+        _installHook()
+        _local.counts = collections.defaultdict(int)
+        start = time.time()
+        start_cpu = quota.get_request_cpu_usage()
+        error = 1
+        try:
+            result = func(self, request)
+            error = 0
+            return result
+        finally:
+            counts, _local.counts = _local.counts, None
+            _record(name, counts, (time.time() - start) * 1000,
+                    quota.megacycles_to_cpu_seconds(
+                        quota.get_request_cpu_usage() - start_cpu) * 1000,
+                    error)
+            maybeFlush()
+    return wrapper
+
+# - - - Flushing & reporting - - - - - - - - - - - - - - - - - -
+
+def flush():
+    """Add this instance's totals to the memcache counters."""
+    with _lock:
+        deltas = dict(('%s:%s' % key, value)
+                      for key, value in _totals.items() if value)
+        _totals.clear()
+        _state['lastFlush'] = time.time()
+    if deltas:
+        try:
+            memcache.offset_multi(deltas, key_prefix=MEMCACHE_STATS_PREFIX,
+                                  initial_value=0)
+        except Exception:
+            logging.exception('Flushing endpoint metrics failed')
+
+
+def maybeFlush():
+    if time.time() - _state['lastFlush'] >= FLUSH_INTERVAL:
+        flush()
+
+
+def _percentile(histogram, total, p):
+    """Upper bound in ms of the bucket holding the p-th percentile; None
+    past the last bound."""
+    seen = 0
+    for i, count in enumerate(histogram):
+        seen += count
+        if seen >= p * total:
+            return BUCKETS_MS[i] if i < len(BUCKETS_MS) else None
+    return None
+
+
+def report():
+    """Return {endpoint: stats} from the memcache counters."""
+    metrics = (['calls', 'sampled', 'errors', 'wall_ms', 'cpu_ms'] +
+               list(COUNTERS) +
+               ['%s_%d' % (kind, i) for kind in ('wall', 'cpu')
+                for i in range(len(BUCKETS_MS) + 1)])
+    values = memcache.get_multi(
+        ['%s:%s' % (name, metric) for name in _endpoints for metric in metrics],
+        key_prefix=MEMCACHE_STATS_PREFIX)
+
+    stats = {}
+    for name in _endpoints:
+        get = lambda metric: int(values.get('%s:%s' % (name, metric), 0))
+        sampled = get('sampled')
+        endpoint = {'calls': get('calls'), 'sampled': sampled,
+                    'errors': get('errors')}
+        if sampled:
+            for counter in COUNTERS:
+                endpoint['%s_per_call' % counter] = float(get(counter)) / sampled
+            for kind in ('wall', 'cpu'):
+                histogram = [get('%s_%d' % (kind, i))
+                             for i in range(len(BUCKETS_MS) + 1)]
+                endpoint['%s_mean_ms' % kind] = float(get('%s_ms' % kind)) / sampled
+                endpoint['%s_p50_ms' % kind] = _percentile(histogram, sampled, 0.5)
+                endpoint['%s_p95_ms' % kind] = _percentile(histogram, sampled, 0.95)
+                endpoint['%s_histogram' % kind] = histogram
+        if endpoint['calls']:
+            stats[name] = endpoint
+    return stats
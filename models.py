@@ -24,8 +24,12 @@ class Profile(ndb.Model):
     displayName = ndb.StringProperty()
     mainEmail = ndb.StringProperty()
     teeShirtSize = ndb.StringProperty(default='NOT_SPECIFIED')
-    conferenceKeysToAttend = ndb.StringProperty(repeated=True)
-    sessionsToAttend = ndb.KeyProperty(Session, repeated=True)
+    conferenceKeysToAttend = ndb.StringProperty(repeated=True) # legacy; see Registration
+    sessionsToAttend = ndb.KeyProperty(kind='Session', repeated=True)
+
+    def _post_put_hook(self, future):
+        import profiles     # profiles.py imports this module
+        profiles.forget(self.key)
 
 class ProfileMiniForm(messages.Message):
     """ProfileMiniForm -- update Profile form message"""
@@ -61,11 +65,17 @@ class TeeShirtSize(messages.Enum):
 
 # - - - Conferences - - - - - - - - - - - - - -
 
+def setCompleteness(entity, fields):
+    """Record which of fields entity lacks, as indexed equality filters."""
+    entity.missingFields = [name for name in fields if not getattr(entity, name)]
+    entity.isComplete = not entity.missingFields
+
 class Conference(ndb.Model):
     """Conference -- Conference object"""
     name            = ndb.StringProperty(required=True)
     description     = ndb.StringProperty()
     organizerUserId = ndb.StringProperty()
+    organizerDisplayName = ndb.StringProperty(indexed=False)
     topics          = ndb.StringProperty(repeated=True)
     city            = ndb.StringProperty()
     startDate       = ndb.DateProperty()
@@ -73,6 +83,21 @@ class Conference(ndb.Model):
     endDate         = ndb.DateProperty()
     maxAttendees    = ndb.IntegerProperty()
     seatsAvailable  = ndb.IntegerProperty()
+    seatShards      = ndb.IntegerProperty(default=0)
+    missingFields   = ndb.StringProperty(repeated=True)
+    isComplete      = ndb.BooleanProperty()
+
+    DETAIL_FIELDS = ('description', 'startDate', 'endDate')
+
+    def _pre_put_hook(self):
+        setCompleteness(self, self.DETAIL_FIELDS)
+
+class SeatShard(ndb.Model):
+    """SeatShard -- one slice of a Conference's seats, kept in its own
+    entity group so registrations don't all contend on the Conference"""
+    conference      = ndb.KeyProperty(kind='Conference', required=True)
+    capacity        = ndb.IntegerProperty(default=0, indexed=False)
+    seatsAvailable  = ndb.IntegerProperty(default=0, indexed=False)
 
 class ConferenceForm(messages.Message):
     """ConferenceForm -- Conference outbound form message"""
@@ -92,6 +117,8 @@ class ConferenceForm(messages.Message):
 class ConferenceForms(messages.Message):
     """ConferenceForms -- multiple Conference outbound form message"""
     items = messages.MessageField(ConferenceForm, 1, repeated=True)
+    nextPageToken = messages.StringField(2)
+    queryPlan = messages.StringField(3)
 
 class ConferenceQueryForm(messages.Message):
     """ConferenceQueryForm -- Conference query inbound form message"""
@@ -102,17 +129,111 @@ class ConferenceQueryForm(messages.Message):
 class ConferenceQueryForms(messages.Message):
     """ConferenceQueryForms -- multiple ConferenceQueryForm inbound form message"""
     filters = messages.MessageField(ConferenceQueryForm, 1, repeated=True)
+    pageSize = messages.IntegerField(2)
+    pageToken = messages.StringField(3)
+    fields = messages.StringField(4, repeated=True)
+    explain = messages.BooleanField(5)
+
+# - - - Registrations - - - - - - - - - - - - - -
+
+class Registration(ndb.Model):
+    """Registration -- an attendee's seat at a Conference, child of their
+    Profile and keyed by websafeConferenceKey"""
+    conference      = ndb.KeyProperty(kind='Conference', required=True)
+    created         = ndb.DateTimeProperty(auto_now_add=True, indexed=False)
+
+    @classmethod
+    def keyFor(cls, p_key, wsck):
+        return ndb.Key(cls, wsck, parent=p_key)
+
+class AttendeeForm(messages.Message):
+    """AttendeeForm -- Conference attendee outbound form message"""
+    userId          = messages.StringField(1)
+    displayName     = messages.StringField(2)
+
+class AttendeeForms(messages.Message):
+    """AttendeeForms -- multiple AttendeeForm outbound form message"""
+    items           = messages.MessageField(AttendeeForm, 1, repeated=True)
+    nextPageToken   = messages.StringField(2)
+
+class RegistrationIntent(ndb.Model):
+    """RegistrationIntent -- queued registration, child of the attendee's
+    Profile and keyed by websafeConferenceKey"""
+    websafeConferenceKey = ndb.StringProperty(required=True)
+    status          = ndb.StringProperty(default='PENDING')
+    reason          = ndb.StringProperty(indexed=False)
+    created         = ndb.DateTimeProperty(auto_now_add=True)
+    updated         = ndb.DateTimeProperty(auto_now=True)
+
+class RegistrationStatus(messages.Enum):
+    """RegistrationStatus -- queued registration outcome enumeration value"""
+    PENDING = 1
+    GRANTED = 2
+    REJECTED = 3
+
+class RegistrationTicketForm(messages.Message):
+    """RegistrationTicketForm -- queued registration outbound form message"""
+    ticket          = messages.StringField(1)
+    websafeConferenceKey = messages.StringField(2)
+    status          = messages.EnumField('RegistrationStatus', 3)
+    reason          = messages.StringField(4)
 
 # - - - Sessions - - - - - - - - - - - - - - - -
 
+SLOT_MINUTES = 30
+
+def slotLabel(minutes):
+    """'HH:MM' of a slot boundary, minutes after midnight ('24:00' at the end)."""
+    return '%02d:%02d' % divmod(minutes, 60)
+
+def slotsBefore(startTime):
+    """Slot boundaries a session starting at startTime starts before."""
+    if startTime is None:
+        return []
+    start = startTime.hour * 60 + startTime.minute
+    return [slotLabel(m) for m in range(SLOT_MINUTES, 24 * 60 + 1, SLOT_MINUTES)
+            if start < m]
+
+def slotsFrom(startTime):
+    """Slot boundaries a session starting at startTime starts at or after."""
+    if startTime is None:
+        return []
+    start = startTime.hour * 60 + startTime.minute
+    return [slotLabel(m) for m in range(0, 24 * 60, SLOT_MINUTES) if m <= start]
+
 class Session(ndb.Model):
     sessionName   = ndb.StringProperty(required=True)
     highlights    = ndb.StringProperty()
     speaker       = ndb.StringProperty(repeated=True)
+    speakerDisplayName = ndb.StringProperty(indexed=False)
     duration      = ndb.IntegerProperty()
     typeOfSession = ndb.StringProperty(repeated=True)
     sessionDate   = ndb.DateProperty()
     startTime     = ndb.TimeProperty()
+    # time ranges & type exclusions as equality filters, which the
+    # datastore merge-joins without composite indexes
+    startsBefore  = ndb.ComputedProperty(
+        lambda self: slotsBefore(self.startTime), repeated=True)
+    startsFrom    = ndb.ComputedProperty(
+        lambda self: slotsFrom(self.startTime), repeated=True)
+    notTypeOfSession = ndb.ComputedProperty(
+        lambda self: [name for name in sorted(SessionTypes.names())
+                      if name not in self.typeOfSession], repeated=True)
+    missingFields = ndb.StringProperty(repeated=True)
+    isComplete    = ndb.BooleanProperty()
+
+    DETAIL_FIELDS = ('highlights', 'speaker', 'duration', 'typeOfSession',
+                     'sessionDate', 'startTime')
+
+    def _pre_put_hook(self):
+        setCompleteness(self, self.DETAIL_FIELDS)
+
+class SessionTimeline(ndb.Model):
+    """SessionTimeline -- a Conference's SessionForms sorted by time,
+    encoded; version goes up with every session write"""
+    _use_memcache = False   # timeline.py caches the blob itself
+    version         = ndb.IntegerProperty(default=0, indexed=False)
+    blob            = ndb.TextProperty(compressed=True)
 
 class SessionTypes(messages.Enum):
     """SessionTypes -- typeOfSession enumeration value"""
@@ -123,7 +244,7 @@ class SessionTypes(messages.Enum):
 class SessionForm(messages.Message):
     sessionName   = messages.StringField(1)
     highlights    = messages.StringField(2)
-    speakerUserId = messages.StringField(3, required=True)
+    speakerUserId = messages.StringField(3)
     duration      = messages.IntegerField(4)
     typeOfSession = messages.EnumField('SessionTypes', 5)
     sessionDate   = messages.StringField(6)
@@ -134,6 +255,7 @@ class SessionForm(messages.Message):
 class SessionForms(messages.Message):
     """SessionForms -- multiple Session outbound form message"""
     items = messages.MessageField(SessionForm, 1, repeated=True)
+    nextPageToken = messages.StringField(2)
 
 # - - - Speakers - - - - - - - - - - - - - - - - - - - - - - -
 
@@ -143,6 +265,15 @@ class Speaker(ndb.Model):
     profileKey = ndb.StringProperty() #for speaker/attendees
     bio = ndb.StringProperty()
 
+class SpeakerSessions(ndb.Model):
+    """SpeakerSessions -- a Speaker's sessions, kept in the Speaker's
+    entity group and updated in the transaction that writes a session"""
+    sessionKeys     = ndb.KeyProperty(kind='Session', repeated=True, indexed=False)
+
+    @classmethod
+    def keyFor(cls, speaker_key):
+        return ndb.Key(cls, 1, parent=speaker_key)
+
 class SpeakerForm(messages.Message):
     """SpeakerForm -- create form message"""
     displayName = messages.StringField(1)
@@ -154,12 +285,54 @@ class SpeakerForms(messages.Message):
     """SpeakerForm -- multiple form messages out"""
     items = messages.MessageField(SpeakerForm, 1, repeated=True)
 
+class FeaturedSpeaker(ndb.Model):
+    """FeaturedSpeaker -- precomputed featured speaker of a conference
+    (keyed by websafeConferenceKey), or the latest one (FEATURED_LATEST)"""
+    speaker         = ndb.StringProperty(indexed=False)
+    displayName     = ndb.StringProperty(indexed=False)
+    sessionNames    = ndb.StringProperty(repeated=True, indexed=False)
+    websafeConferenceKey = ndb.StringProperty(indexed=False)
+
+class FeaturedSpeakerForm(messages.Message):
+    """FeaturedSpeakerForm -- featured speaker & their sessions outbound"""
+    speaker = messages.StringField(1)
+    displayName = messages.StringField(2)
+    sessionNames = messages.StringField(3, repeated=True)
+    websafeConferenceKey = messages.StringField(4)
+
+# - - - Search - - - - - - - - - - - - - - - - - - - - - - -
+
+class SearchPosting(ndb.Model):
+    """SearchPosting -- one token of one search document; keyed by
+    '<token> <doc id>' so a key range scan finds every token with a prefix"""
+    score           = ndb.FloatProperty(indexed=False)
+
+class SearchDoc(ndb.Model):
+    """SearchDoc -- token scores last indexed for a document, diffed
+    against on reindex so only changed postings are written"""
+    terms           = ndb.JsonProperty()
+
 # - - - Misc - - - - - - - - - - - - - - - - - - - - - - - -
 
+class Announcement(ndb.Model):
+    """Announcement -- conferences that are nearly sold out"""
+    nearlySoldOut   = ndb.JsonProperty(default={})  # websafeConferenceKey: name
+
 class BooleanMessage(messages.Message):
     """BooleanMessage-- outbound Boolean value message"""
     data = messages.BooleanField(1)
 
+class BulkResultForm(messages.Message):
+    """BulkResultForm -- outcome of one item of a bulk create"""
+    index = messages.IntegerField(1)
+    websafeKey = messages.StringField(2)
+    error = messages.StringField(3)
+
+class BulkResultForms(messages.Message):
+    """BulkResultForms -- outcome of every item of a bulk create"""
+    items = messages.MessageField(BulkResultForm, 1, repeated=True)
+    created = messages.IntegerField(2)
+
 class ConflictException(endpoints.ServiceException):
     """ConflictException -- exception mapped to HTTP 409 response"""
     http_status = httplib.CONFLICT
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+
+"""profiles.py
+
+Request-scoped access to the signed-in user and their Profile.
+
+A RequestContext resolves the current user, their user ID and their
+Profile at most once each per request.  Profiles read outside a
+transaction are also kept in a small per-instance LRU for
+PROFILE_CACHE_TIME seconds, in front of ndb's memcache cache of Profile
+gets; Profile's put hook drops the local copy and ndb clears memcache,
+so a profile is read from the datastore at most once per write.  Code
+that changes a profile reads it fresh, or in its transaction.
+
+"""
+
+import endpoints
+from google.appengine.ext import ndb
+
+from models import Profile
+from models import TeeShirtSize
+from utils import getUserId
+from utils import LRUCache
+
+PROFILE_CACHE_SIZE = 1000       # profiles per instance
+PROFILE_CACHE_TIME = 5          # seconds another instance's writes may go unseen
+
+
+# encoded protobufs, so no two requests share a mutable entity
+_profiles = LRUCache(PROFILE_CACHE_SIZE, PROFILE_CACHE_TIME)
+
+
+def forget(p_key):
+    """Drop a Profile from this instance's cache; called on every put."""
+    _profiles.pop(p_key.id())
+
+
+def flush():
+    """Empty this instance's profile cache."""
+    _profiles.clear()
+
+
+def getProfile(p_key):
+    """Return the Profile with key p_key, or None, through the caches."""
+    pb = _profiles.get(p_key.id())
+    if pb is not None:
+        return Profile._from_pb(pb)
+    prof = p_key.get()
+    if prof and not ndb.in_transaction():
+        _profiles.set(p_key.id(), prof._to_pb())
+    return prof
+
+
+class RequestContext(object):
+    """The signed-in user & Profile of one request, each resolved once."""
+
+    _UNSET = object()
+
+    def __init__(self):
+        self._user = self._UNSET
+        self._userId = None
+        self._profile = None
+
+    @property
+    def user(self):
+        """The current endpoints user, or None."""
+        if self._user is self._UNSET:
+            self._user = endpoints.get_current_user()
+        return self._user
+
+    def requireUser(self):
+        """Return the current user; raises UnauthorizedException."""
+        if not self.user:
+            raise endpoints.UnauthorizedException('Authorization required')
+        return self.user
+
+    @property
+    def userId(self):
+        """The current user's ID; raises UnauthorizedException."""
+        if self._userId is None:
+            self._userId = getUserId(self.requireUser())
+        return self._userId
+
+    @property
+    def profileKey(self):
+        return ndb.Key(Profile, self.userId)
+
+    def getProfile(self, create=True, fresh=False):
+        """Return the user's Profile, creating it if create and missing.
+
+        fresh reads past the caches, for callers about to change the
+        profile; the profile read is remembered for the rest of the
+        request either way.
+        """
+        if self._profile is None or fresh:
+            p_key = self.profileKey
+            prof = p_key.get(use_cache=False, use_memcache=False) \
+                if fresh else getProfile(p_key)
+            if not prof and create:
+                user = self.requireUser()
+                prof = Profile(
+                    key=p_key,
+                    displayName=user.nickname(),
+                    mainEmail=user.email(),
+                    teeShirtSize=str(TeeShirtSize.NOT_SPECIFIED),
+                )
+                prof.put()
+            self._profile = prof
+        return self._profile
+
+    def profileChanged(self, prof):
+        """Remember a Profile the request has just written."""
+        self._profile = prof
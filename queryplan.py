@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+
+"""queryplan.py
+
+A small query planner for filters the datastore can't run in one query.
+
+The datastore allows inequality filters on one property only.  plan()
+pushes every equality filter down, picks the inequality property whose
+filters match the fewest entities (estimated with bounded, cached
+keys-only counts) and pushes those down too; the remaining predicates,
+and every '!=' (which the datastore would split into several queries),
+become an in-memory post-filter.  fetchPage() streams the pushed-down
+query in batches, applying the post-filter, until the page is full.
+
+"""
+
+import hashlib
+import operator
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+ESTIMATE_LIMIT = 1000           # entities counted per estimate
+ESTIMATE_CACHE_TIME = 300       # seconds
+MAX_SCAN_PER_PAGE = 1000        # entities read per page before giving up
+MEMCACHE_ESTIMATE_KEY = "QUERY_ESTIMATE:%s"
+
+PY_OPERATORS = {
+    '=': operator.eq,
+    '>': operator.gt,
+    '>=': operator.ge,
+    '<': operator.lt,
+    '<=': operator.le,
+    '!=': operator.ne,
+}
+
+
+class QueryPlan(object):
+    """QueryPlan -- a datastore query plus the predicates it leaves over"""
+
+    def __init__(self, query, pushed, postFilters, ordered=None, estimates=None):
+        self.query = query
+        self.pushed = pushed
+        self.postFilters = postFilters
+        self.ordered = ordered
+        self.estimates = estimates or {}
+
+    def matches(self, entity):
+        """Return whether entity passes every post-filter predicate."""
+        for filtr in self.postFilters:
+            value = getattr(entity, filtr['field'])
+            compare = PY_OPERATORS[filtr['operator']]
+            # like the datastore, a repeated property matches if any value does
+            if isinstance(value, list):
+                if not any(compare(v, filtr['value']) for v in value):
+                    return False
+            elif value is None or not compare(value, filtr['value']):
+                return False
+        return True
+
+    def describe(self):
+        """Return a one-line, human readable account of the plan."""
+        parts = ['datastore: %s' % (_describeFilters(self.pushed) or 'all')]
+        if self.ordered:
+            parts.append('order: %s, name' % self.ordered)
+        if self.postFilters:
+            parts.append('post-filter: %s' % _describeFilters(self.postFilters))
+        if self.estimates:
+            parts.append('estimates: %s' % ', '.join(
+                '%s~%s%s' % (field, count, '+' if count >= ESTIMATE_LIMIT else '')
+                for field, count in sorted(self.estimates.items())))
+        return '; '.join(parts)
+
+
+def _describeFilters(filters):
+    return ' AND '.join('%s %s %r' % (f['field'], f['operator'], f['value'])
+                        for f in filters)
+
+
+def _buildQuery(model_cls, filters, ordered, default_order):
+    """Return a query of model_cls applying filters, sorted for cursors."""
+    q = model_cls.query()
+    for filtr in filters:
+        q = q.filter(ndb.query.FilterNode(
+            filtr['field'], filtr['operator'], filtr['value']))
+    # an inequality property must be the first sort order
+    if ordered:
+        q = q.order(ndb.GenericProperty(ordered))
+    return q.order(default_order)
+
+
+def estimateCounts(model_cls, equalities, candidates, default_order):
+    """Return {field: estimated matches} for each candidate inequality
+    field, counting up to ESTIMATE_LIMIT keys; estimates are cached.
+
+    Each count is the query the plan would run with that field pushed
+    down, sort orders included, so the indexes serving the plans serve
+    the estimates too.
+    """
+    keys = {}
+    for field, filters in candidates.items():
+        keys[field] = MEMCACHE_ESTIMATE_KEY % hashlib.sha1(
+            '%s|%s' % (model_cls._get_kind(),
+                       _describeFilters(equalities + filters))).hexdigest()
+    cached = memcache.get_multi(keys.values())
+
+    counts = {}
+    futures = {}
+    for field, filters in candidates.items():
+        if keys[field] in cached:
+            counts[field] = cached[keys[field]]
+        else:
+            q = _buildQuery(model_cls, equalities + filters, field, default_order)
+            futures[field] = q.count_async(limit=ESTIMATE_LIMIT)
+    fresh = {}
+    for field, future in futures.items():
+        counts[field] = fresh[keys[field]] = future.get_result()
+    if fresh:
+        memcache.set_multi(fresh, time=ESTIMATE_CACHE_TIME)
+    return counts
+
+
+def plan(model_cls, filters, default_order):
+    """Plan a query of model_cls for formatted filters; return a QueryPlan."""
+    equalities = [f for f in filters if f['operator'] == '=']
+    inequalities = [f for f in filters if f['operator'] not in ('=', '!=')]
+    notEquals = [f for f in filters if f['operator'] == '!=']
+
+    candidates = {}
+    for filtr in inequalities:
+        candidates.setdefault(filtr['field'], []).append(filtr)
+
+    estimates = {}
+    if len(candidates) > 1:
+        estimates = estimateCounts(model_cls, equalities, candidates,
+                                   default_order)
+        ordered = min(sorted(candidates), key=lambda field: estimates[field])
+    elif candidates:
+        ordered = candidates.keys()[0]
+    else:
+        ordered = None
+
+    pushed = equalities + candidates.get(ordered, [])
+    postFilters = [f for f in inequalities if f['field'] != ordered] + notEquals
+    return QueryPlan(_buildQuery(model_cls, pushed, ordered, default_order),
+                     pushed, postFilters, ordered, estimates)
+
+
+def fetchPage(queryPlan, pageSize, cursor=None, batch_size=None, max_scan=MAX_SCAN_PER_PAGE):
+    """Stream the plan's query from cursor, keeping entities that pass the
+    post-filter, until pageSize are found or max_scan were read.
+
+    Returns (entities, next cursor or None).  The cursor points just past
+    the last entity read, so a short page still resumes where it stopped.
+    """
+    if not queryPlan.postFilters:
+        items, next_cursor, more = queryPlan.query.fetch_page(
+            pageSize, start_cursor=cursor)
+        return items, (next_cursor if more else None)
+
+    it = queryPlan.query.iter(start_cursor=cursor, produce_cursors=True,
+                              batch_size=batch_size or max(pageSize * 2, 50))
+    items = []
+    scanned = 0
+    for entity in it:
+        scanned += 1
+        if queryPlan.matches(entity):
+            items.append(entity)
+        if len(items) >= pageSize or scanned >= max_scan:
+            break
+    else:
+        return items, None
+    return items, (it.cursor_after() if it.probably_has_next() else None)
@@ -0,0 +1,268 @@
+#!/usr/bin/env python
+
+"""search.py
+
+Token inverted index for searching conferences by their text.
+
+Each conference is one document, made of its name, topics, city and
+description and the names, speakers and highlights of its sessions.  The
+text is split into lowercase tokens scored by the fields they occur in,
+and stored as one posting per token keyed '<token> <doc id>', so every
+token starting with a prefix is one key range scan and a search costs
+the postings it matches, not the number of conferences.  Reindexing
+diffs against the terms stored for the document last time and writes
+only the postings that changed.
+
+Postings live behind a small backend: DatastoreBackend in production,
+MemoryBackend to test or benchmark in process (see setBackend()).
+
+"""
+
+import bisect
+import re
+import threading
+import time
+
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+from models import Conference
+from models import SearchDoc
+from models import SearchPosting
+from models import Session
+
+TOKEN_RE = re.compile(r'[^\W_]+', re.UNICODE)
+MAX_TOKEN_LENGTH = 40
+MAX_QUERY_TOKENS = 8
+MAX_POSTINGS_PER_PREFIX = 2000  # postings read per query token
+PREFIX_DISCOUNT = 0.5           # a longer token only sharing the prefix
+REINDEX_DELAY = 2               # seconds; reindexes of one doc coalesce
+REINDEX_BATCH = 50              # conferences per reindexAll task
+
+CONFERENCE_WEIGHTS = {
+    'name': 4.0,
+    'topics': 3.0,
+    'city': 2.0,
+    'description': 1.0,
+}
+
+SESSION_WEIGHTS = {
+    'sessionName': 1.0,
+    'speakerDisplayName': 1.0,
+    'highlights': 0.5,
+}
+
+# - - - Tokens - - - - - - - - - - - - - - - - - - - - - - - -
+
+def tokenize(text):
+    """Return the lowercase word tokens of text."""
+    if not text:
+        return []
+    if isinstance(text, str):
+        text = text.decode('utf-8', 'replace')
+    return [token[:MAX_TOKEN_LENGTH] for token in TOKEN_RE.findall(text.lower())]
+
+
+def addTerms(terms, entity, weights):
+    """Add each field's weight to terms once per token occurrence."""
+    for name, weight in weights.items():
+        value = getattr(entity, name, None)
+        for text in (value if isinstance(value, list) else [value]):
+            for token in tokenize(text):
+                terms[token] = terms.get(token, 0.0) + weight
+    return terms
+
+
+def conferenceTerms(conf, sessions=()):
+    """Return {token: score} for a conference and its sessions."""
+    terms = addTerms({}, conf, CONFERENCE_WEIGHTS)
+    for session in sessions:
+        addTerms(terms, session, SESSION_WEIGHTS)
+    return terms
+
+
+def postingId(token, doc_id):
+    return u'%s %s' % (token, doc_id)
+
+# - - - Backends - - - - - - - - - - - - - - - - - - - - - - -
+
+class DatastoreBackend(object):
+    """Postings as SearchPosting entities, term lists as SearchDocs."""
+
+    def getTerms(self, doc_id):
+        doc = ndb.Key(SearchDoc, doc_id).get()
+        return doc.terms if doc else None
+
+    def update(self, doc_id, terms, put, delete):
+        """Store terms for doc_id, writing put {token: score} and
+        deleting the delete tokens' postings."""
+        futures = ndb.put_multi_async(
+            [SearchPosting(id=postingId(token, doc_id), score=score)
+             for token, score in put.items()])
+        futures += ndb.delete_multi_async(
+            [ndb.Key(SearchPosting, postingId(token, doc_id)) for token in delete])
+        if terms:
+            futures.append(SearchDoc(id=doc_id, terms=terms).put_async())
+        else:
+            futures.append(ndb.Key(SearchDoc, doc_id).delete_async())
+        ndb.Future.wait_all(futures)
+
+    def scanPrefixes(self, prefixes, limit):
+        """Return {prefix: [(token, doc_id, score)]}, scanning in parallel."""
+        futures = {}
+        for prefix in prefixes:
+            futures[prefix] = SearchPosting.query(
+                SearchPosting.key >= ndb.Key(SearchPosting, prefix),
+                SearchPosting.key < ndb.Key(SearchPosting, prefix + u'\ufffd')
+            ).fetch_async(limit)
+        scans = {}
+        for prefix, future in futures.items():
+            scans[prefix] = [tuple(posting.key.id().split(' ', 1)) + (posting.score,)
+                             for posting in future.get_result()]
+        return scans
+
+
+class MemoryBackend(object):
+    """In-process backend: a sorted list of posting ids plus dicts."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ids = []
+        self._scores = {}
+        self._docs = {}
+
+    def getTerms(self, doc_id):
+        return self._docs.get(doc_id)
+
+    def update(self, doc_id, terms, put, delete):
+        with self._lock:
+            for token in delete:
+                pid = postingId(token, doc_id)
+                if self._scores.pop(pid, None) is not None:
+                    del self._ids[bisect.bisect_left(self._ids, pid)]
+            for token, score in put.items():
+                pid = postingId(token, doc_id)
+                if pid not in self._scores:
+                    bisect.insort(self._ids, pid)
+                self._scores[pid] = score
+            if terms:
+                self._docs[doc_id] = dict(terms)
+            else:
+                self._docs.pop(doc_id, None)
+
+    def scanPrefixes(self, prefixes, limit):
+        scans = {}
+        with self._lock:
+            for prefix in prefixes:
+                start = bisect.bisect_left(self._ids, prefix)
+                end = bisect.bisect_left(self._ids, prefix + u'\ufffd', start)
+                scans[prefix] = [tuple(pid.split(' ', 1)) + (self._scores[pid],)
+                                 for pid in self._ids[start:min(end, start + limit)]]
+        return scans
+
+
+_backend = DatastoreBackend()
+
+
+def setBackend(backend):
+    """Swap the index store, e.g. for a MemoryBackend; return the old one."""
+    global _backend
+    old, _backend = _backend, backend
+    return old
+
+# - - - Indexing - - - - - - - - - - - - - - - - - - - - - - -
+
+def updateDoc(doc_id, terms, backend=None):
+    """Make the index hold terms for doc_id, writing only the postings
+    that changed; return (postings written, postings deleted)."""
+    backend = backend or _backend
+    old = backend.getTerms(doc_id) or {}
+    put = dict((token, score) for token, score in terms.items()
+               if old.get(token) != score)
+    delete = [token for token in old if token not in terms]
+    if put or delete or (old and not terms):
+        backend.update(doc_id, terms, put, delete)
+    return len(put), len(delete)
+
+
+def reindexConference(conf_key, backend=None):
+    """Index a conference and its sessions as they are stored now; a
+    conference that no longer exists is removed from the index."""
+    conf_future = conf_key.get_async()
+    sessions = Session.query(ancestor=conf_key).fetch()
+    conf = conf_future.get_result()
+    terms = conferenceTerms(conf, sessions) if conf else {}
+    return updateDoc(conf_key.urlsafe(), terms, backend)
+
+
+def reindexTask(conf_key, countdown=REINDEX_DELAY, name=None):
+    """Return a task reindexing a conference."""
+    return taskqueue.Task(name=name,
+                          params={'websafeConferenceKey': conf_key.urlsafe()},
+                          url='/tasks/reindex_conference', countdown=countdown)
+
+
+def scheduleReindex(conf_key, transactional=False):
+    """Enqueue a reindex of a conference.  Outside transactions, one task
+    per conference per REINDEX_DELAY takes in every change made so far."""
+    if transactional:
+        reindexTask(conf_key).add(transactional=True)
+        return
+    try:
+        reindexTask(conf_key, name='reindex-%s-%d' % (
+            conf_key.urlsafe(), int(time.time() / REINDEX_DELAY))).add()
+    except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+        pass
+
+
+def reindexAll(cursor=None):
+    """Enqueue reindexes for a batch of conferences, chaining a task for
+    the next batch; used to build the index for existing data."""
+    conf_keys, next_cursor, more = Conference.query().fetch_page(
+        REINDEX_BATCH, keys_only=True,
+        start_cursor=ndb.Cursor(urlsafe=cursor) if cursor else None)
+    tasks = [reindexTask(conf_key, countdown=0) for conf_key in conf_keys]
+    if more and next_cursor:
+        tasks.append(taskqueue.Task(params={'cursor': next_cursor.urlsafe()},
+                                    url='/tasks/reindex_all'))
+    if tasks:
+        taskqueue.Queue().add(tasks)
+    return len(conf_keys)
+
+# - - - Searching - - - - - - - - - - - - - - - - - - - - - - -
+
+def search(query, backend=None):
+    """Return [(doc_id, score)] for docs matching every token of query as
+    a prefix, best first.
+
+    A doc scores, per query token, its best matching posting, discounted
+    unless the token matched whole.  Each token reads at most
+    MAX_POSTINGS_PER_PREFIX postings, so very short prefixes may miss docs.
+    """
+    backend = backend or _backend
+    tokens = []
+    for token in tokenize(query):
+        if token not in tokens:
+            tokens.append(token)
+    tokens = tokens[:MAX_QUERY_TOKENS]
+    if not tokens:
+        return []
+
+    scans = backend.scanPrefixes(tokens, MAX_POSTINGS_PER_PREFIX)
+    scores = None
+    # intersect from the rarest prefix, so the running set only shrinks
+    for prefix in sorted(tokens, key=lambda token: len(scans[token])):
+        matched = {}
+        for token, doc_id, score in scans[prefix]:
+            if scores is not None and doc_id not in scores:
+                continue
+            if token != prefix:
+                score *= PREFIX_DISCOUNT
+            matched[doc_id] = max(matched.get(doc_id, 0.0), score)
+        if scores is not None:
+            for doc_id in matched:
+                matched[doc_id] += scores[doc_id]
+        scores = matched
+        if not scores:
+            return []
+    return sorted(scores.items(), key=lambda item: (-item[1], item[0]))
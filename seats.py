@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+
+"""seats.py
+
+Sharded seat allocation for conference registration.
+
+A Conference's seats are split across SeatShard entities.  Every shard is
+a root entity, so registrations that land on different shards commit to
+different entity groups instead of serializing on the Conference.  The
+total is served from memcache, and Conference.seatsAvailable is written
+back by a deduplicated task at most once per SEATS_SYNC_INTERVAL.
+
+"""
+
+import random
+import time
+
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+import announcements
+from models import SeatShard
+
+NUM_SEAT_SHARDS = 20
+SEATS_SYNC_INTERVAL = 5     # seconds
+SEATS_CACHE_TIME = 60       # seconds
+MEMCACHE_SEATS_KEY = "SEATS_AVAILABLE:%s"
+
+# - - - Shard layout - - - - - - - - - - - - - - - - - - - - -
+
+def numShardsFor(maxAttendees):
+    """Return how many shards to use for a conference of the given size."""
+    return max(1, min(NUM_SEAT_SHARDS, maxAttendees or 0))
+
+
+def shardKeys(conf_key, num_shards):
+    """Return the SeatShard keys of a conference."""
+    wsck = conf_key.urlsafe()
+    return [ndb.Key(SeatShard, '%s:%d' % (wsck, i)) for i in range(num_shards)]
+
+
+def splitSeats(seats, num_shards):
+    """Split seats as evenly as possible into num_shards slices."""
+    base, extra = divmod(max(seats or 0, 0), num_shards)
+    return [base + (1 if i < extra else 0) for i in range(num_shards)]
+
+
+def newShards(conf_key, maxAttendees, seatsAvailable=None, num_shards=None):
+    """Return, unsaved, the seat shards of a conference that has none yet."""
+    if seatsAvailable is None:
+        seatsAvailable = maxAttendees
+    num_shards = num_shards or numShardsFor(maxAttendees)
+    return [SeatShard(key=key, conference=conf_key, capacity=capacity,
+                      seatsAvailable=min(seats, capacity))
+            for key, capacity, seats
+            in zip(shardKeys(conf_key, num_shards),
+                   splitSeats(maxAttendees, num_shards),
+                   splitSeats(seatsAvailable, num_shards))]
+
+
+def createShards(conf_key, maxAttendees, seatsAvailable=None, num_shards=None):
+    """Create the seat shards of a conference; return the number of shards.
+
+    Existing shards are left untouched, so it is safe to call this again
+    for a conference that was created before seats were sharded.
+    """
+    if seatsAvailable is None:
+        seatsAvailable = maxAttendees
+    num_shards = num_shards or numShardsFor(maxAttendees)
+    capacities = splitSeats(maxAttendees, num_shards)
+    available = splitSeats(seatsAvailable, num_shards)
+
+    futures = [SeatShard.get_or_insert_async(key.id(),
+                    conference=conf_key, capacity=capacity,
+                    seatsAvailable=min(seats, capacity))
+               for key, capacity, seats
+               in zip(shardKeys(conf_key, num_shards), capacities, available)]
+    ndb.Future.wait_all(futures)
+    memcache.set(MEMCACHE_SEATS_KEY % conf_key.urlsafe(),
+                 sum(f.get_result().seatsAvailable for f in futures),
+                 time=SEATS_CACHE_TIME)
+    return num_shards
+
+
+def ensureShards(conf):
+    """Make sure conf has seat shards, creating them from its current counts."""
+    if conf.seatShards or not conf.maxAttendees:
+        return conf
+
+    num_shards = createShards(conf.key, conf.maxAttendees, conf.seatsAvailable)
+
+    @ndb.transactional()
+    def _markSharded():
+        stored = conf.key.get()
+        if not stored.seatShards:
+            stored.seatShards = num_shards
+            stored.put()
+        return stored
+    return _markSharded()
+
+# - - - Allocation - - - - - - - - - - - - - - - - - - - - - -
+
+def pickShard(conf, reg=True):
+    """Return the key of a random shard that can take (reg) or give back
+    a seat, or None if there is no such shard."""
+    shards = [s for s in ndb.get_multi(shardKeys(conf.key, conf.seatShards)) if s]
+    if reg:
+        candidates = [s for s in shards if s.seatsAvailable > 0]
+    else:
+        candidates = [s for s in shards if s.seatsAvailable < s.capacity]
+    if not candidates:
+        return None
+    return random.choice(candidates).key
+
+
+def takeSeats(shard_key, count=1):
+    """Take up to count seats from a shard; return how many were taken.
+    Must be called inside a transaction."""
+    shard = shard_key.get()
+    taken = min(count, shard.seatsAvailable) if shard else 0
+    if taken > 0:
+        shard.seatsAvailable -= taken
+        shard.put()
+    return taken
+
+
+def returnSeats(shard_key, count=1):
+    """Give back up to count seats to a shard; return how many were returned.
+    Must be called inside a transaction."""
+    shard = shard_key.get()
+    returned = min(count, shard.capacity - shard.seatsAvailable) if shard else 0
+    if returned > 0:
+        shard.seatsAvailable += returned
+        shard.put()
+    return returned
+
+
+def seatsChanged(conf_key, delta):
+    """Record a committed change in seats on the cached total, and schedule
+    Conference.seatsAvailable to be brought up to date.  Returns the new
+    cached total, or None if it wasn't cached."""
+    key = MEMCACHE_SEATS_KEY % conf_key.urlsafe()
+    seats = None
+    if delta < 0:
+        seats = memcache.decr(key, -delta)
+    elif delta > 0:
+        seats = memcache.incr(key, delta)
+    scheduleSync(conf_key)
+    return seats
+
+# - - - Aggregated reads - - - - - - - - - - - - - - - - - - -
+
+def countSeats(conf_key, num_shards):
+    """Return the total of available seats summed over the shards."""
+    return sum(s.seatsAvailable
+               for s in ndb.get_multi(shardKeys(conf_key, num_shards)) if s)
+
+
+def getSeatsAvailable(conf):
+    """Return the available seats of conf, read through memcache."""
+    if not conf.seatShards:
+        return conf.seatsAvailable
+    key = MEMCACHE_SEATS_KEY % conf.key.urlsafe()
+    seats = memcache.get(key)
+    if seats is None:
+        seats = countSeats(conf.key, conf.seatShards)
+        memcache.add(key, seats, time=SEATS_CACHE_TIME)
+    return seats
+
+
+@ndb.tasklet
+def countSeatsAsync(conf):
+    """Tasklet summing the shards of conf and re-priming the cached total;
+    for callers that already found the total missing from memcache."""
+    if not conf.seatShards:
+        raise ndb.Return(conf.seatsAvailable)
+    shards = yield ndb.get_multi_async(shardKeys(conf.key, conf.seatShards))
+    seats = sum(s.seatsAvailable for s in shards if s)
+    yield ndb.get_context().memcache_add(MEMCACHE_SEATS_KEY % conf.key.urlsafe(),
+                                         seats, time=SEATS_CACHE_TIME)
+    raise ndb.Return(seats)
+
+# - - - Write-back - - - - - - - - - - - - - - - - - - - - - -
+
+def scheduleSync(conf_key):
+    """Enqueue one seat write-back per conference per SEATS_SYNC_INTERVAL."""
+    wsck = conf_key.urlsafe()
+    window = int(time.time() / SEATS_SYNC_INTERVAL)
+    try:
+        taskqueue.add(name='sync-seats-%s-%d' % (wsck, window),
+            params={'websafeConferenceKey': wsck},
+            url='/tasks/sync_seats',
+            countdown=SEATS_SYNC_INTERVAL,
+        )
+    except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+        pass
+
+
+def syncSeats(conf_key):
+    """Write the summed shard total back to Conference.seatsAvailable."""
+    conf = conf_key.get()
+    if not conf or not conf.seatShards:
+        return None
+    seats = countSeats(conf_key, conf.seatShards)
+    memcache.set(MEMCACHE_SEATS_KEY % conf_key.urlsafe(), seats,
+                 time=SEATS_CACHE_TIME)
+
+    @ndb.transactional()
+    def _writeBack():
+        stored = conf_key.get()
+        if stored.seatsAvailable != seats:
+            stored.seatsAvailable = seats
+            stored.put()
+    _writeBack()
+    # catches threshold crossings the registration saw no total for
+    announcements.seatsChanged(conf, seats)
+    return seats
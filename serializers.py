@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+
+"""serializers.py
+
+Precompiled ndb model -> ProtoRPC message serializers.
+
+register() works out, once at import time, which form fields come from
+which model properties and how each value is converted (dates, times,
+enums, keys).  serialize() then just runs that plan, with no all_fields(),
+hasattr() or per-field type checks per row; serializeAll() does a whole
+result list.
+
+"""
+
+from protorpc import messages
+from google.appengine.ext import ndb
+
+from models import Conference
+from models import ConferenceForm
+from models import Profile
+from models import ProfileForm
+from models import Session
+from models import SessionForm
+from models import SessionTypes
+from models import Speaker
+from models import SpeakerForm
+from models import TeeShirtSize
+
+_registry = {}
+
+# - - - Converters - - - - - - - - - - - - - - - - - - - - - -
+
+def websafeKey(entity):
+    return entity.key.urlsafe()
+
+
+def dateToString(value):
+    return str(value)
+
+
+def timeToString(value):
+    return value.strftime('%H:%M')
+
+
+def enumConverter(enum_type):
+    """Return a converter from a stored enum name to enum_type."""
+    def toEnum(value):
+        return enum_type(value)
+    return toEnum
+
+
+def firstOf(convert=None):
+    """Return a converter taking the first value of a repeated property."""
+    def first(values):
+        if not values:
+            return None
+        return convert(values[0]) if convert else values[0]
+    return first
+
+# - - - Plans - - - - - - - - - - - - - - - - - - - - - - - - -
+
+class FormPlan(object):
+    """FormPlan -- compiled copy plan from one model to one message"""
+
+    def __init__(self, model_cls, form_cls, converters=None, computed=None):
+        converters = converters or {}
+        computed = computed or {}
+        self.form_cls = form_cls
+        self.steps = []
+        self.computed = []
+        properties = model_cls._properties
+        for field in form_cls.all_fields():
+            name = field.name
+            if name in computed:
+                self.computed.append((name, computed[name]))
+            elif name in properties:
+                self.steps.append((name, properties[name]._code_name,
+                    converters.get(name) or
+                    self._defaultConverter(properties[name], field)))
+        self.needs_check = any(field.required for field in form_cls.all_fields())
+
+    @staticmethod
+    def _defaultConverter(prop, field):
+        """Pick the converter a property/field pair needs, if any."""
+        if isinstance(prop, ndb.TimeProperty):
+            convert = timeToString
+        elif isinstance(prop, (ndb.DateProperty, ndb.DateTimeProperty)):
+            convert = dateToString
+        elif isinstance(prop, ndb.KeyProperty):
+            convert = lambda key: key.urlsafe()
+        elif isinstance(field, messages.EnumField):
+            convert = enumConverter(field.type)
+        else:
+            convert = None
+        if prop._repeated and not field.repeated:
+            return firstOf(convert)
+        if convert and prop._repeated:
+            return lambda values: [convert(v) for v in values]
+        return convert
+
+    def serialize(self, entity):
+        """Return a form holding entity's fields."""
+        form = self.form_cls()
+        for name, code_name, convert in self.steps:
+            value = getattr(entity, code_name)
+            if value is not None and value != []:
+                setattr(form, name, convert(value) if convert else value)
+        for name, compute in self.computed:
+            value = compute(entity)
+            if value is not None:
+                setattr(form, name, value)
+        if self.needs_check:
+            form.check_initialized()
+        return form
+
+
+def register(model_cls, form_cls, converters=None, computed=None):
+    """Compile and register the plan copying model_cls into form_cls."""
+    plan = FormPlan(model_cls, form_cls, converters, computed)
+    _registry[(model_cls, form_cls)] = plan
+    return plan
+
+
+def getPlan(model_cls, form_cls):
+    """Return the registered plan for a (model, message) pair."""
+    try:
+        return _registry[(model_cls, form_cls)]
+    except KeyError:
+        raise KeyError('No serializer registered for %s -> %s'
+                       % (model_cls.__name__, form_cls.__name__))
+
+
+def serialize(entity, form_cls):
+    """Copy one entity into a new form_cls message."""
+    return getPlan(type(entity), form_cls).serialize(entity)
+
+
+def serializeAll(entities, form_cls):
+    """Copy a list of entities of one kind into form_cls messages."""
+    if not entities:
+        return []
+    plan = getPlan(type(entities[0]), form_cls)
+    return [plan.serialize(entity) for entity in entities]
+
+# - - - Registry - - - - - - - - - - - - - - - - - - - - - - -
+
+register(Conference, ConferenceForm,
+    computed={'websafeKey': websafeKey})
+
+register(Session, SessionForm,
+    converters={'typeOfSession': firstOf(enumConverter(SessionTypes))},
+    computed={'websafeKey': websafeKey,
+              'speakerUserId': lambda session: firstOf()(session.speaker) or ''})
+
+register(Speaker, SpeakerForm,
+    computed={'websafeKey': websafeKey})
+
+register(Profile, ProfileForm,
+    converters={'teeShirtSize': enumConverter(TeeShirtSize)})
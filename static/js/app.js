@@ -40,29 +40,6 @@ var app = angular.module('conferenceApp',
                 });
         }]);
 
-/**
- * @ngdoc filter
- * @name startFrom
- *
- * @description
- * A filter that extracts an array from the specific index.
- *
- */
-app.filter('startFrom', function () {
-    /**
-     * Extracts an array from the specific index.
-     *
-     * @param {Array} data
-     * @param {Integer} start
-     * @returns {Array|*}
-     */
-    var filter = function (data, start) {
-        return data.slice(start);
-    }
-    return filter;
-});
-
-
 /**
  * @ngdoc constant
  * @name HTTP_ERRORS
@@ -341,18 +341,79 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
 
     /**
      * Namespace for the pagination.
+     * Pages are fetched from the server one at a time: pageTokens[i] is the pageToken of page i,
+     * and a page that comes back with a nextPageToken makes the page after it known.
      * @type {{}|*}
      */
     $scope.pagination = $scope.pagination || {};
     $scope.pagination.currentPage = 0;
     $scope.pagination.pageSize = 20;
+    $scope.pagination.pageTokens = [undefined];
+    $scope.pagination.load = null;
+
+    /**
+     * Starts paging from the first page.
+     *
+     * @param load function (pageToken, page) fetching a page, or null if the results come in one page.
+     */
+    $scope.pagination.start = function (load) {
+        $scope.pagination.currentPage = 0;
+        $scope.pagination.pageTokens = [undefined];
+        $scope.pagination.load = load;
+        if (load) {
+            load(undefined, 0);
+        }
+    };
+
+    /**
+     * Records the page the server has returned and the token of the page after it, if any.
+     *
+     * @param page the number of the page, from 0.
+     * @param nextPageToken the nextPageToken of the response.
+     */
+    $scope.pagination.loaded = function (page, nextPageToken) {
+        $scope.pagination.currentPage = page;
+        if (nextPageToken) {
+            $scope.pagination.pageTokens[page + 1] = nextPageToken;
+        } else {
+            $scope.pagination.pageTokens.length = page + 1;
+        }
+    };
+
+    /**
+     * Fetches a page known to exist.
+     *
+     * @param page the number of the page, from 0.
+     */
+    $scope.pagination.goTo = function (page) {
+        if ($scope.pagination.load && page != $scope.pagination.currentPage &&
+            page >= 0 && page < $scope.pagination.numberOfPages()) {
+            $scope.pagination.load($scope.pagination.pageTokens[page], page);
+        }
+    };
+
     /**
-     * Returns the number of the pages in the pagination.
+     * Returns the request parameters for a page of pagination.pageSize items.
+     *
+     * @param params the other request parameters.
+     * @param pageToken the pageToken of the page, or undefined for the first one.
+     * @returns {Object}
+     */
+    $scope.pagination.params = function (params, pageToken) {
+        var pageParams = angular.extend({pageSize: $scope.pagination.pageSize}, params);
+        if (pageToken) {
+            pageParams.pageToken = pageToken;
+        }
+        return pageParams;
+    };
+
+    /**
+     * Returns the number of the pages known so far.
      *
      * @returns {number}
      */
     $scope.pagination.numberOfPages = function () {
-        return Math.ceil($scope.conferences.length / $scope.pagination.pageSize);
+        return $scope.pagination.pageTokens.length;
     };
 
     /**
@@ -440,69 +501,69 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
                 });
             }
         }
-        $scope.loading = true;
-        gapi.client.conference.queryConferences(sendFilters).
-            execute(function (resp) {
-                $scope.$apply(function () {
-                    $scope.loading = false;
-                    if (resp.error) {
-                        // The request has failed.
-                        var errorMessage = resp.error.message || '';
-                        $scope.messages = 'Failed to query conferences : ' + errorMessage;
-                        $scope.alertStatus = 'warning';
-                        $log.error($scope.messages + ' filters : ' + JSON.stringify(sendFilters));
-                    } else {
-                        // The request has succeeded.
-                        $scope.submitted = false;
-                        $scope.messages = 'Query succeeded : ' + JSON.stringify(sendFilters);
-                        $scope.alertStatus = 'success';
-                        $log.info($scope.messages);
+        $scope.pagination.start(function (pageToken, page) {
+            $scope.loading = true;
+            gapi.client.conference.queryConferences($scope.pagination.params(sendFilters, pageToken)).
+                execute(function (resp) {
+                    $scope.$apply(function () {
+                        $scope.loading = false;
+                        if (resp.error) {
+                            // The request has failed.
+                            var errorMessage = resp.error.message || '';
+                            $scope.messages = 'Failed to query conferences : ' + errorMessage;
+                            $scope.alertStatus = 'warning';
+                            $log.error($scope.messages + ' filters : ' + JSON.stringify(sendFilters));
+                        } else {
+                            // The request has succeeded.
+                            $scope.submitted = false;
+                            $scope.messages = 'Query succeeded : ' + JSON.stringify(sendFilters);
+                            $scope.alertStatus = 'success';
+                            $log.info($scope.messages);
 
-                        $scope.conferences = [];
-                        angular.forEach(resp.items, function (conference) {
-                            $scope.conferences.push(conference);
-                        });
-                    }
-                    $scope.submitted = true;
+                            $scope.conferences = resp.items || [];
+                            $scope.pagination.loaded(page, resp.nextPageToken);
+                        }
+                        $scope.submitted = true;
+                    });
                 });
-            });
+        });
     }
 
     /**
      * Invokes the conference.getConferencesCreated method.
      */
     $scope.getConferencesCreated = function () {
-        $scope.loading = true;
-        gapi.client.conference.getConferencesCreated().
-            execute(function (resp) {
-                $scope.$apply(function () {
-                    $scope.loading = false;
-                    if (resp.error) {
-                        // The request has failed.
-                        var errorMessage = resp.error.message || '';
-                        $scope.messages = 'Failed to query the conferences created : ' + errorMessage;
-                        $scope.alertStatus = 'warning';
-                        $log.error($scope.messages);
+        $scope.pagination.start(function (pageToken, page) {
+            $scope.loading = true;
+            gapi.client.conference.getConferencesCreated($scope.pagination.params({}, pageToken)).
+                execute(function (resp) {
+                    $scope.$apply(function () {
+                        $scope.loading = false;
+                        if (resp.error) {
+                            // The request has failed.
+                            var errorMessage = resp.error.message || '';
+                            $scope.messages = 'Failed to query the conferences created : ' + errorMessage;
+                            $scope.alertStatus = 'warning';
+                            $log.error($scope.messages);
 
-                        if (resp.code && resp.code == HTTP_ERRORS.UNAUTHORIZED) {
-                            oauth2Provider.showLoginModal();
-                            return;
-                        }
-                    } else {
-                        // The request has succeeded.
-                        $scope.submitted = false;
-                        $scope.messages = 'Query succeeded : Conferences you have created';
-                        $scope.alertStatus = 'success';
-                        $log.info($scope.messages);
+                            if (resp.code && resp.code == HTTP_ERRORS.UNAUTHORIZED) {
+                                oauth2Provider.showLoginModal();
+                                return;
+                            }
+                        } else {
+                            // The request has succeeded.
+                            $scope.submitted = false;
+                            $scope.messages = 'Query succeeded : Conferences you have created';
+                            $scope.alertStatus = 'success';
+                            $log.info($scope.messages);
 
-                        $scope.conferences = [];
-                        angular.forEach(resp.items, function (conference) {
-                            $scope.conferences.push(conference);
-                        });
-                    }
-                    $scope.submitted = true;
+                            $scope.conferences = resp.items || [];
+                            $scope.pagination.loaded(page, resp.nextPageToken);
+                        }
+                        $scope.submitted = true;
+                    });
                 });
-            });
+        });
     };
 
     /**
@@ -510,6 +571,7 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
      * invokes the conference.getConference method n times where n == the number of the conferences to attend.
      */
     $scope.getConferencesAttend = function () {
+        $scope.pagination.start(null);
         $scope.loading = true;
         gapi.client.conference.getConferencesToAttend().
             execute(function (resp) {
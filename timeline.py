@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+
+"""timeline.py
+
+Materialized, time-sorted session timeline of each conference.
+
+A conference's SessionForms, sorted by date, start time and name, are
+kept encoded as one blob: in memcache, and in a SessionTimeline entity
+in the conference's entity group as the fallback.  Every transaction
+that writes sessions bumps the timeline's version, which marks the
+stored blob stale, and on commit deletes the memcache copy with a short
+lock so a reader that built the old version can't put it back.  The
+next read rebuilds the blob from one ancestor query.
+
+Session listings, e.g. by type, are filters of the decoded timeline, so
+a whole schedule is one cache fetch.
+
+"""
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+from protorpc import protojson
+
+from models import Session
+from models import SessionForm
+from models import SessionForms
+from models import SessionTimeline
+import serializers
+
+MEMCACHE_TIMELINE_KEY = "SESSION_TIMELINE:%s"
+TIMELINE_CACHE_TIME = 3600      # seconds
+TIMELINE_LOCK_TIME = 2          # seconds stale readers are kept out after a write
+
+
+def timelineKey(conf_key):
+    return ndb.Key(SessionTimeline, 1, parent=conf_key)
+
+
+def sortKey(form):
+    return (form.sessionDate or '', form.startTime or '', form.sessionName or '')
+
+# - - - Writing - - - - - - - - - - - - - - - - - - - - - - - -
+
+@ndb.tasklet
+def bumpAsync(conf_key):
+    """Tasklet marking a conference's timeline stale; call it in the
+    transaction that writes the sessions."""
+    key = timelineKey(conf_key)
+    timeline = (yield key.get_async()) or SessionTimeline(key=key, version=0)
+    timeline.version += 1
+    timeline.blob = None
+    yield timeline.put_async()
+    ndb.get_context().call_on_commit(lambda: memcache.delete(
+        MEMCACHE_TIMELINE_KEY % conf_key.urlsafe(), seconds=TIMELINE_LOCK_TIME))
+    raise ndb.Return(timeline.version)
+
+
+@ndb.tasklet
+def _buildAsync(conf_key, timeline):
+    """Tasklet encoding the sessions of a conference as a timeline blob;
+    stores it on the entity unless a write bumped the version meanwhile."""
+    sessions = yield Session.query(ancestor=conf_key).fetch_async()
+    forms = sorted(serializers.serializeAll(sessions, SessionForm), key=sortKey)
+    blob = protojson.encode_message(SessionForms(items=forms))
+
+    version = timeline.version if timeline else 0
+
+    @ndb.tasklet
+    def _store():
+        stored = yield timelineKey(conf_key).get_async()
+        if (stored.version if stored else 0) == version:
+            yield SessionTimeline(key=timelineKey(conf_key), version=version,
+                                  blob=blob).put_async()
+    yield ndb.transaction_async(_store)
+    raise ndb.Return(blob)
+
+# - - - Reading - - - - - - - - - - - - - - - - - - - - - - - -
+
+@ndb.tasklet
+def getBlobAsync(conf_key):
+    """Tasklet returning the encoded timeline of a conference, from
+    memcache, the stored entity, or rebuilt."""
+    ctx = ndb.get_context()
+    cache_key = MEMCACHE_TIMELINE_KEY % conf_key.urlsafe()
+    blob = yield ctx.memcache_get(cache_key)
+    if blob is None:
+        timeline = yield timelineKey(conf_key).get_async()
+        if timeline and timeline.blob:
+            blob = timeline.blob
+        else:
+            blob = yield _buildAsync(conf_key, timeline)
+        # fails while a writer's delete lock holds, as it should
+        yield ctx.memcache_add(cache_key, blob, time=TIMELINE_CACHE_TIME)
+    raise ndb.Return(blob)
+
+
+@ndb.tasklet
+def getSessionsAsync(conf_key):
+    """Tasklet returning the conference's SessionForms, sorted by time."""
+    blob = yield getBlobAsync(conf_key)
+    raise ndb.Return(protojson.decode_message(SessionForms, blob).items)
+
+# - - - Views - - - - - - - - - - - - - - - - - - - - - - - - -
+
+def ofType(forms, typeOfSession):
+    """Return the forms of sessions of a SessionTypes value."""
+    return [form for form in forms if form.typeOfSession == typeOfSession]
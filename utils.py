@@ -1,11 +1,59 @@
+import collections
 import json
 import os
+import threading
 import time
 import uuid
 
+import endpoints
 from google.appengine.api import urlfetch
 from models import Profile
 
+from settings import WEB_CLIENT_ID
+from settings import ANDROID_CLIENT_ID
+from settings import IOS_CLIENT_ID
+from settings import ANDROID_AUDIENCE
+
+ID_TOKEN_AUDIENCES = (WEB_CLIENT_ID, ANDROID_CLIENT_ID, IOS_CLIENT_ID,
+                      ANDROID_AUDIENCE, endpoints.API_EXPLORER_CLIENT_ID)
+
+class LRUCache(object):
+    """Bounded, thread-safe LRU mapping whose entries expire, at a time
+    given per entry or ttl seconds after they are set."""
+
+    def __init__(self, size, ttl=None):
+        self.size = size
+        self.ttl = ttl
+        self._items = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, now=None):
+        now = now or time.time()
+        with self._lock:
+            item = self._items.pop(key, None)
+            if item is None or item[0] <= now:
+                return None
+            self._items[key] = item
+            return item[1]
+
+    def set(self, key, value, expires=None):
+        if expires is None:
+            expires = time.time() + self.ttl
+        with self._lock:
+            self._items.pop(key, None)
+            self._items[key] = (expires, value)
+            while len(self._items) > self.size:
+                self._items.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            self._items.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
 def getUserId(user, id_type="email"):
     if id_type == "email":
         return user.email()
@@ -14,21 +62,35 @@ def getUserId(user, id_type="email"):
         """A workaround implementation for getting userid."""
         auth = os.getenv('HTTP_AUTHORIZATION')
         bearer, token = auth.split()
-        token_type = 'id_token'
-        if 'OAUTH_USER_ID' in os.environ:
-            token_type = 'access_token'
+        import idtoken  # not at the top: idtoken uses LRUCache from here
+
+        # ID tokens are verified locally against cached Google certs;
+        # tokeninfo would only turn a bad one into an empty user ID
+        if 'OAUTH_USER_ID' not in os.environ and idtoken.looksLikeJwt(token):
+            try:
+                return idtoken.verifyIdToken(token, ID_TOKEN_AUDIENCES)['sub']
+            except idtoken.InvalidTokenError as e:
+                raise endpoints.UnauthorizedException('Invalid ID token: %s' % e)
+
+        # access tokens are opaque; ask tokeninfo, but only once per token
+        token_hash = idtoken.tokenHash(token)
+        user = idtoken.getCachedClaims(token_hash)
+        if user is not None:
+            return user.get('user_id', '')
+
         url = ('https://www.googleapis.com/oauth2/v1/tokeninfo?%s=%s'
-               % (token_type, token))
+               % ('access_token', token))
         user = {}
         wait = 1
         for i in range(3):
             resp = urlfetch.fetch(url)
             if resp.status_code == 200:
                 user = json.loads(resp.content)
+                user['exp'] = time.time() + int(user.get('expires_in', 0))
+                idtoken.cacheClaims(token_hash, user)
+                break
+            elif resp.status_code == 400:
                 break
-            elif resp.status_code == 400 and 'invalid_token' in resp.content:
-                url = ('https://www.googleapis.com/oauth2/v1/tokeninfo?%s=%s'
-                       % ('access_token', token))
             else:
                 time.sleep(wait)
                 wait = wait + i